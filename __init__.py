@@ -1,8 +1,21 @@
 import os
+import json
+import functools
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import Future
+from werkzeug.datastructures import MultiDict
 from werkzeug.routing import PathConverter
-from flask import (Flask, redirect, render_template,
+from flask import (Flask, Response, abort, jsonify, redirect, render_template,
                    request, send_from_directory, url_for) # type: ignore
-from .lookup import lookup_word, lookup_random_word, LookupResultVariants, LookupResultRhymes
+from .lookup import (lookup_word, lookup_word_stream, lookup_words, lookup_random_word, load_rhyme_index, load_mapped_index,
+                     use_read_only_db, forget_inherited_connections, LookupResult, LookupResultVariants, LookupResultRhymes, RhymeFilter)
+from .morphology.features import morph_features, features_to_mask
+from .data.data_model import max_neighbour_distance
+from .lookup_cache import LookupCache, RandomResultPool
+from .lookup_executor import LookupExecutor, LookupOverloaded
+from .lookup_metrics import LookupMetrics, StageTimings, current_timings, timed_stage
 
 class Query(PathConverter):
    regex = ".*?" # everything PathConverter accepts but also leading slashes
@@ -10,6 +23,123 @@ class Query(PathConverter):
 app = Flask(__name__)
 app.url_map.converters["query"] = Query
 
+# RIFMUJ_MEMORY_INDEX=1 serves lookups from memory, falling back to the db if it can't be loaded;
+# RIFMUJ_MEMORY_INDEX=required fails to start instead of falling back
+memory_index_mode = os.environ.get("RIFMUJ_MEMORY_INDEX", "")
+if memory_index_mode in ("1", "required"):
+   loaded_index = load_rhyme_index(fallback_to_sql=memory_index_mode != "required")
+   if loaded_index is not None:
+      app.logger.warning("Loaded the rhyme index: %s", loaded_index)
+   else:
+      app.logger.warning("Could not load the rhyme index, querying the db instead")
+
+# RIFMUJ_MAPPED_INDEX=1 serves lookups from the file written by `db_generation.py --mapped-index`
+# (RIFMUJ_MAPPED_INDEX_FILE), which the processes map and share instead of loading it,
+# falling back to the db if it can't be opened; RIFMUJ_MAPPED_INDEX=required fails to start instead
+mapped_index_mode = os.environ.get("RIFMUJ_MAPPED_INDEX", "")
+if mapped_index_mode in ("1", "required"):
+   mapped_index = load_mapped_index(fallback_to_sql=mapped_index_mode != "required")
+   if mapped_index is not None:
+      app.logger.warning("Opened the rhyme index: %s", mapped_index)
+   else:
+      app.logger.warning("Could not open the rhyme index file, querying the db instead")
+
+# RIFMUJ_READ_ONLY_DB=1 queries the db through read-only connections tuned with
+# RIFMUJ_DB_MMAP_SIZE (bytes), RIFMUJ_DB_CACHE_SIZE (KiB per connection)
+# and RIFMUJ_DB_IMMUTABLE=1 (only if the db is rebuilt with --bulk), see `data/serving.py`
+if os.environ.get("RIFMUJ_READ_ONLY_DB") == "1":
+   warm_up_seconds = use_read_only_db(
+      mmap_size=int(os.environ.get("RIFMUJ_DB_MMAP_SIZE", 256 * 2**20)),
+      cache_size_kib=int(os.environ.get("RIFMUJ_DB_CACHE_SIZE", 64 * 2**10)),
+      immutable=os.environ.get("RIFMUJ_DB_IMMUTABLE") == "1"
+   )
+   app.logger.warning("Opened the db read-only, warmed up in %.2f s", warm_up_seconds)
+
+# RIFMUJ_LOOKUP_CACHE_SIZE is the number of lookup results kept in memory
+lookup_cache = LookupCache(lookup_word, max_size=int(os.environ.get("RIFMUJ_LOOKUP_CACHE_SIZE", 10_000)))
+
+# RIFMUJ_LOOKUP_WORKERS lookups run at once, RIFMUJ_LOOKUP_QUEUE lookups may wait for a worker,
+# the others get 503; RIFMUJ_LOOKUP_POOL=process runs them in processes instead of threads
+lookup_executor = LookupExecutor(
+   max_workers=int(os.environ.get("RIFMUJ_LOOKUP_WORKERS", os.cpu_count() or 1)),
+   max_pending=int(os.environ.get("RIFMUJ_LOOKUP_QUEUE", 64)),
+   use_processes=os.environ.get("RIFMUJ_LOOKUP_POOL", "thread") == "process",
+   initializer=forget_inherited_connections
+)
+
+def cached_lookup(query: str, limit: Optional[int], cursor: int, rhyme_filter: RhymeFilter) -> LookupResult:
+   """Runs in the lookup executor; with processes, every process has its own cache."""
+   return lookup_cache(query, limit, cursor, rhyme_filter)
+
+# RIFMUJ_STREAM_BUFFER is the number of lines a streamed lookup may produce ahead of a slow client
+stream_buffer = int(os.environ.get("RIFMUJ_STREAM_BUFFER", 64))
+
+class ExecutorStream:
+   """The NDJSON lines of the lookup pieces, produced by a thread of `lookup_executor`
+   which waits while `stream_buffer` lines are not sent yet.
+   Raises `LookupOverloaded` right away like the other lookups.
+   A generator can't be sent to another process, so with processes the lines are produced
+   by the thread which sends them, and only take a pending slot of the executor.
+   """
+
+   def __init__(self, make_pieces: Callable[[], Iterable[Any]]) -> None:
+      self.make_pieces = make_pieces
+      self.lines: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=stream_buffer)
+      self.stopped = threading.Event()
+      self.produced: Optional["Future[None]"] = None
+      if lookup_executor.use_processes:
+         lookup_executor.acquire()
+      else:
+         self.produced = lookup_executor.submit(self.produce)
+
+   def produce(self) -> None:
+      try:
+         for line in ndjson_lines(self.make_pieces()):
+            if self.stopped.is_set():
+               return
+            self.lines.put(line)
+      finally:
+         if not self.stopped.is_set():
+            self.lines.put(None)
+
+   def __iter__(self) -> Iterator[str]:
+      if self.produced is None:
+         yield from ndjson_lines(self.make_pieces())
+         return
+      line = self.lines.get()
+      while line is not None:
+         yield line
+         line = self.lines.get()
+      self.produced.result()  # raises the error of the lookup, if any
+
+   def close(self) -> None:
+      """Called by the server when the response is done, or the client is gone."""
+      if self.stopped.is_set():
+         return
+      self.stopped.set()
+      if self.produced is None:
+         lookup_executor.release(None)
+         return
+      # the producer stops, and the line it waits to put is dropped
+      while not self.lines.empty():
+         self.lines.get_nowait()
+
+# RIFMUJ_PAGE_SIZE is the default number of rhyming lemmas per page, 0 shows all of them
+page_size = int(os.environ.get("RIFMUJ_PAGE_SIZE", 0))
+
+# RIFMUJ_BATCH_MAX_WORDS is the maximum number of words of a batch lookup
+batch_max_words = int(os.environ.get("RIFMUJ_BATCH_MAX_WORDS", 1000))
+
+# RIFMUJ_RANDOM_POOL_SIZE is the number of random lookup results prepared in the background
+random_pool_size = int(os.environ.get("RIFMUJ_RANDOM_POOL_SIZE", 0))
+random_lookup: Callable[[], LookupResult] = functools.partial(lookup_executor, functools.partial(lookup_random_word, page_size or None))
+if random_pool_size > 0:
+   random_lookup = RandomResultPool(random_lookup, random_pool_size)
+
+# the stages of the lookup requests are timed, see `lookup_metrics.py`
+lookup_metrics = LookupMetrics()
+timed_endpoints = {"results", "api_lookup", "api_lookup_batch", "random"}
+
 from flask import g
 
 def bool_arg(value: str) -> bool:
@@ -31,17 +161,169 @@ def results():
    if not word:
       return redirect(url_for("index"))
    
-   result = lookup_word(word)
+   limit, cursor = page_args(request.args)
+   try:
+      rhyme_filter = filter_args(request.args)
+   except ValueError:
+      abort(400)
+   with timed_stage("lookup"):
+      result = lookup_executor(cached_lookup, word, limit, cursor, rhyme_filter)
    
    if isinstance(result, LookupResultVariants):
-      return render_template("variants.html", variants=result.variants, input_word=result.prettified_input_word)
+      with timed_stage("render"):
+         return render_template("variants.html", variants=result.variants, input_word=result.prettified_input_word)
+   else:
+      return render_rhymes(result, limit or 0)
+
+@app.route("/api/lookup")
+def api_lookup():
+   """The lookup result as JSON or, with stream=true, as NDJSON:
+   the first line is the result without rhymes, each next line is a rhyming lemma.
+   """
+   try:
+      word, stream, limit, cursor, rhyme_filter = lookup_api_args(request.args)
+   except ValueError as error:
+      return jsonify(error=str(error)), 400
+   
+   if stream:
+      lines = ExecutorStream(functools.partial(lookup_word_stream, word, limit, cursor, rhyme_filter))
+      return Response(lines, mimetype="application/x-ndjson")
    else:
-      return render_template("rhymes.html", rhymes=result.rhymes, input_word=result.prettified_input_word)
+      with timed_stage("lookup"):
+         result = lookup_executor(cached_lookup, word, limit, cursor, rhyme_filter)
+      return jsonify(result.to_dict())
+
+@app.route("/api/lookup/batch", methods=["POST"])
+def api_lookup_batch():
+   """The lookup results of the words of the JSON body {"words": [...]}, in the same order.
+   Takes the same query arguments as /api/lookup, except for the cursor.
+   """
+   try:
+      words, limit, rhyme_filter = batch_api_args(request.args, request.get_json(silent=True))
+   except TooManyWords as error:
+      return jsonify(error=str(error)), 413
+   except ValueError as error:
+      return jsonify(error=str(error)), 400
+   
+   with timed_stage("lookup"):
+      results = lookup_executor(lookup_words, words, limit, rhyme_filter)
+   return jsonify(results=[result.to_dict() for result in results])
+
+@app.errorhandler(LookupOverloaded)
+def overloaded(error):
+   headers = {"Retry-After": "1"}
+   if request.path.startswith("/api/"):
+      return jsonify(error=str(error)), 503, headers
+   return "The server is too busy, please try again later", 503, headers
+
+# The argument parsing below is shared with `asgi.py`.
+
+class TooManyWords(ValueError):
+   pass
+
+def lookup_api_args(args: MultiDict) -> Tuple[str, bool, Optional[int], int, RhymeFilter]:
+   """The word, the stream flag, the page and the filter of an /api/lookup request."""
+   word: str = args.get("word", default="")
+   if not word:
+      raise ValueError("The word argument is required")
+   try:
+      stream = bool_arg(args.get("stream", default=""))
+   except ValueError:
+      raise ValueError("The stream argument must be true or false")
+   limit, cursor = page_args(args)
+   return word, stream, limit, cursor, filter_args(args)
+
+def batch_api_args(args: MultiDict, body: Any) -> Tuple[List[str], Optional[int], RhymeFilter]:
+   """The words, the limit and the filter of an /api/lookup/batch request."""
+   words = body.get("words") if isinstance(body, dict) else None
+   if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+      raise ValueError('The body must be {"words": [...]}')
+   if len(words) > batch_max_words:
+      raise TooManyWords(f"At most {batch_max_words} words are allowed")
+   limit, _ = page_args(args)
+   return words, limit, filter_args(args)
+
+def page_args(args: MultiDict) -> Tuple[Optional[int], int]:
+   """The limit (None for no limit) and the cursor of the requested page of rhymes."""
+   limit = args.get("limit", default=page_size, type=int)
+   cursor = args.get("cursor", default=0, type=int)
+   return (limit if limit > 0 else None), max(cursor, 0)
+
+# both the codes and the dictionary abbreviations of the parts of speech are accepted
+parts_of_speech = {**{code: code for code in morph_features["часть речи"].values()}, **morph_features["часть речи"]}
+
+def filter_args(args: MultiDict) -> RhymeFilter:
+   """The filter of the rhyming words: a regex for their `ending` (see `lookup.safe_ending_regex`),
+   a comma-separated list of their parts of speech `pos`, e.g. "Nn,Ad" or "сущ,прл",
+   and the distance `near` of the other basic rhymes to look in.
+   """
+   ending = args.get("ending", default="")
+   pos = [p.strip() for p in args.get("pos", default="").split(",") if p.strip()]
+   unknown = [p for p in pos if p not in parts_of_speech]
+   if unknown:
+      raise ValueError(f"Unknown parts of speech: {', '.join(unknown)}")
+   near = args.get("near", default=0, type=int)
+   if not 0 <= near <= max_neighbour_distance:
+      raise ValueError(f"near must be between 0 and {max_neighbour_distance}")
+   rhyme_filter = RhymeFilter(ending, features_to_mask(parts_of_speech[p] for p in pos), near)
+   rhyme_filter.ending_pattern  # raises ValueError for the unsafe endings
+   return rhyme_filter
+
+def ndjson_lines(pieces: Iterable) -> Iterable[str]:
+   for piece in pieces:
+      line: Dict[str, Any]
+      if isinstance(piece, LookupResultRhymes):
+         line = {"input_word": piece.prettified_input_word}
+      elif isinstance(piece, LookupResultVariants):
+         line = piece.to_dict()
+      else:
+         line = {"lemma": [form.to_dict() for form in piece]}
+      yield json.dumps(line, ensure_ascii=False) + "\n"
 
 @app.route("/random")
 def random():
-   result = lookup_random_word()
-   return render_template("rhymes.html", rhymes=result.rhymes, input_word=result.prettified_input_word)
+   with timed_stage("lookup"):
+      result = random_lookup()
+   return render_rhymes(result, page_size)
+
+def render_rhymes(result: LookupResultRhymes, limit: int):
+   # the next page link and the filter form keep the filter
+   active_filters = {name: request.args[name] for name in ("ending", "pos", "near") if request.args.get(name)}
+   with timed_stage("render"):
+      return render_template("rhymes.html", rhymes=result.rhymes, input_word=result.prettified_input_word,
+                             lemma_count=result.lemma_count, next_cursor=result.next_cursor, limit=limit,
+                             active_filters=active_filters)
+
+@app.route("/stats")
+def stats():
+   return jsonify(lookup_cache=lookup_cache.stats.to_dict(), lookup_executor=lookup_executor.stats())
+
+@app.route("/metrics")
+def metrics():
+   """The stage timings of the lookup requests in the Prometheus text format."""
+   return Response(lookup_metrics.to_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.before_request
+def start_timings():
+   if request.endpoint in timed_endpoints:
+      g.stage_timings = StageTimings()
+      g.stage_timings_token = current_timings.set(g.stage_timings)
+
+@app.after_request
+def add_server_timing(response):
+   # a streamed response is timed until its body starts
+   timings = g.pop("stage_timings", None)
+   if timings is not None:
+      timings.finish()
+      response.headers["Server-Timing"] = timings.server_timing()
+      lookup_metrics.record(request.path, timings)
+   return response
+
+@app.teardown_request
+def stop_timings(_):
+   token = g.pop("stage_timings_token", None)
+   if token is not None:
+      current_timings.reset(token)
 
 @app.errorhandler(404)
 def page_not_found(_):
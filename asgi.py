@@ -0,0 +1,222 @@
+"""An ASGI app for serving the site with an asyncio server, e.g.
+
+    uvicorn rifmuj.asgi:asgi_app
+
+The lookup API is served by coroutines which await the lookups
+running in the bounded `lookup_executor`, so the event loop keeps serving
+other requests while a huge bucket is being scored.
+Everything else is passed to the Flask app, which runs in a thread.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import functools
+import io
+import json
+import sys
+import threading
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MultiDict
+from . import (app, lookup_executor, lookup_metrics, cached_lookup, lookup_api_args, batch_api_args,
+    ndjson_lines, stream_buffer, TooManyWords)
+from .lookup import lookup_word_stream, lookup_words
+from .lookup_executor import LookupOverloaded
+from .lookup_metrics import StageTimings, current_timings, timed_stage
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+Headers = List[Tuple[bytes, bytes]]
+
+async def asgi_app(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    api_route = api_routes.get((scope['method'], scope['path']))
+    if api_route is None:
+        await call_flask(scope, receive, send)
+        return
+    args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+    timings = StageTimings()
+    token = current_timings.set(timings)
+    try:
+        await api_route(args, await read_body(receive), send)
+    except LookupOverloaded as error:
+        await send_json(send, 503, {'error': str(error)}, [(b'retry-after', b'1')])
+    finally:
+        current_timings.reset(token)
+    lookup_metrics.record(scope['path'], timings)
+
+async def lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            lookup_executor.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def api_lookup(args: MultiDict, body: bytes, send: Send) -> None:
+    """The same as the /api/lookup route of the Flask app."""
+    try:
+        word, stream, limit, cursor, rhyme_filter = lookup_api_args(args)
+    except ValueError as error:
+        await send_json(send, 400, {'error': str(error)})
+        return
+    if stream:
+        await send_stream(send, functools.partial(lookup_word_stream, word, limit, cursor, rhyme_filter))
+    else:
+        with timed_stage('lookup'):
+            result = await lookup_executor.run(cached_lookup, word, limit, cursor, rhyme_filter)
+        await send_json(send, 200, result.to_dict())
+
+async def api_lookup_batch(args: MultiDict, body: bytes, send: Send) -> None:
+    """The same as the /api/lookup/batch route of the Flask app."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    try:
+        words, limit, rhyme_filter = batch_api_args(args, data)
+    except TooManyWords as error:
+        await send_json(send, 413, {'error': str(error)})
+        return
+    except ValueError as error:
+        await send_json(send, 400, {'error': str(error)})
+        return
+    with timed_stage('lookup'):
+        results = await lookup_executor.run(lookup_words, words, limit, rhyme_filter)
+    await send_json(send, 200, {'results': [result.to_dict() for result in results]})
+
+api_routes: Dict[Tuple[str, str], Callable[[MultiDict, bytes, Send], Awaitable[None]]] = {
+    ('GET', '/api/lookup'): api_lookup,
+    ('POST', '/api/lookup/batch'): api_lookup_batch,
+}
+
+async def send_stream(send: Send, make_pieces: Callable[[], Iterable[Any]]) -> None:
+    """Sends the NDJSON lines of the lookup pieces as a thread produces them.
+    The thread waits while `stream_buffer` lines are not sent yet.
+    """
+    loop = asyncio.get_running_loop()
+    lines: 'asyncio.Queue[Optional[str]]' = asyncio.Queue(maxsize=stream_buffer)
+    stopped = threading.Event()
+
+    def put(line: Optional[str]) -> None:
+        asyncio.run_coroutine_threadsafe(lines.put(line), loop).result()
+
+    def produce() -> None:
+        try:
+            for line in ndjson_lines(make_pieces()):
+                if stopped.is_set():
+                    return
+                put(line)
+        finally:
+            if not stopped.is_set():
+                put(None)
+
+    # a generator can't be sent to another process, so it always runs in a thread,
+    # which takes a pending slot of the executor like the lookups in the pool
+    if lookup_executor.use_processes:
+        lookup_executor.acquire()
+        produced = loop.run_in_executor(None, produce)
+        produced.add_done_callback(lookup_executor.release)
+    else:
+        produced = asyncio.wrap_future(lookup_executor.submit(produce))
+
+    try:
+        first_line = await lines.get()
+        if first_line is None:
+            await produced  # raises the error of the lookup, if any
+        await send_start(send, 200, 'application/x-ndjson')
+        line = first_line
+        while line is not None:
+            await send({'type': 'http.response.body', 'body': line.encode(), 'more_body': True})
+            line = await lines.get()
+    finally:
+        # e.g. the client is gone: the producer stops, and the line it waits to put is dropped
+        stopped.set()
+        while not lines.empty():
+            lines.get_nowait()
+    await send({'type': 'http.response.body', 'body': b''})
+    await produced
+
+
+async def call_flask(scope: Scope, receive: Receive, send: Send) -> None:
+    """Runs the Flask app in a thread and sends its buffered response."""
+    environ = make_environ(scope, await read_body(receive))
+    loop = asyncio.get_running_loop()
+    status, headers, body = await loop.run_in_executor(None, call_wsgi, environ)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+def call_wsgi(environ: Dict[str, Any]) -> Tuple[int, Headers, bytes]:
+    response: Dict[str, Any] = {}
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any=None) -> Callable[[bytes], None]:
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return chunks.append
+
+    chunks: List[bytes] = []
+    result = app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], b''.join(chunks)
+
+def make_environ(scope: Scope, body: bytes) -> Dict[str, Any]:
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f'HTTP_{key}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+async def send_start(send: Send, status: int, content_type: str, headers: Iterable[Tuple[bytes, bytes]]=()) -> None:
+    start_headers = [(b'content-type', content_type.encode('latin-1')), *headers]
+    # a streamed response is timed until its body starts
+    timings = current_timings.get()
+    if timings is not None:
+        timings.finish()
+        start_headers.append((b'server-timing', timings.server_timing().encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': start_headers})
+
+async def send_json(send: Send, status: int, data: Any, headers: Iterable[Tuple[bytes, bytes]]=()) -> None:
+    body = json.dumps(data, ensure_ascii=False).encode()
+    await send_start(send, status, 'application/json', headers)
+    await send({'type': 'http.response.body', 'body': body})
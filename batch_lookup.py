@@ -0,0 +1,56 @@
+"""Looks up the rhymes of many words at once, e.g. of all the line ends of a poem.
+Prints a JSON line per word in the input order.
+"""
+
+import argparse
+import json
+import re
+import sys
+from typing import Iterable, List
+
+from package_modules import import_package_module
+
+lookup = import_package_module('lookup')
+
+word_pattern = re.compile(r"[а-яё][а-яё'\N{COMBINING ACUTE ACCENT}`-]*", re.IGNORECASE)
+
+def text_words(lines: Iterable[str], line_ends: bool) -> List[str]:
+    """The words of the text or, with `line_ends`, only the last word of every line."""
+    words = []
+    for line in lines:
+        line_words = word_pattern.findall(line)
+        words.extend(line_words[-1:] if line_ends else line_words)
+    return words
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='*',
+        help='text files to take the words from (by default, the standard input)')
+    parser.add_argument('--line-ends', action='store_true',
+        help='look up only the last word of every line')
+    parser.add_argument('--limit', type=int, default=10,
+        help='number of best rhyming lemmas for every word (0 for all of them)')
+    parser.add_argument('--processes', type=int, default=1,
+        help='number of worker processes scoring the rhyme buckets')
+    parser.add_argument('--memory-index', action='store_true',
+        help='load the whole db into memory first, which pays off for long texts')
+    parser.add_argument('--mapped-index', action='store_true',
+        help='map the index file written by `db_generation.py --mapped-index`, which takes no time to open')
+    args = parser.parse_args()
+    
+    if args.files:
+        lines: List[str] = []
+        for file_name in args.files:
+            with open(file_name, encoding='utf-8') as file:
+                lines.extend(file)
+    else:
+        lines = list(sys.stdin)
+    words = text_words(lines, args.line_ends)
+    
+    if args.memory_index:
+        lookup.load_rhyme_index(fallback_to_sql=False)
+    elif args.mapped_index:
+        lookup.load_mapped_index(fallback_to_sql=False)
+    results = lookup.lookup_words(words, args.limit or None, processes=args.processes)
+    for word, result in zip(words, results):
+        print(json.dumps({'query': word, **result.to_dict()}, ensure_ascii=False))
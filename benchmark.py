@@ -0,0 +1,296 @@
+"""Measures the speed of phonetization, rhyme scoring and lookups on a db
+built from a synthetic dictionary (see `synthetic_dictionary.py`),
+so that it runs without the Hagen dictionary and gives comparable numbers anywhere.
+
+    python benchmark.py --output before.json
+    python benchmark.py --compare before.json
+
+Every benchmark reports the microseconds per operation of its best and median run.
+The `import.*` benchmarks report the time of importing a module in a new interpreter.
+With `--compare`, the benchmarks whose median got slower than `--tolerance` allows
+are reported as regressions, and the exit code is 1.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+
+Timing = Dict[str, float]
+
+def measure(run: Callable[[], Any], ops: int, repeat: int) -> Timing:
+    """Runs `run` once to warm up the caches and then `repeat` times.
+    `ops` is the number of operations a run makes.
+    """
+    run()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started)
+    return {
+        'ops': ops,
+        'repeat': repeat,
+        'best_us': min(seconds) / ops * 1e6,
+        'median_us': statistics.median(seconds) / ops * 1e6,
+    }
+
+# modules whose import time is measured; the ones of the app package are imported as such
+imported_modules = ['phonetics.phonetizer', 'phonetics.rhyme', 'phonetics.vectorized', 'hagen', '.lookup', '']
+
+def measure_import(module: str, repeat: int, env: Optional[Dict[str, str]]=None) -> Timing:
+    """Imports the module in a new interpreter once to warm up the caches and then `repeat` times.
+    Only the import itself is timed, without the start of the interpreter.
+    """
+    package = os.path.basename(package_dir)
+    path, name = (os.path.dirname(package_dir), f'{package}{module}') if module.startswith('.') or not module \
+        else (package_dir, module)
+    code = ('import sys, time; '
+        f'sys.path.insert(0, {path!r}); '
+        f'started = time.perf_counter(); import {name}; print(time.perf_counter() - started)')
+    seconds = []
+    for _ in range(repeat + 1):
+        output = subprocess.run([sys.executable, '-c', code], env={**os.environ, **(env or {})},
+            capture_output=True, text=True, check=True).stdout
+        seconds.append(float(output.split()[-1]))
+    return {
+        'ops': 1,
+        'repeat': repeat,
+        'best_us': min(seconds[1:]) * 1e6,
+        'median_us': statistics.median(seconds[1:]) * 1e6,
+    }
+
+def build_db(work_dir: str, corpus: Dict[str, Any], processes: Optional[int], top_rhymes: int) -> float:
+    """Builds the db of the synthetic dictionary unless it is already built for the same corpus.
+    Returns the number of seconds it took.
+    """
+    import db_generation
+    import hagen
+    import synthetic_dictionary
+
+    hagen.file_name = os.path.join(work_dir, 'hagen-morph.txt')
+    corpus_file = os.path.join(work_dir, 'corpus.json')
+    if all(os.path.exists(f) for f in [corpus_file, db_generation.db_file, db_generation.mapped_index_file]):
+        with open(corpus_file) as file:
+            if json.load(file) == corpus:
+                return 0.0
+
+    started = time.perf_counter()
+    synthetic_dictionary.write_dictionary(hagen.file_name, corpus['lemmas'], corpus['seed'], corpus['huge_bucket_share'])
+    # the progress of the build goes to stderr, so that stdout is left for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        db_generation.generate_db_bulk(processes)
+        db_generation.generate_rhyme_neighbours()
+        if top_rhymes > 0:
+            db_generation.generate_top_rhymes(top_rhymes, processes)
+        db_generation.generate_mapped_index()
+    with open(corpus_file, 'w') as file:
+        json.dump(corpus, file)
+    return time.perf_counter() - started
+
+def run_benchmarks(lookups: int, limit: int, repeat: int, seed: int) -> Tuple[Dict[str, Timing], Dict[str, Any]]:
+    """Returns the timings and the facts about the corpus they depend on."""
+    import hagen
+    from phonetics.phonetizer import phonetize
+    from phonetics.rhyme import get_basic_rhyme, normalized_rhyme_distance
+    from package_modules import import_package_module
+    lookup: Any = import_package_module('lookup')  # its settings are switched below
+
+    rng = random.Random(seed)
+    accented_spells = [row.accented_spell for article in hagen.get_articles() for row in article.rows]
+    transcriptions = [phonetize(spell) for spell in accented_spells]
+    basic_rhymes = [get_basic_rhyme(trans) for trans in transcriptions]
+    buckets: Dict[str, List[int]] = {}
+    for i, rhyme in enumerate(basic_rhymes):
+        buckets.setdefault(rhyme, []).append(i)
+    huge_bucket = max(buckets.values(), key=len)
+    regular_words = [i for i, rhyme in enumerate(basic_rhymes) if buckets[rhyme] is not huge_bucket]
+
+    results: Dict[str, Timing] = {}
+    def report(name: str, timing: Timing) -> None:
+        results[name] = timing
+        print(f'{name:40} {timing["median_us"]:12.1f} us', file=sys.stderr)
+    def bench(name: str, run: Callable[[], Any], ops: int) -> None:
+        report(name, measure(run, ops, repeat))
+
+    for module in imported_modules:
+        report(f'import.{module.lstrip(".") or "app"}', measure_import(module, repeat))
+    report('import.phonetics.phonetizer.no_rule_cache',
+        measure_import('phonetics.phonetizer', repeat, {'RIFMUJ_RULE_CACHE': ''}))
+
+    sample = rng.sample(range(len(accented_spells)), min(10_000, len(accented_spells)))
+    sample_spells = [accented_spells[i] for i in sample]
+    sample_transcriptions = [transcriptions[i] for i in sample]
+    bench('phonetize', lambda: [phonetize(spell) for spell in sample_spells], len(sample))
+    bench('get_basic_rhyme', lambda: [get_basic_rhyme(trans) for trans in sample_transcriptions], len(sample))
+    pairs = [(transcriptions[i], transcriptions[rng.choice(buckets[basic_rhymes[i]])]) for i in sample]
+    bench('normalized_rhyme_distance', lambda: [normalized_rhyme_distance(t1, t2) for t1, t2 in pairs], len(pairs))
+
+    huge_query = accented_spells[rng.choice(huge_bucket)]
+    source = lookup.open_word_source()
+    try:
+        _, word = lookup.find_word(source, huge_query)
+        words_with_dists = list(lookup.get_rhyming_words_with_dists(source, word, lookup.no_filter))
+    finally:
+        source.close()
+    bench('group_by_lemma.huge_bucket', lambda: lookup.group_by_lemma(words_with_dists, limit), 1)
+    bench('group_by_lemma.huge_bucket.all', lambda: lookup.group_by_lemma(words_with_dists, None), 1)
+
+    regular_sample = rng.sample(regular_words, min(lookups, len(regular_words)))
+    regular_queries = [accented_spells[i] for i in regular_sample]
+    huge_queries = [accented_spells[i] for i in rng.sample(huge_bucket, min(max(lookups // 10, 1), len(huge_bucket)))]
+    def bench_lookups(mode: str) -> None:
+        bench(f'lookup_word.{mode}', lambda: [lookup.lookup_word(q, limit) for q in regular_queries], len(regular_queries))
+        bench(f'lookup_word.{mode}.huge_bucket', lambda: [lookup.lookup_word(q, limit) for q in huge_queries], len(huge_queries))
+        near = lookup.RhymeFilter(near=1)
+        bench(f'lookup_word.{mode}.near', lambda: [lookup.lookup_word(q, limit, 0, near) for q in regular_queries], len(regular_queries))
+
+    def bench_bucket_scans(mode: str) -> None:
+        source = lookup.open_word_source()
+        try:
+            bench(f'bucket_scan.{mode}', lambda: [list(source.bucket_words(basic_rhymes[i])) for i in regular_sample],
+                len(regular_sample))
+            bench(f'bucket_scan.{mode}.huge_bucket', lambda: list(source.bucket_words(basic_rhymes[huge_bucket[0]])), 1)
+        finally:
+            source.close()
+
+    bench_lookups('sql')
+    bench_bucket_scans('sql')
+    lookup.use_read_only_db()
+    bench_lookups('read_only')
+    bench_bucket_scans('read_only')
+    lookup.serving_engine = None
+
+    vectorized = lookup.use_vectorized_distances
+    def bench_index_lookups(mode: str) -> None:
+        if vectorized:
+            lookup.use_vectorized_distances = True
+            bench_lookups(f'{mode}.vectorized')
+            lookup.use_vectorized_distances = False
+        bench_lookups(mode)
+        bench_bucket_scans(mode)
+
+    bench('open_index.memory', lambda: lookup.load_rhyme_index(fallback_to_sql=False), 1)
+    bench_index_lookups('index')
+    bench('open_index.mapped', lambda: lookup.load_mapped_index(fallback_to_sql=False), 1)
+    bench_index_lookups('index.mapped')
+    lookup.rhyme_index = None
+    lookup.use_vectorized_distances = vectorized
+
+    corpus_facts = {
+        'words': len(accented_spells),
+        'buckets': len(buckets),
+        'huge_bucket_words': len(huge_bucket),
+    }
+    return results, corpus_facts
+
+def compare(results: Dict[str, Timing], baseline: Dict[str, Timing], tolerance: float) -> List[str]:
+    """Prints the changes of the median timings and returns the names of the regressions."""
+    regressions = []
+    for name, timing in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median_us'], timing['median_us']
+        ratio = after / before if before > 0 else 1.0
+        is_regression = ratio > 1 + tolerance
+        if is_regression:
+            regressions.append(name)
+        print(f'{name:40} {before:12.1f} -> {after:12.1f} us  x{ratio:.2f}{"  REGRESSION" if is_regression else ""}',
+            file=sys.stderr)
+    return regressions
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=package_dir,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='file to write the JSON results to (by default, the standard output)')
+    parser.add_argument('--compare', metavar='RESULTS', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='relative slowdown of the median reported as a regression')
+    parser.add_argument('--lemmas', type=int, default=20_000, help='number of lemmas of the synthetic dictionary')
+    parser.add_argument('--huge-bucket-share', type=float, default=0.05,
+        help='share of the lemmas falling into the huge buckets')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the dictionary and of the samples')
+    parser.add_argument('--lookups', type=int, default=200, help='number of words looked up per run')
+    parser.add_argument('--limit', type=int, default=20, help='number of best rhyming lemmas per lookup')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs of every benchmark')
+    parser.add_argument('--top-rhymes', type=int, default=0, metavar='K',
+        help='also precompute K best rhyming lemmas for every word')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes building the db')
+    parser.add_argument('--work-dir',
+        help='directory for the dictionary and the db, which are reused if built for the same corpus '
+            '(by default, a temporary one)')
+    args = parser.parse_args()
+
+    started = datetime.now()
+    # the benchmark switches between the lookup modes itself
+    for name in ['RIFMUJ_MEMORY_INDEX', 'RIFMUJ_MAPPED_INDEX', 'RIFMUJ_MAPPED_INDEX_FILE', 'RIFMUJ_READ_ONLY_DB', 'RIFMUJ_RANDOM_POOL_SIZE']:
+        os.environ.pop(name, None)
+    with contextlib.ExitStack() as stack:
+        work_dir = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix='rifmuj-benchmark-'))
+        os.makedirs(work_dir, exist_ok=True)
+        # the db file is chosen when `data.data_model` is first imported
+        os.environ['RIFMUJ_DB'] = os.path.join(work_dir, 'database.sqlite')
+        sys.path.insert(0, package_dir)
+
+        corpus = {'lemmas': args.lemmas, 'seed': args.seed, 'huge_bucket_share': args.huge_bucket_share,
+            'top_rhymes': args.top_rhymes, 'rhyme_neighbours': True}
+        build_seconds = build_db(work_dir, corpus, args.processes, args.top_rhymes)
+        db_bytes = os.path.getsize(os.environ['RIFMUJ_DB'])
+        from data.data_model import mapped_index_file
+        index_bytes = os.path.getsize(mapped_index_file)
+        results, corpus_facts = run_benchmarks(args.lookups, args.limit, args.repeat, args.seed)
+
+    from phonetics.vectorized import numpy_available
+    report = {
+        'meta': {
+            'started': started.isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': numpy_available,
+            'corpus': {**corpus, **corpus_facts},
+            'lookups': args.lookups,
+            'limit': args.limit,
+            'build_seconds': build_seconds,
+            'db_bytes': db_bytes,
+            'index_bytes': index_bytes,
+        },
+        'results': results,
+    }
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report_json + '\n')
+    else:
+        print(report_json)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline['meta']['corpus'] != report['meta']['corpus'] or baseline['meta']['limit'] != args.limit:
+            print('The corpus or the limit differ from the compared run, the timings may be incomparable',
+                file=sys.stderr)
+        for name, size in [('db_bytes', db_bytes), ('index_bytes', index_bytes)]:
+            if name in baseline['meta']:
+                print(f'{name:40} {baseline["meta"][name]:12,} -> {size:12,}', file=sys.stderr)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}', file=sys.stderr)
+            sys.exit(1)
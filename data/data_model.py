@@ -1,25 +1,171 @@
-from sqlalchemy import create_engine, Column, String, Integer, ForeignKey
+from typing import List, Tuple
+import os
+import struct
+from sqlalchemy import create_engine, text, Column, MetaData, String, Integer, LargeBinary, ForeignKey, Index, Table
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
-engine = create_engine('sqlite:///data/database.sqlite', echo=False)
+# RIFMUJ_DB is the path of the db, relative to the working directory
+db_file = os.environ.get('RIFMUJ_DB', 'data/database.sqlite')
+engine = create_engine(f'sqlite:///{db_file}', echo=False)
+# RIFMUJ_MAPPED_INDEX_FILE is the path of the index written by `db_generation.py --mapped-index`
+mapped_index_file = os.environ.get('RIFMUJ_MAPPED_INDEX_FILE', f'{os.path.splitext(db_file)[0]}.index')
 
-class Word(Base): # type: ignore
-    __tablename__ = 'words'
+class RhymeKey(Base): # type: ignore
+    """A basic rhyme interned as an integer. The ids follow the order of the rhymes."""
+    __tablename__ = 'rhyme_keys'
+    rhyme_id = Column(Integer, nullable=False, primary_key=True)
+    rhyme = Column(String, nullable=False, unique=True)
+
+class Lemma(Base): # type: ignore
+    """A dictionary article, identified by the id of its first form."""
+    __tablename__ = 'lemmas'
+    lemma_id = Column(Integer, nullable=False, primary_key=True)
+    # the length of the common prefix of the `Form.orth`s of all the forms,
+    # computed by `db_generation.py` once instead of on every lookup
+    stem_len = Column(Integer, nullable=False)
+
+class Gram(Base): # type: ignore
+    """The grammatical features of the forms interned by their mask,
+    which the features are made of (see `morphology.features.features_to_mask`).
+    """
+    __tablename__ = 'grams'
+    gram_mask = Column(Integer, nullable=False, primary_key=True, autoincrement=False)
+    gram = Column(String, nullable=False)  # the sorted abbreviations of the features, e.g. 'AdNn'
+
+class Form(Base): # type: ignore
+    """A form of a lemma. The table is clustered by the primary key,
+    so a rhyme bucket is a single range of rows already ordered by lemma.
+    """
+    __tablename__ = 'forms'
+    rhyme_id = Column(Integer, ForeignKey('rhyme_keys.rhyme_id'), nullable=False, primary_key=True)
+    lemma_id = Column(Integer, ForeignKey('lemmas.lemma_id'), nullable=False, primary_key=True)
     word_id = Column(Integer, nullable=False, primary_key=True)
-    lemma_id = Column(Integer, ForeignKey('words.word_id'), nullable=False)
     spell = Column(String, nullable=False, index=True)
     trans = Column(String, nullable=False)
-    rhyme = Column(String, nullable=False, index=True)
-    gram = Column(String, nullable=False)
+    rhyme_parts = Column(String, nullable=False)  # see `phonetics.rhyme.Rhyme.encode`
+    # the lookups filtered by the features test `gram_mask & ?` while scanning the rows of the bucket,
+    # which no index can serve, so the filter doesn't change how the bucket is read
+    gram_mask = Column(Integer, ForeignKey('grams.gram_mask'), nullable=False)
+    # what the lookups show, computed by `db_generation.py` once instead of on every lookup:
+    # the spelling with ё where the transcription has it, NULL if it is the same as `spell`
+    orth = Column(String)
+
+    __table_args__ = (Index('ix_forms_word_id', 'word_id', unique=True), {'sqlite_with_rowid': False})
+
+# the views are created by `create_schema` rather than by `Base.metadata.create_all`
+view_metadata = MetaData()
 
-    def __init__(self, word_id: int, lemma_id: int, spell: str, trans: str, rhyme: str, gram: str) -> None:
+# The words as the lookups read them: the forms with their basic rhymes, lemmas and features.
+# Dbs built before these tables have a `words` table without `orth` and `stem_len` instead,
+# or forms with their own `gram` and `stem_len`; `db_generation.py --migrate` converts them.
+create_words_view = '''
+    CREATE VIEW IF NOT EXISTS words AS
+    SELECT word_id, lemma_id, spell, trans, rhyme, rhyme_parts, gram, gram_mask, coalesce(orth, spell) AS orth, stem_len
+    FROM forms JOIN rhyme_keys USING (rhyme_id) JOIN lemmas USING (lemma_id) JOIN grams USING (gram_mask)'''
+
+class Word(Base): # type: ignore
+    """A form with its basic rhyme, read from the `words` view.
+    The db is written through the other tables, see `db_generation.py`.
+    """
+    __table__ = Table('words', view_metadata,
+        Column('word_id', Integer, nullable=False, primary_key=True),
+        Column('lemma_id', Integer, nullable=False),
+        Column('spell', String, nullable=False),
+        Column('trans', String, nullable=False),
+        Column('rhyme', String, nullable=False),
+        Column('rhyme_parts', String, nullable=False),
+        Column('gram', String, nullable=False),
+        Column('gram_mask', Integer, nullable=False),
+        Column('orth', String, nullable=False),
+        Column('stem_len', Integer, nullable=False),
+    )
+
+    def __init__(self, word_id: int, lemma_id: int, spell: str, trans: str, rhyme: str, rhyme_parts: str,
+                 gram: str, gram_mask: int=0, orth: str='', stem_len: int=0) -> None:
+        """An empty `orth` is unknown, e.g. for the words absent in the db (see `lookup.get_orthography`)."""
         self.word_id = word_id
         self.lemma_id = lemma_id
         self.spell = spell
         self.trans = trans
         self.rhyme = rhyme
+        self.rhyme_parts = rhyme_parts
         self.gram = gram
+        self.gram_mask = gram_mask
+        self.orth = orth
+        self.stem_len = stem_len
     
     def __repr__(self) -> str:
         return f'#{self.word_id} ({self.lemma_id}) {self.spell} [{self.trans}] -{self.rhyme} ({self.gram.strip()})'
+
+class TopRhymes(Base): # type: ignore
+    """The best rhyming lemmas of a word, precomputed by `db_generation.py`."""
+    __tablename__ = 'top_rhymes'
+    word_id = Column(Integer, ForeignKey('forms.word_id'), nullable=False, primary_key=True)
+    lemma_ids = Column(LargeBinary, nullable=False)  # little-endian int32, best first
+    distances = Column(LargeBinary, nullable=False)  # little-endian float32, for each lemma
+
+    def __init__(self, word_id: int, lemmas: List[Tuple[int, float]]) -> None:
+        """`lemmas` are pairs of lemma ids and distances."""
+        self.word_id = word_id
+        self.lemma_ids = struct.pack(f'<{len(lemmas)}i', *(lemma_id for lemma_id, _ in lemmas))
+        self.distances = struct.pack(f'<{len(lemmas)}f', *(dist for _, dist in lemmas))
+
+    def unpack(self) -> List[Tuple[int, float]]:
+        """Returns pairs of lemma ids and distances."""
+        count = len(self.lemma_ids) // 4
+        return list(zip(self.unpack_lemma_ids(self.lemma_ids), struct.unpack(f'<{count}f', self.distances)))
+
+    @staticmethod
+    def unpack_lemma_ids(lemma_ids: bytes) -> List[int]:
+        return list(struct.unpack(f'<{len(lemma_ids) // 4}i', lemma_ids))
+
+class TopRhymesBucket(Base): # type: ignore
+    """A basic rhyme whose words all have their `TopRhymes` computed."""
+    __tablename__ = 'top_rhymes_buckets'
+    rhyme = Column(String, nullable=False, primary_key=True)
+
+# the largest distance between the basic rhymes of `RhymeNeighbour`, unless `db_generation.py` is told otherwise
+max_neighbour_distance = 3
+
+class RhymeNeighbour(Base): # type: ignore
+    """A pair of basic rhymes whose buckets may hold near rhymes of each other
+    (see `phonetics.rhyme_neighbours`), stored in both directions.
+    The primary key finds the neighbours of a rhyme up to a distance.
+    """
+    __tablename__ = 'rhyme_neighbours'
+    rhyme = Column(String, nullable=False, primary_key=True)
+    distance = Column(Integer, nullable=False, primary_key=True)
+    neighbour = Column(String, nullable=False, primary_key=True)
+
+    __table_args__ = ({'sqlite_with_rowid': False},)
+
+    def __init__(self, rhyme: str, neighbour: str, distance: int) -> None:
+        self.rhyme = rhyme
+        self.neighbour = neighbour
+        self.distance = distance
+
+class RandomWord(Base): # type: ignore
+    """A word which `/random` may show: its rhyme bucket has other lemmas.
+    Positions are consecutive, so a random word is picked by the primary key.
+    """
+    __tablename__ = 'random_words'
+    position = Column(Integer, nullable=False, primary_key=True)
+    word_id = Column(Integer, ForeignKey('forms.word_id'), nullable=False)
+
+class BuildStamp(Base): # type: ignore
+    """A single row identifying the current contents of the db.
+    `db_generation.py` changes it every time it modifies the db.
+    """
+    __tablename__ = 'build_stamp'
+    stamp = Column(String, nullable=False, primary_key=True)
+
+    def __init__(self, stamp: str) -> None:
+        self.stamp = stamp
+
+def create_schema(engine: Engine) -> None:
+    """Creates the missing tables and views of the db."""
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text(create_words_view))
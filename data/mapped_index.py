@@ -0,0 +1,279 @@
+"""The rhyme index in a flat binary file, which the lookups read through `mmap`
+instead of loading the db into memory (see `rhyme_index.RhymeIndex`).
+
+Opening the file only reads its header. The pages are read when the lookups
+touch them, and all the processes serving from the file share them in the page cache.
+`db_generation.py --mapped-index` writes the file from the db.
+
+The file starts with `magic`, the format version, the number of sections,
+the byte order of the sections and the (offset, size) of every section in the order of `sections`.
+The numbers of the header are little-endian, and the sections are aligned to 8 bytes.
+The sections are written in the byte order of the machine and are read as they are,
+so a machine with the other byte order doesn't open the file (the lookups keep querying the db).
+The rows are sorted by (rhyme, lemma_id, word_id) as in `RhymeIndex`.
+A column of strings takes two sections: the offsets of the strings (`uint32`,
+one more than the strings) and the UTF-8 data they point into.
+The `orths` which are the same as the `spells` are stored empty.
+"""
+
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from array import array
+from datetime import datetime
+from random import randrange
+import itertools as it
+import mmap
+import os
+import struct
+import sys
+
+from .rhyme_index import IndexedWord, RhymeIndex
+
+magic = b'RIFMUJIX'
+# changes when the layout of the file changes
+format_version = 3
+header = struct.Struct('<8sII8s')  # the byte order is `sys.byteorder`, padded with zeros
+section_entry = struct.Struct('<qq')
+
+sections = [
+    'word_ids',             # int64 per row
+    'lemma_ids',            # int64 per row
+    'gram_masks',           # int64 per row
+    'rhyme_ids',            # int32 per row, into `rhymes`
+    'gram_ids',             # int32 per row, into `grams`
+    'stem_lens',            # uint16 per row
+    'spells', 'spells.data',
+    'transcriptions', 'transcriptions.data',
+    'rhyme_parts', 'rhyme_parts.data',
+    'orths', 'orths.data',
+    'rhymes', 'rhymes.data',  # the basic rhymes in the order of their bytes
+    'bucket_starts',        # int64 per rhyme and one more: the rows of a bucket are [start, next start)
+    'grams', 'grams.data',
+    'spell_rows',           # int64: all the rows ordered by (spell bytes, word_id)
+    'random_rows',          # int64: the rows `random_word` picks from
+    'neighbour_starts',     # int64 per rhyme and one more, into the neighbour sections
+    'neighbour_distances',  # int32, closest first
+    'neighbour_rhyme_ids',  # int32, into `rhymes`
+    'build_stamp',          # UTF-8, see `data_model.BuildStamp`
+]
+
+def write_mapped_index(index: RhymeIndex, file_name: str, build_stamp: Optional[str]=None) -> int:
+    """Writes the index to the file, replacing it at once, so that the processes
+    which have mapped the old file keep reading it. Returns the size of the file.
+    """
+    rhymes = list(index.buckets)
+    if rhymes != sorted(rhymes, key=str.encode):
+        raise ValueError('The buckets must be sorted by the bytes of their rhymes')
+    rhyme_ids = {rhyme: rhyme_id for rhyme_id, rhyme in enumerate(rhymes)}
+    bucket_starts = [start for start, _ in index.buckets.values()] + [len(index)]
+    grams = sorted(set(index.grams))
+    gram_ids = {gram: gram_id for gram_id, gram in enumerate(grams)}
+    encoded_spells = [spell.encode() for spell in index.spells]
+    word_ids = index.word_ids
+    neighbours = [index.neighbours.get(rhyme, []) for rhyme in rhymes]
+
+    data: Dict[str, bytes] = {
+        'word_ids': word_ids.tobytes(),
+        'lemma_ids': index.lemma_ids.tobytes(),
+        'gram_masks': index.gram_masks.tobytes(),
+        'rhyme_ids': array('i', (rhyme_ids[rhyme] for rhyme in index.rhymes)).tobytes(),
+        'gram_ids': array('i', (gram_ids[gram] for gram in index.grams)).tobytes(),
+        'stem_lens': array('H', index.stem_lens).tobytes(),
+        'bucket_starts': array('q', bucket_starts).tobytes(),
+        'spell_rows': array('q', sorted(range(len(index)), key=lambda row: (encoded_spells[row], word_ids[row]))).tobytes(),
+        'random_rows': index.random_rows.tobytes(),
+        'neighbour_starts': array('q', it.accumulate(map(len, neighbours), initial=0)).tobytes(),
+        'neighbour_distances': array('i', (d for pairs in neighbours for d, _ in pairs)).tobytes(),
+        'neighbour_rhyme_ids': array('i', (rhyme_ids[n] for pairs in neighbours for _, n in pairs)).tobytes(),
+        'build_stamp': (build_stamp or '').encode(),
+    }
+    orths = ['' if orth == spell else orth for orth, spell in zip(index.orths, index.spells)]
+    string_columns: List[Tuple[str, Iterable[Any]]] = [('spells', encoded_spells), ('transcriptions', index.transcriptions),
+        ('rhyme_parts', index.rhyme_parts), ('rhymes', rhymes), ('grams', grams), ('orths', orths)]
+    for name, strings in string_columns:
+        data[name], data[f'{name}.data'] = pack_strings(strings)
+
+    offset = header.size + section_entry.size * len(sections)
+    entries = []
+    for name in sections:
+        offset = aligned(offset)
+        entries.append((offset, len(data[name])))
+        offset += len(data[name])
+
+    temp_name = f'{file_name}.{os.getpid()}.tmp'
+    try:
+        with open(temp_name, 'wb') as file:
+            file.write(header.pack(magic, format_version, len(sections), sys.byteorder.encode()))
+            for entry in entries:
+                file.write(section_entry.pack(*entry))
+            for name, (section_offset, _) in zip(sections, entries):
+                file.write(bytes(section_offset - file.tell()))
+                file.write(data[name])
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+    return offset
+
+def pack_strings(strings: Iterable[Any]) -> Tuple[bytes, bytes]:
+    """Returns the offsets and the data of the strings (or of their UTF-8 bytes)."""
+    encoded = [s if isinstance(s, bytes) else s.encode() for s in strings]
+    blob = b''.join(encoded)
+    if len(blob) >= 2**32:
+        raise ValueError('The strings take more than 4 GiB')
+    return array('I', it.accumulate(map(len, encoded), initial=0)).tobytes(), blob
+
+def aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+class StringColumn:
+    """The strings of a column, decoded when read."""
+    __slots__ = ('offsets', 'data')
+
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+def bisect_bytes(target: bytes, count: int, key: Any) -> int:
+    """The first position in [0, count) whose `key` is not less than `target`."""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if key(middle) < target:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+class MappedRhymeIndex:
+    """Serves the same queries as `RhymeIndex` from a file written by `write_mapped_index`.
+    The columns are views of the mapped file, nothing is copied when it is opened.
+    """
+    def __init__(self, file_name: str) -> None:
+        """Raises `OSError` if the file can't be read and `ValueError` if it has another format."""
+        started = datetime.now()
+        self.file_name = file_name
+        with open(file_name, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        if len(view) < header.size:
+            raise ValueError(f'{file_name} is not a rhyme index')
+        file_magic, version, section_count, byte_order = header.unpack_from(view)
+        if file_magic != magic or version != format_version or section_count != len(sections):
+            raise ValueError(f'{file_name} is not a rhyme index of the version {format_version}')
+        byte_order = byte_order.rstrip(b'\0').decode('ascii', 'replace')
+        if byte_order != sys.byteorder:
+            raise ValueError(f'{file_name} is written on a {byte_order}-endian machine')
+        section: Dict[str, memoryview] = {}
+        for i, name in enumerate(sections):
+            offset, size = section_entry.unpack_from(view, header.size + section_entry.size * i)
+            section[name] = view[offset:offset + size]
+
+        self.word_ids = section['word_ids'].cast('q')
+        self.lemma_ids = section['lemma_ids'].cast('q')
+        self.gram_masks = section['gram_masks'].cast('q')
+        self.rhyme_ids = section['rhyme_ids'].cast('i')
+        self.gram_ids = section['gram_ids'].cast('i')
+        self.stem_lens = section['stem_lens'].cast('H')
+        self.spells = StringColumn(section['spells'].cast('I'), section['spells.data'])
+        self.transcriptions = StringColumn(section['transcriptions'].cast('I'), section['transcriptions.data'])
+        self.rhyme_parts = StringColumn(section['rhyme_parts'].cast('I'), section['rhyme_parts.data'])
+        self.orths = StringColumn(section['orths'].cast('I'), section['orths.data'])
+        self.rhymes = StringColumn(section['rhymes'].cast('I'), section['rhymes.data'])
+        self.bucket_starts = section['bucket_starts'].cast('q')
+        self.grams = StringColumn(section['grams'].cast('I'), section['grams.data'])
+        self.spell_rows = section['spell_rows'].cast('q')
+        self.random_rows = section['random_rows'].cast('q')
+        self.neighbour_starts = section['neighbour_starts'].cast('q')
+        self.neighbour_distances = section['neighbour_distances'].cast('i')
+        self.neighbour_rhyme_ids = section['neighbour_rhyme_ids'].cast('i')
+        self.build_stamp = str(section['build_stamp'], 'utf-8') or None
+        # basic rhyme -> data derived from the bucket by the lookup, kept by every process for itself
+        self.bucket_cache: Dict[str, Any] = {}
+        self.load_seconds = (datetime.now() - started).total_seconds()
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    def word(self, row: int) -> IndexedWord:
+        spell = self.spells[row]
+        return IndexedWord(
+            self.word_ids[row],
+            self.lemma_ids[row],
+            spell,
+            self.transcriptions[row],
+            self.rhymes[self.rhyme_ids[row]],
+            self.rhyme_parts[row],
+            self.grams[self.gram_ids[row]],
+            self.gram_masks[row],
+            self.orths[row] or spell,
+            self.stem_lens[row]
+        )
+
+    def rhyme_id(self, rhyme: str) -> Optional[int]:
+        target = rhyme.encode()
+        rhyme_id = bisect_bytes(target, len(self.rhymes), self.rhymes.raw)
+        return rhyme_id if rhyme_id < len(self.rhymes) and self.rhymes.raw(rhyme_id) == target else None
+
+    def bucket_range(self, rhyme: str) -> Tuple[int, int]:
+        """The rows of the bucket: (first row, last row + 1)."""
+        rhyme_id = self.rhyme_id(rhyme)
+        if rhyme_id is None:
+            return 0, 0
+        return self.bucket_starts[rhyme_id], self.bucket_starts[rhyme_id + 1]
+
+    def words_by_spell(self, spell: str) -> List[IndexedWord]:
+        target = spell.encode()
+        spell_rows, spells = self.spell_rows, self.spells
+        position = bisect_bytes(target, len(spell_rows), lambda i: spells.raw(spell_rows[i]))
+        words = []
+        while position < len(spell_rows) and spells.raw(spell_rows[position]) == target:
+            words.append(self.word(spell_rows[position]))
+            position += 1
+        return words
+
+    def rhyming_words(self, rhyme: str, lemma_id: int, gram_mask: int=0) -> Iterable[IndexedWord]:
+        """See `RhymeIndex.rhyming_words`."""
+        return (self.word(row) for row in self.rhyming_rows(rhyme, lemma_id, gram_mask))
+
+    def rhyming_rows(self, rhyme: str, lemma_id: int, gram_mask: int=0) -> Iterable[int]:
+        """The rows of `rhyming_words`."""
+        start, end = self.bucket_range(rhyme)
+        lemma_ids = self.lemma_ids
+        if not gram_mask:
+            return (row for row in range(start, end) if lemma_ids[row] != lemma_id)
+        gram_masks = self.gram_masks
+        return (row for row in range(start, end) if lemma_ids[row] != lemma_id and gram_masks[row] & gram_mask)
+
+    def neighbour_rhymes(self, rhyme: str, max_distance: int) -> List[str]:
+        """The basic rhymes within `max_distance` from the given one, closest first."""
+        rhyme_id = self.rhyme_id(rhyme)
+        if rhyme_id is None:
+            return []
+        neighbours = range(self.neighbour_starts[rhyme_id], self.neighbour_starts[rhyme_id + 1])
+        return [self.rhymes[self.neighbour_rhyme_ids[i]] for i in neighbours if self.neighbour_distances[i] <= max_distance]
+
+    def random_word(self) -> IndexedWord:
+        """See `RhymeIndex.random_word`."""
+        if self.random_rows:
+            return self.word(self.random_rows[randrange(len(self.random_rows))])
+        return self.word(randrange(len(self)))
+
+    def __repr__(self) -> str:
+        return (f'<MappedRhymeIndex: {len(self)} words in {len(self.rhymes)} buckets, '
+            f'{len(self.map) / 2**20:.1f} MiB mapped from {self.file_name}, opened in {self.load_seconds:.3f} s>')
+
+
+if __name__ == '__main__':
+    from .data_model import mapped_index_file
+    print(MappedRhymeIndex(mapped_index_file))
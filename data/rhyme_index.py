@@ -0,0 +1,189 @@
+"""An in-memory copy of the words of the db for serving lookups without the ORM."""
+
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+from array import array
+from datetime import datetime
+from random import randrange
+import sys
+
+class IndexedWord(NamedTuple):
+    """A word from the index. Has the same attributes as `data_model.Word`."""
+    word_id: int
+    lemma_id: int
+    spell: str
+    trans: str
+    rhyme: str
+    rhyme_parts: str
+    gram: str
+    gram_mask: int = 0
+    # see `data_model.Form`, empty if unknown
+    orth: str = ''
+    stem_len: int = 0
+
+class RhymeIndex:
+    """All the words from the db stored column-wise and sorted by
+    (rhyme, lemma_id, word_id), so that every basic rhyme bucket is
+    a contiguous range of rows already in the order the lookup needs.
+    Repeating strings (rhymes, grammatical features) are interned.
+    """
+    def __init__(self) -> None:
+        self.word_ids = array('q')
+        self.lemma_ids = array('q')
+        self.spells: List[str] = []
+        self.transcriptions: List[str] = []
+        self.rhymes: List[str] = []
+        self.rhyme_parts: List[str] = []
+        self.grams: List[str] = []
+        self.gram_masks = array('q')
+        self.orths: List[str] = []
+        self.stem_lens = array('H')
+        # basic rhyme -> (first row, last row + 1)
+        self.buckets: Dict[str, Tuple[int, int]] = {}
+        # spelling -> rows sorted by word_id
+        self.rows_by_spell: Dict[str, List[int]] = {}
+        # basic rhyme -> data derived from the bucket by the lookup, e.g. encoded rhymes
+        self.bucket_cache: Dict[str, Any] = {}
+        # basic rhyme -> (distance, neighbouring basic rhyme) sorted by distance, see `data_model.RhymeNeighbour`
+        self.neighbours: Dict[str, List[Tuple[int, str]]] = {}
+        # rows `random_word` picks from, see `collect_random_rows`
+        self.random_rows = array('q')
+        self.load_seconds = 0.0
+
+    @classmethod
+    def load(cls, engine: Any) -> RhymeIndex:
+        """Reads all the words using a raw DBAPI connection of the engine."""
+        started = datetime.now()
+        index = cls()
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('''
+                SELECT word_id, lemma_id, spell, trans, rhyme, rhyme_parts, gram, gram_mask, orth, stem_len FROM words
+                ORDER BY rhyme, lemma_id, word_id''')
+            for row in cursor:
+                index.append(IndexedWord(*row))
+            # older dbs have no neighbours
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rhyme_neighbours'")
+            if cursor.fetchone() is not None:
+                cursor.execute('SELECT rhyme, distance, neighbour FROM rhyme_neighbours ORDER BY rhyme, distance, neighbour')
+                for rhyme, distance, neighbour in cursor:
+                    index.neighbours.setdefault(sys.intern(rhyme), []).append((distance, sys.intern(neighbour)))
+        finally:
+            connection.close()
+
+        index.sort_spell_rows()
+        index.collect_random_rows()
+        index.load_seconds = (datetime.now() - started).total_seconds()
+        return index
+
+    def append(self, word: IndexedWord) -> None:
+        """Adds a word after all the others. Words must come sorted by
+        (rhyme, lemma_id, word_id) for the buckets to be contiguous.
+        """
+        row = len(self.word_ids)
+        rhyme = sys.intern(word.rhyme)
+        self.word_ids.append(word.word_id)
+        self.lemma_ids.append(word.lemma_id)
+        self.spells.append(word.spell)
+        self.transcriptions.append(word.trans)
+        self.rhymes.append(rhyme)
+        self.rhyme_parts.append(word.rhyme_parts)
+        self.grams.append(sys.intern(word.gram))
+        self.gram_masks.append(word.gram_mask)
+        # most words have no ё, so they share the string
+        self.orths.append(word.spell if word.orth == word.spell else word.orth)
+        self.stem_lens.append(word.stem_len)
+
+        start, _ = self.buckets.get(rhyme, (row, row))
+        self.buckets[rhyme] = (start, row + 1)
+        self.rows_by_spell.setdefault(word.spell, []).append(row)
+
+    def sort_spell_rows(self) -> None:
+        """Must be called after appending all the words."""
+        for spell_rows in self.rows_by_spell.values():
+            spell_rows.sort(key=lambda row: self.word_ids[row])
+
+    def collect_random_rows(self) -> None:
+        """Must be called after appending all the words.
+        Chooses the same words as `db_generation.fill_random_words`:
+        those from buckets with other lemmas and at most 3 syllables after the stress.
+        """
+        self.random_rows = array('q')
+        for rhyme, (start, end) in self.buckets.items():
+            if not rhyme.endswith(tuple('456789')) and len(set(self.lemma_ids[start:end])) > 1:
+                self.random_rows.extend(range(start, end))
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    def word(self, row: int) -> IndexedWord:
+        return IndexedWord(
+            self.word_ids[row],
+            self.lemma_ids[row],
+            self.spells[row],
+            self.transcriptions[row],
+            self.rhymes[row],
+            self.rhyme_parts[row],
+            self.grams[row],
+            self.gram_masks[row],
+            self.orths[row],
+            self.stem_lens[row]
+        )
+
+    def bucket_range(self, rhyme: str) -> Tuple[int, int]:
+        """The rows of the bucket: (first row, last row + 1)."""
+        return self.buckets.get(rhyme, (0, 0))
+
+    def words_by_spell(self, spell: str) -> List[IndexedWord]:
+        return [self.word(row) for row in self.rows_by_spell.get(spell, [])]
+
+    def rhyming_words(self, rhyme: str, lemma_id: int, gram_mask: int=0) -> Iterable[IndexedWord]:
+        """Yields the words of the bucket which are not forms of the lemma,
+        ordered by lemma_id.
+        With `gram_mask`, yields only the words having any of its features.
+        """
+        return (self.word(row) for row in self.rhyming_rows(rhyme, lemma_id, gram_mask))
+
+    def rhyming_rows(self, rhyme: str, lemma_id: int, gram_mask: int=0) -> Iterable[int]:
+        """The rows of `rhyming_words`."""
+        start, end = self.bucket_range(rhyme)
+        lemma_ids = self.lemma_ids
+        if not gram_mask:
+            return (row for row in range(start, end) if lemma_ids[row] != lemma_id)
+        gram_masks = self.gram_masks
+        return (row for row in range(start, end) if lemma_ids[row] != lemma_id and gram_masks[row] & gram_mask)
+
+    def neighbour_rhymes(self, rhyme: str, max_distance: int) -> List[str]:
+        """The basic rhymes within `max_distance` from the given one, closest first."""
+        return [neighbour for distance, neighbour in self.neighbours.get(rhyme, []) if distance <= max_distance]
+
+    def random_word(self) -> IndexedWord:
+        """Picks a word guaranteed to have rhymes if `collect_random_rows` has found any."""
+        if self.random_rows:
+            return self.word(self.random_rows[randrange(len(self.random_rows))])
+        return self.word(randrange(len(self)))
+
+    def memory_footprint(self) -> int:
+        """Returns the approximate number of bytes taken by the index."""
+        columns: List[Any] = [self.word_ids, self.lemma_ids, self.spells, self.transcriptions,
+            self.rhymes, self.rhyme_parts, self.grams, self.gram_masks, self.orths, self.stem_lens, self.buckets, self.rows_by_spell, self.random_rows,
+            self.neighbours]
+        size = sum(sys.getsizeof(column) for column in columns)
+        size += sum(sys.getsizeof(rows) for rows in self.rows_by_spell.values())
+        size += sum(sys.getsizeof(neighbours) + sys.getsizeof(neighbours[0]) * len(neighbours)
+            for neighbours in self.neighbours.values())
+        size += sum(sys.getsizeof(bucket) for bucket in self.buckets.values())
+        strings = {id(s): s for column in [self.spells, self.transcriptions, self.rhymes, self.rhyme_parts, self.grams, self.orths]
+            for s in column}
+        size += sum(sys.getsizeof(s) for s in strings.values())
+        return size
+
+    def __repr__(self) -> str:
+        return (f'<RhymeIndex: {len(self)} words in {len(self.buckets)} buckets, '
+            f'{self.memory_footprint() / 2**20:.1f} MiB, loaded in {self.load_seconds:.2f} s>')
+
+
+if __name__ == '__main__':
+    from .data_model import engine
+    print(RhymeIndex.load(engine))
@@ -0,0 +1,56 @@
+"""Read-only connections to the db tuned for serving lookups."""
+
+from datetime import datetime
+import sqlite3
+from urllib.parse import quote
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+def create_serving_engine(db_file: str, mmap_size: int=256 * 2**20, cache_size_kib: int=64 * 2**10,
+                          immutable: bool=False, pool_size: int=16) -> Engine:
+    """Returns an engine whose connections can only read the db.
+
+    Up to `pool_size` connections are kept in the pool and reused by the threads,
+    so the statements prepared by the `sqlite3` module stay cached;
+    when more threads read the db at once, the extra connections are closed after use.
+    The db is read through a memory map of `mmap_size` bytes,
+    and each connection caches up to `cache_size_kib` KiB of pages.
+    With `immutable`, SQLite doesn't lock the db or check it for changes at all,
+    which is only safe if the db file is replaced as a whole (see `db_generation.py --bulk`).
+    """
+    uri = f"file:{quote(db_file)}?mode=ro{'&immutable=1' if immutable else ''}"
+    pragmas = [
+        'PRAGMA query_only = ON',
+        f'PRAGMA mmap_size = {int(mmap_size)}',
+        f'PRAGMA cache_size = {-int(cache_size_kib)}',
+        'PRAGMA temp_store = MEMORY',
+    ]
+
+    def connect() -> sqlite3.Connection:
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        for pragma in pragmas:
+            connection.execute(pragma)
+        return connection
+
+    return create_engine('sqlite://', creator=connect, poolclass=QueuePool, pool_size=pool_size, max_overflow=-1)
+
+# the tables behind the `words` view, or the words table of older dbs
+word_tables = ['words', 'forms', 'rhyme_keys']
+
+def warm_up(engine: Engine) -> float:
+    """Reads every index of the word tables, so that the first lookups
+    don't wait for their pages. Returns the number of seconds it took.
+    """
+    started = datetime.now()
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT tbl_name, name FROM sqlite_master WHERE type = 'index' "
+            f"AND tbl_name IN ({', '.join('?' * len(word_tables))})", word_tables)
+        for table, name in list(cursor.fetchall()):
+            cursor.execute(f'SELECT count(*) FROM "{table}" INDEXED BY "{name}"')
+            cursor.fetchone()
+    finally:
+        connection.close()
+    return (datetime.now() - started).total_seconds()
@@ -1,44 +1,522 @@
 """Makes the database from the plaintext dictionary."""
 
+from typing import Any, List, Optional
+import argparse
+import functools
+import itertools as it
+import os
+import sys
+import uuid
+import multiprocessing
 import more_itertools as mit
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import CreateIndex
 from datetime import datetime
 
-from data.data_model import engine, Base, Word
+from data.data_model import (db_file, mapped_index_file, engine, Base, Word, RhymeKey, Lemma, Gram, Form, TopRhymes, TopRhymesBucket, RhymeNeighbour,
+    RandomWord, BuildStamp, create_schema, create_words_view, max_neighbour_distance)
+from data.mapped_index import write_mapped_index
+from data.rhyme_index import RhymeIndex
+from phonetics.accent import yoficate_by_transcription, common_prefix_len
+from phonetics.rhyme import encode_rhyme
+from morphology.features import features_to_mask
+from phonetics import rhyme_neighbours
 import hagen
+import top_rhymes
 
-def generate_db() -> None:
+def generate_db(processes: Optional[int]=None, batch_size: int=1000) -> None:
+    """Fills the word tables from the dictionary file.
+    See `hagen.get_word_values` for the meaning of the arguments.
+    """
     started = datetime.now()
     print(f'Started: {started}')
     
-    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        drop_words(connection)
+        # the neighbours are found anew anyway, and an older version made the table with rowids
+        RhymeNeighbour.__table__.drop(connection, checkfirst=True)
+    create_schema(engine)
     Session = sessionmaker(bind=engine)
     
     session = Session()
     try:
-        print('Clearing the db table...')
-        session.query(Word).delete()
+        print('Clearing the db tables...')
+        session.query(TopRhymes).delete()
+        session.query(TopRhymesBucket).delete()
+        session.query(RandomWord).delete()
         
         print('Populating the db table from the dictionary file:')
-        words = hagen.get_words()
-        
-        chunks = mit.chunked(words, 100_000)
+        connection = session.connection()
+        add_build_functions(connection.connection.driver_connection)
+        connection.exec_driver_sql('DROP TABLE IF EXISTS word_values')
+        connection.exec_driver_sql(create_word_values)
+        chunks = mit.chunked(hagen.get_word_values(processes, batch_size), 100_000)
         for index, chunk in enumerate(chunks):
-            print(f' chunk {index} ({chunk[0].spell} — {chunk[-1].spell})...')
-            session.bulk_save_objects(chunk)
+            print(f' chunk {index} ({chunk[0][2]} — {chunk[-1][2]})...')
+            connection.exec_driver_sql(insert_word_values, chunk)
+        
+        print('Clustering the words by their rhymes...')
+        for statement in normalize_word_values:
+            connection.exec_driver_sql(statement)
+        
+        print('Choosing words for random lookups...')
+        session.execute(text(fill_random_words))
         
         print('Committing data into the db...')
+        update_build_stamp(session)
         session.commit()
     finally:
         session.close()
     
     print('Vacuuming the db...')
     with engine.connect() as connection:
-        connection.execute("VACUUM")
+        connection.execute(text("VACUUM"))
     
     finished = datetime.now()
     print(f'Finished: {finished}')
     print(f'Elapsed: {finished - started}')
 
+# Speed over durability: if the build fails, the temporary file is just thrown away.
+bulk_load_pragmas = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA locking_mode = EXCLUSIVE',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -262144',  # 256 MiB
+]
+
+# in the order of `hagen.WordValues`
+word_columns = ['word_id', 'lemma_id', 'spell', 'trans', 'rhyme', 'rhyme_parts', 'gram', 'gram_mask']
+
+# The words are loaded as they come from the dictionary into a plain table
+# and then split into the rhyme keys, the lemmas, the grammatical features and the forms.
+# The forms are inserted in the order of their primary key, so every rhyme bucket
+# takes consecutive pages, which are filled up.
+# The statements use the functions of `add_build_functions`.
+create_word_values = f'CREATE TABLE word_values ({", ".join(word_columns)}, orth)'
+insert_word_values = f'INSERT INTO word_values ({", ".join(word_columns)}) VALUES ({", ".join("?" * len(word_columns))})'
+normalize_word_values = [
+    'UPDATE word_values SET orth = yoficate(spell, trans)',
+    '''INSERT INTO rhyme_keys (rhyme_id, rhyme)
+    SELECT row_number() OVER (ORDER BY rhyme), rhyme FROM (SELECT DISTINCT rhyme FROM word_values)''',
+    '''INSERT INTO lemmas (lemma_id, stem_len)
+    SELECT lemma_id, common_prefix_len(orth) FROM word_values GROUP BY lemma_id''',
+    # the same features make the same text (`migrate_db` sorts the ones of the first versions)
+    '''INSERT INTO grams (gram_mask, gram)
+    SELECT gram_mask, min(gram) FROM word_values GROUP BY gram_mask''',
+    '''INSERT INTO forms (rhyme_id, lemma_id, word_id, spell, trans, rhyme_parts, gram_mask, orth)
+    SELECT rhyme_id, lemma_id, word_id, spell, trans, rhyme_parts, gram_mask, nullif(orth, spell)
+    FROM word_values JOIN rhyme_keys USING (rhyme)
+    ORDER BY rhyme_id, lemma_id, word_id''',
+    'DROP TABLE word_values',
+]
+
+class CommonPrefixLength:
+    """The SQL aggregate of `phonetics.accent.common_prefix_len`."""
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+    
+    def step(self, string: str) -> None:
+        self.strings.append(string)
+    
+    def finalize(self) -> int:
+        return common_prefix_len(self.strings)
+
+def add_build_functions(connection: Any) -> None:
+    """Lets the statements of a `sqlite3` connection compute the columns the lookups show (see `Form.orth`)."""
+    connection.create_function('yoficate', 2, yoficate_by_transcription, deterministic=True)
+    connection.create_aggregate('common_prefix_len', 1, CommonPrefixLength)
+
+def has_words_table(connection: Any) -> bool:
+    """Whether the db was built before the forms table and keeps the words
+    in a table where the `words` view should be.
+    """
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'words'").first() is not None
+
+def has_current_words(connection: Any) -> bool:
+    """Whether the words of the db are stored in the current tables."""
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'grams'").first() is not None
+
+def rebuild_without_rowid(connection: Any, table: Any) -> None:
+    """Recreates the table, keeping its rows, if an older version made it with rowids."""
+    sql = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)).scalar()
+    if sql is None or 'WITHOUT ROWID' in sql.upper():
+        return
+    columns = ', '.join(column.name for column in table.columns)
+    connection.exec_driver_sql(f'ALTER TABLE {table.name} RENAME TO old_{table.name}')
+    table.create(connection)
+    connection.exec_driver_sql(f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM old_{table.name}')
+    connection.exec_driver_sql(f'DROP TABLE old_{table.name}')
+
+def drop_words(connection: Any) -> None:
+    """Drops the tables of the words in any of the layouts of the older versions,
+    so that `create_schema` makes them anew.
+    """
+    connection.exec_driver_sql('DROP TABLE words' if has_words_table(connection) else 'DROP VIEW IF EXISTS words')
+    for table in [Form, Lemma, Gram, RhymeKey]:
+        table.__table__.drop(connection, checkfirst=True)
+
+def generate_db_bulk(processes: Optional[int]=None, batch_size: int=1000,
+                     neighbour_distance: int=0, top_rhymes_k: int=0) -> None:
+    """The same as `generate_db` but much faster.
+    
+    The db is built in a temporary file which then replaces the db file,
+    so a running app never sees a half-built db.
+    Rows are inserted with plain SQL, and the indexes are created after that.
+    The rhyme neighbours within `neighbour_distance` and the `top_rhymes_k` best rhymes
+    (none for 0) are found in the temporary file too, before the build stamp is written.
+    """
+    started = datetime.now()
+    print(f'Started: {started}')
+    
+    temp_file = f'{db_file}.tmp'
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    temp_engine = create_engine(f'sqlite:///{temp_file}')
+    create_schema(temp_engine)
+    deferred_indexes = list(Form.__table__.indexes)
+    for index in deferred_indexes:
+        index.drop(temp_engine)
+    
+    connection = temp_engine.raw_connection()
+    try:
+        add_build_functions(connection.driver_connection)
+        cursor = connection.cursor()
+        for pragma in bulk_load_pragmas:
+            cursor.execute(pragma)
+        
+        print('Populating the db table from the dictionary file:')
+        stage_started = datetime.now()
+        cursor.execute(create_word_values)
+        word_count = 0
+        for index, chunk in enumerate(mit.chunked(hagen.get_word_values(processes, batch_size), 100_000)):
+            cursor.executemany(insert_word_values, chunk)
+            word_count += len(chunk)
+            print(f' chunk {index} ({chunk[0][2]} — {chunk[-1][2]}), {throughput(word_count, stage_started)}...')
+        connection.commit()
+        print(f'Loaded {word_count} words, {throughput(word_count, stage_started)}')
+        
+        print('Clustering the words by their rhymes...')
+        stage_started = datetime.now()
+        for statement in normalize_word_values:
+            cursor.execute(statement)
+        connection.commit()
+        print(f' {throughput(word_count, stage_started)}')
+        
+        for index in deferred_indexes:
+            print(f'Creating the index {index.name}...')
+            stage_started = datetime.now()
+            cursor.execute(str(CreateIndex(index).compile(dialect=temp_engine.dialect)))
+            connection.commit()
+            print(f' {throughput(word_count, stage_started)}')
+        
+        print('Choosing words for random lookups...')
+        cursor.execute(fill_random_words)
+        connection.commit()
+        
+        # the pages of the loaded words are free now
+        print('Vacuuming the db...')
+        cursor.execute('VACUUM')
+    finally:
+        connection.close()
+        # the following connections don't keep the exclusive lock of the pragmas
+        temp_engine.dispose()
+    
+    try:
+        if neighbour_distance > 0:
+            generate_rhyme_neighbours(neighbour_distance, temp_engine)
+        if top_rhymes_k > 0:
+            generate_top_rhymes(top_rhymes_k, processes, temp_engine)
+        
+        print('Analyzing the db...')
+        with temp_engine.begin() as temp_connection:
+            temp_connection.exec_driver_sql('ANALYZE')
+            temp_connection.exec_driver_sql('INSERT INTO build_stamp (stamp) VALUES (?)', (make_build_stamp(),))
+    finally:
+        temp_engine.dispose()
+    
+    print('Replacing the db file...')
+    engine.dispose()
+    os.replace(temp_file, db_file)
+    
+    finished = datetime.now()
+    print(f'Finished: {finished}')
+    print(f'Elapsed: {finished - started}')
+
+# Words whose rhyme buckets contain other lemmas, so they are guaranteed to have rhymes,
+# except for the words with more than 3 syllables after the stress.
+fill_random_words = '''
+    INSERT INTO random_words (position, word_id)
+    SELECT row_number() OVER (ORDER BY word_id) - 1, word_id FROM words
+    WHERE substr(rhyme, -1) NOT IN ('4', '5', '6', '7', '8', '9')
+        AND rhyme IN (SELECT rhyme FROM words GROUP BY rhyme HAVING COUNT(DISTINCT lemma_id) > 1)'''
+
+def migrate_db() -> None:
+    """Moves the words of a db built by an older version (before the forms table,
+    before their `orth` and `stem_len` or before the lemmas and the grammatical features
+    had their own tables) into the current tables without reading the dictionary again.
+    The columns the first versions didn't store are computed from the stored ones.
+    The other tables refer to the words by their ids, so they are kept,
+    but the ones an older version made with rowids are made without them.
+    Everything is changed in one transaction, so a failed migration leaves the db as it was.
+    """
+    started = datetime.now()
+    print(f'Started migrating the db: {started}')
+    
+    migration_engine = create_migration_engine()
+    try:
+        with migration_engine.begin() as connection:
+            if connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'words'").first() is None:
+                print('The db has no words, nothing to migrate')
+                return
+            rebuild_without_rowid(connection, RhymeNeighbour.__table__)
+            if has_current_words(connection):
+                print('The words of the db are up to date, nothing to migrate')
+                return
+            
+            print('Copying the words...')
+            stored_columns = {row[1] for row in connection.exec_driver_sql('PRAGMA table_info(words)')}
+            values = [column if column in stored_columns else computed_word_columns[column] for column in word_columns]
+            # the first versions joined the features in any order
+            values[word_columns.index('gram')] = 'sort_gram(gram)'
+            connection.exec_driver_sql('DROP TABLE IF EXISTS word_values')
+            connection.exec_driver_sql(create_word_values)
+            connection.exec_driver_sql(f'INSERT INTO word_values ({", ".join(word_columns)}) SELECT {", ".join(values)} FROM words')
+            drop_words(connection)
+            Base.metadata.create_all(connection)
+            connection.execute(text(create_words_view))
+            
+            print('Clustering the words by their rhymes...')
+            for statement in normalize_word_values:
+                connection.exec_driver_sql(statement)
+            if connection.exec_driver_sql('SELECT 1 FROM random_words LIMIT 1').first() is None:
+                print('Choosing words for random lookups...')
+                connection.exec_driver_sql(fill_random_words)
+            connection.exec_driver_sql('DELETE FROM build_stamp')
+            connection.exec_driver_sql('INSERT INTO build_stamp (stamp) VALUES (?)', (make_build_stamp(),))
+    finally:
+        migration_engine.dispose()
+    
+    print('Vacuuming the db...')
+    engine.dispose()
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+    
+    finished = datetime.now()
+    print(f'Finished: {finished}')
+    print(f'Elapsed: {finished - started}')
+
+# the columns of `word_columns` the first versions didn't store, computed by `add_migration_functions`
+computed_word_columns = {
+    'rhyme_parts': 'encode_rhyme(trans)',
+    'gram_mask': 'gram_mask(gram)',
+}
+
+def gram_features(gram: str) -> List[str]:
+    """The feature abbreviations of `Word.gram`, two letters each (see `morphology.features.morph_abbr`)."""
+    return [gram[i:i + 2] for i in range(0, len(gram), 2)]
+
+def add_migration_functions(connection: Any) -> None:
+    """Lets the statements of a `sqlite3` connection compute the columns the first versions didn't store."""
+    add_build_functions(connection)
+    connection.create_function('encode_rhyme', 1, encode_rhyme, deterministic=True)
+    connection.create_function('gram_mask', 1, lambda gram: features_to_mask(gram_features(gram)), deterministic=True)
+    connection.create_function('sort_gram', 1, lambda gram: ''.join(sorted(gram_features(gram))), deterministic=True)
+
+def create_migration_engine() -> Engine:
+    """An engine for the db whose transactions also include the changes of the schema,
+    which `sqlite3` otherwise commits right away.
+    """
+    migration_engine = create_engine(f'sqlite:///{db_file}')
+    
+    @event.listens_for(migration_engine, 'connect')
+    def connect(connection: Any, _: Any) -> None:
+        connection.isolation_level = None  # the transactions are begun by `begin`
+        add_migration_functions(connection)
+    
+    @event.listens_for(migration_engine, 'begin')
+    def begin(connection: Any) -> None:
+        connection.exec_driver_sql('BEGIN')
+    
+    return migration_engine
+
+def make_build_stamp() -> str:
+    return f'{datetime.now().isoformat()} {uuid.uuid4().hex}'
+
+def update_build_stamp(session: Session) -> None:
+    """Lets the running app know that the db has changed (see `lookup_cache.py`)."""
+    session.query(BuildStamp).delete()
+    session.add(BuildStamp(make_build_stamp()))
+
+def throughput(rows: int, started: datetime) -> str:
+    seconds = max((datetime.now() - started).total_seconds(), 1e-6)
+    return f'{rows / seconds:,.0f} rows/s'
+
+def generate_top_rhymes(k: int, processes: Optional[int]=None, db_engine: Engine=engine) -> None:
+    """Fills the `top_rhymes` table for the words of the db (or of the one `db_engine` connects to).
+    Buckets are committed one by one, so an interrupted run
+    continues from where it stopped.
+    """
+    started = datetime.now()
+    print(f'Started computing top rhymes: {started}')
+    
+    Base.metadata.create_all(db_engine)
+    Session = sessionmaker(bind=db_engine)
+    
+    session = Session()
+    try:
+        done = {rhyme for rhyme, in session.query(TopRhymesBucket.rhyme)}
+        buckets = [rhyme for rhyme, in session.query(Word.rhyme).distinct() if rhyme not in done]
+        print(f'{len(done)} buckets are already done, {len(buckets)} buckets to go')
+        
+        # the connections of the pool must not be shared with the child processes
+        db_engine.dispose()
+        rank = functools.partial(top_rhymes.rank_bucket_in_worker, k=k, file_name=db_engine.url.database)
+        with multiprocessing.Pool(processes) as pool:
+            word_count = 0
+            for index, (rhyme, words) in enumerate(pool.imap_unordered(rank, buckets)):
+                word_count += len(words)
+                print(f' bucket {index + 1}/{len(buckets)} -{rhyme} ({len(words)} words), {throughput(word_count, started)}...')
+                session.bulk_save_objects([TopRhymes(word_id, lemmas) for word_id, lemmas in words])
+                session.add(TopRhymesBucket(rhyme=rhyme))
+                session.commit()
+        
+        if db_engine is engine:
+            update_build_stamp(session)
+            session.commit()
+    finally:
+        session.close()
+    
+    finished = datetime.now()
+    print(f'Finished: {finished}')
+    print(f'Elapsed: {finished - started}')
+
+def generate_rhyme_neighbours(max_distance: int=max_neighbour_distance, db_engine: Engine=engine) -> None:
+    """Fills the `rhyme_neighbours` table for the basic rhymes of the db (or of the one `db_engine` connects to)."""
+    started = datetime.now()
+    print(f'Started finding rhyme neighbours: {started}')
+    
+    Base.metadata.create_all(db_engine)
+    Session = sessionmaker(bind=db_engine)
+    
+    session = Session()
+    try:
+        session.query(RhymeNeighbour).delete()
+        rhymes = [rhyme for rhyme, in session.query(Word.rhyme).distinct()]
+        neighbours = [RhymeNeighbour(*pair) for pair in rhyme_neighbours.find_rhyme_neighbours(rhymes, max_distance)]
+        print(f'{len(neighbours)} neighbours of {len(rhymes)} basic rhymes within the distance {max_distance}')
+        session.bulk_save_objects(neighbours)
+        # a db being built gets its stamp when it is finished
+        if db_engine is engine:
+            update_build_stamp(session)
+        session.commit()
+    finally:
+        session.close()
+    
+    finished = datetime.now()
+    print(f'Finished: {finished}')
+    print(f'Elapsed: {finished - started}')
+
+def has_rhyme_neighbours() -> bool:
+    """Whether the db already has the rhyme neighbours, e.g. when it is resumed or migrated."""
+    with engine.connect() as connection:
+        if connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rhyme_neighbours'").first() is None:
+            return False
+        return connection.exec_driver_sql('SELECT 1 FROM rhyme_neighbours LIMIT 1').first() is not None
+
+def generate_mapped_index(file_name: str=mapped_index_file) -> None:
+    """Writes the words of the db into the index file which the lookups can map
+    instead of querying the db (see `data/mapped_index.py`).
+    """
+    started = datetime.now()
+    print(f'Started writing the mapped index: {started}')
+    
+    index = RhymeIndex.load(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        build_stamp = session.query(BuildStamp.stamp).scalar()
+    finally:
+        session.close()
+    size = write_mapped_index(index, file_name, build_stamp)
+    print(f'{len(index)} words in {len(index.buckets)} buckets, {size / 2**20:.1f} MiB written to {file_name}')
+    
+    finished = datetime.now()
+    print(f'Finished: {finished}')
+    print(f'Elapsed: {finished - started}')
+
+def check_db(batch_size: int=1000) -> bool:
+    """Compares the words of the db with the words produced by a serial build."""
+    print('Checking the db against a serial build...')
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        db_words = session.query(Word).order_by(Word.word_id)
+        serial_words = sorted(hagen.get_words(processes=1, batch_size=batch_size), key=lambda w: w.word_id)
+        for db_word, serial_word in it.zip_longest(db_words, serial_words):
+            if db_word is None or serial_word is None or word_values(db_word) != word_values(serial_word):
+                print(f'The db differs: {db_word!r} != {serial_word!r}')
+                return False
+    finally:
+        session.close()
+    print('The db is the same')
+    return True
+
+def word_values(word: Word) -> hagen.WordValues:
+    return (word.word_id, word.lemma_id, word.spell, word.trans, word.rhyme, word.rhyme_parts, word.gram, word.gram_mask)
+
 if __name__ == '__main__':
-    generate_db()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--top-rhymes', type=int, default=0, metavar='K',
+        help='also precompute K best rhyming lemmas for every word')
+    parser.add_argument('--neighbour-distance', type=int, default=None, metavar='D',
+        help='find the basic rhymes within the distance D of each other for the extended lookups anew (0 to skip); '
+            f'by default, they are found within {max_neighbour_distance} only if the db has none')
+    parser.add_argument('--resume', action='store_true',
+        help='work on the existing db instead of regenerating it, e.g. continue computing top rhymes '
+            'or only write the mapped index')
+    parser.add_argument('--processes', type=int, default=None,
+        help='number of worker processes (by default, the number of CPUs; 1 builds in a single process)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+        help='number of dictionary articles sent to a worker process at once')
+    parser.add_argument('--migrate', action='store_true',
+        help='move the words of a db built by an older version into the current tables instead of regenerating it')
+    parser.add_argument('--bulk', action='store_true',
+        help='build the db into a temporary file with plain SQL and then replace the db file')
+    parser.add_argument('--mapped-index', nargs='?', const=mapped_index_file, metavar='FILE',
+        help=f'also write the words into an index file the lookups can map instead of querying the db '
+            f'(by default, {mapped_index_file})')
+    parser.add_argument('--check', action='store_true',
+        help='make sure the db is the same as if built in a single process')
+    args = parser.parse_args()
+    
+    neighbour_distance = args.neighbour_distance
+    top_rhymes_k = args.top_rhymes
+    if args.resume:
+        pass
+    elif args.migrate:
+        migrate_db()
+    elif args.bulk:
+        # the new db replaces the old one with all its tables at once
+        generate_db_bulk(args.processes, args.batch_size,
+            max_neighbour_distance if neighbour_distance is None else neighbour_distance, top_rhymes_k)
+        neighbour_distance, top_rhymes_k = 0, 0
+    else:
+        generate_db(args.processes, args.batch_size)
+    if args.check and not check_db(args.batch_size):
+        sys.exit(1)
+    # finding them again would change the build stamp and clear the caches of the running app
+    if neighbour_distance is None:
+        neighbour_distance = 0 if has_rhyme_neighbours() else max_neighbour_distance
+    if neighbour_distance > 0:
+        generate_rhyme_neighbours(neighbour_distance)
+    if top_rhymes_k > 0:
+        generate_top_rhymes(top_rhymes_k, args.processes)
+    if args.mapped_index:
+        generate_mapped_index(args.mapped_index)
@@ -1,12 +1,18 @@
-from typing import Iterable, List, Dict, Set, Type, TypeVar
+from typing import TYPE_CHECKING, Iterable, List, Dict, Optional, Set, Tuple, Type, TypeVar
 from dataclasses import dataclass
+import os
 import re
+import multiprocessing
 import more_itertools as mit
-from data.data_model import Word
-from phonetics.phonetizer import phonetize
-from phonetics.rhyme import get_basic_rhyme
+from phonetics.phonetizer import phonetize_many
+from phonetics.rhyme import get_basic_rhyme_many, encode_rhyme
 from phonetics.accent import normalize_accented_spell, normalize_spell
-from morphology.features import morph_abbr
+from morphology.features import morph_abbr, features_to_mask
+
+# SQLAlchemy is imported only when the words are made,
+# so that reading the dictionary (e.g. in the processes of a pool) doesn't wait for it
+if TYPE_CHECKING:
+    from data.data_model import Word
 
 file_name = 'data/hagen-morph.txt'
 file_encoding = 'windows-1251'
@@ -67,21 +73,57 @@ class Article:
         return list(groups.values())
 
 
-def get_words() -> Iterable[Word]:
-    for article in get_articles():
-        yield from get_article_words(article)
+# arguments of the `Word` constructor
+WordValues = Tuple[int, int, str, str, str, str, str, int]
 
-def get_articles() -> Iterable[Article]:
+def get_words(processes: Optional[int]=1, batch_size: int=1000) -> Iterable['Word']:
+    """Yields the words of the dictionary in the order of the file.
+    See `get_word_values` for the meaning of the arguments.
+    """
+    from data.data_model import Word
+    return (Word(*values) for values in get_word_values(processes, batch_size))
+
+def get_word_values(processes: Optional[int]=1, batch_size: int=1000) -> Iterable[WordValues]:
+    """Yields the values of the words of the dictionary in the order of the file.
+    
+    With more than one process (`None` means the number of CPUs),
+    articles are parsed and phonetized in a process pool,
+    `batch_size` articles per task.
+    """
+    if processes == 1:
+        for article in get_articles():
+            yield from get_article_word_values(article)
+        return
+    
+    processes = processes or os.cpu_count() or 1
+    batches = mit.chunked(get_article_lines(), batch_size)
+    with multiprocessing.Pool(processes) as pool:
+        # the pool reads its input eagerly, so it gets a few batches per process at a time
+        for window in mit.chunked(batches, 4 * processes):
+            # `imap` keeps the order of the batches, so the result is the same as in one process
+            for batch_values in pool.imap(get_batch_word_values, window):
+                yield from batch_values
+
+def get_article_lines() -> Iterable[List[str]]:
     with open(file_name, encoding=file_encoding) as file:
         lines = (line.strip() for line in file)
-        line_groups = mit.split_at(lines, lambda line: line == '')
-        articles = (Article(group) for group in line_groups)
-        yield from articles
+        yield from mit.split_at(lines, lambda line: line == '')
+
+def get_articles() -> Iterable[Article]:
+    return (Article(lines) for lines in get_article_lines())
+
+def get_batch_word_values(batch: List[List[str]]) -> List[WordValues]:
+    return [values for lines in batch for values in get_article_word_values(Article(lines))]
+
+def get_article_words(article: Article) -> Iterable['Word']:
+    from data.data_model import Word
+    return (Word(*values) for values in get_article_word_values(article))
 
-def get_article_words(article: Article) -> Iterable[Word]:
-    for row in article.rows:
-        trans = phonetize(row.accented_spell)
-        basic_rhyme = get_basic_rhyme(trans)
+def get_article_word_values(article: Article) -> Iterable[WordValues]:
+    # every form is met only once while building the db, so there is nothing to cache
+    transcriptions = phonetize_many((row.accented_spell for row in article.rows), use_cache=False)
+    basic_rhymes = get_basic_rhyme_many(transcriptions, use_cache=False)
+    for row, trans, basic_rhyme in zip(article.rows, transcriptions, basic_rhymes):
         if basic_rhyme:
-            gram = ''.join(row.gram)
-            yield Word(row.id, article.id, row.spell, trans, basic_rhyme, gram)
+            gram = ''.join(sorted(row.gram))
+            yield (row.id, article.id, row.spell, trans, basic_rhyme, encode_rhyme(trans), gram, features_to_mask(row.gram))
@@ -1,14 +1,23 @@
-from typing import Iterable, List, Dict, Tuple, Callable, TypeVar
+from typing import Any, Iterable, Iterator, List, Dict, Optional, Tuple, Callable, TypeVar, Union
 from dataclasses import dataclass
-from abc import ABC
+import re
+from abc import ABC, abstractmethod
 import itertools as it
-import more_itertools as mit
 from random import randrange
+import multiprocessing
+import heapq
+from functools import lru_cache, cached_property
+from sqlalchemy import func
 from sqlalchemy.orm import Session, sessionmaker
-from .phonetics.phonetizer import phonetize
-from .phonetics.rhyme import get_basic_rhyme, normalized_rhyme_distance
+from .phonetics.phonetizer import phonetize_cached, phonetize_many
+from .phonetics.rhyme import get_basic_rhyme_cached, get_basic_rhyme_many, encode_rhyme, Rhyme, parsed_rhyme_distance
+from .phonetics.vectorized import numpy_available, BucketRhymes
 from .phonetics.accent import *
-from .data.data_model import engine, Word
+from .data.data_model import db_file, mapped_index_file, engine, Word, TopRhymes, RhymeNeighbour, RandomWord
+from .data.rhyme_index import RhymeIndex, IndexedWord
+from .data.mapped_index import MappedRhymeIndex
+from .data.serving import create_serving_engine, warm_up
+from .lookup_metrics import timed_stage, record_bucket_size
 
 @dataclass
 class RhymeResult:
@@ -16,130 +25,741 @@ class RhymeResult:
     ending: str
     transcription: str
     distance: float
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'orthography': self.orthogaphy,
+            'ending': self.ending,
+            'transcription': self.transcription,
+            'distance': self.distance,
+        }
 
 @dataclass
 class LookupResult(ABC):
     prettified_input_word: str
+    
+    @abstractmethod
+    def to_dict(self) -> Dict[str, Any]:
+        """The result as served by the JSON API."""
 
 @dataclass
 class LookupResultVariants(LookupResult):
     variants: List[str]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {'input_word': self.prettified_input_word, 'variants': self.variants}
 
 @dataclass
 class LookupResultRhymes(LookupResult):
     rhymes: List[List[RhymeResult]]
+    # the number of all rhyming lemmas, of which `rhymes` may be just a page
+    lemma_count: int = 0
+    # the cursor of the next page, if there is one
+    next_cursor: Optional[int] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'input_word': self.prettified_input_word,
+            'rhymes': [[form.to_dict() for form in lemma] for lemma in self.rhymes],
+            'lemma_count': self.lemma_count,
+            'next_cursor': self.next_cursor,
+        }
 
 LookupResult.register(LookupResultVariants)
 LookupResult.register(LookupResultRhymes)
 
+# The endings come from the requests and are matched against every rhyming word,
+# so only the regexes without repetitions are accepted: letters, any letter ".",
+# classes of letters "[ая]" or "[^ая]" and alternatives "|".
+safe_ending_regex = re.compile(r'(?:[^\W\d_]|\.|\||\[\^?[^\W\d_]+\])*')
+max_ending_length = 32
+
+@dataclass(frozen=True)
+class RhymeFilter:
+    """Chooses the rhyming words of a lookup."""
+    # a regex (see `safe_ending_regex`) the end of the orthography or of the transcription must match
+    ending: str = ''
+    # the words must have any of these grammatical features (see `morphology.features`), 0 means any words
+    gram_mask: int = 0
+    # the words may also come from the buckets whose basic rhymes are within this
+    # `basic_rhyme_distance` from the one of the query (see `phonetics.rhyme_neighbours`), 0 means only its own bucket
+    near: int = 0
+    
+    @cached_property
+    def ending_pattern(self) -> 're.Pattern[str]':
+        """Raises `ValueError` if the ending is too long or not one of the safe regexes."""
+        if len(self.ending) > max_ending_length:
+            raise ValueError(f'The ending must be at most {max_ending_length} characters long')
+        if not safe_ending_regex.fullmatch(self.ending):
+            raise ValueError('The ending may only contain letters, ".", "|" and classes of letters like "[ая]"')
+        return re.compile(f'(?:{self.ending})$')
+    
+    def matches_ending(self, word: 'AnyWord') -> bool:
+        if not self.ending:
+            return True
+        pattern = self.ending_pattern
+        return bool(pattern.search(get_orthography(word)) or pattern.search(word.trans))
+
+no_filter = RhymeFilter()
+
 
 Session = sessionmaker(bind=engine)
 
-def lookup_word(query: str) -> LookupResult:
+AnyWord = Union[Word, IndexedWord]
+
+class WordSource(ABC):
+    """Where lookups take the words from."""
+    @abstractmethod
+    def words_by_spell(self, spell: str) -> Iterable[AnyWord]: ...
+    
+    @abstractmethod
+    def rhyming_words(self, word: AnyWord, gram_mask: int=0) -> Iterable[AnyWord]:
+        """Words with the same basic rhyme which are not forms of the same lemma,
+        ordered by lemma_id.
+        With `gram_mask`, only the words having any of its features.
+        """
+    
+    @abstractmethod
+    def random_word(self) -> AnyWord: ...
+    
+    def top_rhyming_lemma_ids(self, word: AnyWord) -> Optional[List[int]]:
+        """The best rhyming lemmas precomputed by `db_generation.py`, if any."""
+        return None
+    
+    @abstractmethod
+    def lemma_forms(self, rhyme: str, lemma_ids: List[int]) -> Iterable[AnyWord]:
+        """Words of the bucket which are forms of the lemmas, ordered by lemma_id."""
+    
+    @abstractmethod
+    def bucket_words(self, rhyme: str, gram_mask: int=0) -> Iterable[AnyWord]:
+        """All the words with the basic rhyme, ordered by lemma_id.
+        With `gram_mask`, only the words having any of its features.
+        """
+    
+    def neighbour_rhymes(self, rhyme: str, max_distance: int) -> List[str]:
+        """The basic rhymes within `max_distance` found by `db_generation.py`, closest first."""
+        return []
+    
+    def close(self) -> None:
+        pass
+
+class SqlWordSource(WordSource):
+    """Queries the db through the ORM."""
+    def __init__(self) -> None:
+        self.session = Session()
+        self.word_count: Optional[int] = None
+    
+    def words_by_spell(self, spell: str) -> Iterable[Word]:
+        yield from self.session.query(Word).filter_by(spell=spell)
+    
+    def rhyming_words(self, word: AnyWord, gram_mask: int=0) -> Iterable[Word]:
+        query = (self.session.query(Word)
+            .filter(Word.rhyme == word.rhyme)
+            .filter(Word.lemma_id != word.lemma_id)
+        )
+        if gram_mask:
+            query = query.filter(Word.gram_mask.op('&')(gram_mask) != 0)
+        return query.order_by(Word.lemma_id)
+    
+    def random_word(self) -> Word:
+        # the words with rhymes chosen by `db_generation.py`, if the db has them
+        if has_table('random_words'):
+            max_position = self.session.query(func.max(RandomWord.position)).scalar()
+            if max_position is not None:
+                return (self.session.query(Word)
+                    .join(RandomWord, RandomWord.word_id == Word.word_id)
+                    .filter(RandomWord.position == randrange(max_position + 1))
+                    .one()
+                )
+        if self.word_count is None:
+            self.word_count = self.session.query(Word.word_id).count()
+        return self.session.query(Word).offset(randrange(self.word_count)).limit(1).one()
+    
+    def top_rhyming_lemma_ids(self, word: AnyWord) -> Optional[List[int]]:
+        # words absent in the db have the id 0
+        if not word.word_id or not has_rows('top_rhymes'):
+            return None
+        top = self.session.query(TopRhymes).filter_by(word_id=word.word_id).one_or_none()
+        return [lemma_id for lemma_id, _ in top.unpack()] if top is not None else None
+    
+    def lemma_forms(self, rhyme: str, lemma_ids: List[int]) -> Iterable[Word]:
+        if not lemma_ids:
+            return []
+        return (self.session.query(Word)
+            .filter(Word.rhyme == rhyme)
+            .filter(Word.lemma_id.in_(lemma_ids))
+            .order_by(Word.lemma_id)
+        )
+    
+    def bucket_words(self, rhyme: str, gram_mask: int=0) -> Iterable[Word]:
+        query = self.session.query(Word).filter(Word.rhyme == rhyme)
+        if gram_mask:
+            query = query.filter(Word.gram_mask.op('&')(gram_mask) != 0)
+        return query.order_by(Word.lemma_id)
+    
+    def neighbour_rhymes(self, rhyme: str, max_distance: int) -> List[str]:
+        if not has_table('rhyme_neighbours'):
+            return []
+        rows: Iterable[Tuple[str]] = (self.session.query(RhymeNeighbour.neighbour)
+            .filter(RhymeNeighbour.rhyme == rhyme)
+            .filter(RhymeNeighbour.distance <= max_distance)
+            .order_by(RhymeNeighbour.distance, RhymeNeighbour.neighbour)
+        )
+        return [neighbour for neighbour, in rows]
+    
+    def close(self) -> None:
+        self.session.close()
+
+class SqliteWordSource(WordSource):
+    """Queries the db through a read-only connection of `serving_engine` with plain SQL,
+    which the `sqlite3` module prepares once per connection.
+    Returns `IndexedWord`s, which are much cheaper to make than ORM objects.
+    """
+    columns = 'word_id, lemma_id, spell, trans, rhyme, rhyme_parts, gram, gram_mask, orth, stem_len'
+    by_spell = f'SELECT {columns} FROM words WHERE spell = ?'
+    rhyming = f'SELECT {columns} FROM words WHERE rhyme = ? AND lemma_id != ? ORDER BY lemma_id'
+    rhyming_with_gram = f'SELECT {columns} FROM words WHERE rhyme = ? AND lemma_id != ? AND gram_mask & ? != 0 ORDER BY lemma_id'
+    bucket = f'SELECT {columns} FROM words WHERE rhyme = ? ORDER BY lemma_id'
+    bucket_with_gram = f'SELECT {columns} FROM words WHERE rhyme = ? AND gram_mask & ? != 0 ORDER BY lemma_id'
+    top_rhymes = 'SELECT lemma_ids FROM top_rhymes WHERE word_id = ?'
+    neighbours = 'SELECT neighbour FROM rhyme_neighbours WHERE rhyme = ? AND distance <= ? ORDER BY distance, neighbour'
+    max_random_position = 'SELECT max(position) FROM random_words'
+    random = f'SELECT {columns} FROM random_words JOIN words USING (word_id) WHERE position = ?'
+    
+    def __init__(self, engine: Any) -> None:
+        self.connection = engine.raw_connection()
+    
+    def query(self, sql: str, *params: Any) -> List[IndexedWord]:
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        return [IndexedWord(*row) for row in cursor]
+    
+    def words_by_spell(self, spell: str) -> Iterable[IndexedWord]:
+        return self.query(self.by_spell, spell)
+    
+    def rhyming_words(self, word: AnyWord, gram_mask: int=0) -> Iterable[IndexedWord]:
+        if gram_mask:
+            return self.query(self.rhyming_with_gram, word.rhyme, word.lemma_id, gram_mask)
+        return self.query(self.rhyming, word.rhyme, word.lemma_id)
+    
+    def random_word(self) -> IndexedWord:
+        cursor = self.connection.cursor()
+        if has_table('random_words'):
+            cursor.execute(self.max_random_position)
+            max_position, = cursor.fetchone()
+            if max_position is not None:
+                return self.query(self.random, randrange(max_position + 1))[0]
+        cursor.execute('SELECT count(*) FROM words')
+        word_count, = cursor.fetchone()
+        return self.query(f'SELECT {self.columns} FROM words LIMIT 1 OFFSET ?', randrange(word_count))[0]
+    
+    def top_rhyming_lemma_ids(self, word: AnyWord) -> Optional[List[int]]:
+        # words absent in the db have the id 0
+        if not word.word_id or not has_rows('top_rhymes'):
+            return None
+        cursor = self.connection.cursor()
+        cursor.execute(self.top_rhymes, (word.word_id,))
+        row = cursor.fetchone()
+        return TopRhymes.unpack_lemma_ids(row[0]) if row is not None else None
+    
+    def lemma_forms(self, rhyme: str, lemma_ids: List[int]) -> Iterable[IndexedWord]:
+        if not lemma_ids:
+            return []
+        # the number of lemmas varies, so the statement is cached for every number
+        placeholders = ', '.join('?' * len(lemma_ids))
+        return self.query(f'SELECT {self.columns} FROM words WHERE rhyme = ? AND lemma_id IN ({placeholders}) ORDER BY lemma_id',
+            rhyme, *lemma_ids)
+    
+    def bucket_words(self, rhyme: str, gram_mask: int=0) -> Iterable[IndexedWord]:
+        if gram_mask:
+            return self.query(self.bucket_with_gram, rhyme, gram_mask)
+        return self.query(self.bucket, rhyme)
+    
+    def neighbour_rhymes(self, rhyme: str, max_distance: int) -> List[str]:
+        if not has_table('rhyme_neighbours'):
+            return []
+        cursor = self.connection.cursor()
+        cursor.execute(self.neighbours, (rhyme, max_distance))
+        return [neighbour for neighbour, in cursor]
+    
+    def close(self) -> None:
+        # returns the connection to the pool
+        self.connection.close()
+
+AnyIndex = Union[RhymeIndex, MappedRhymeIndex]
+
+class IndexWordSource(WordSource):
+    """Serves the words from the in-memory `RhymeIndex` or from the mapped file of `MappedRhymeIndex`."""
+    def __init__(self, index: AnyIndex) -> None:
+        self.index = index
+    
+    def words_by_spell(self, spell: str) -> Iterable[IndexedWord]:
+        return self.index.words_by_spell(spell)
+    
+    def rhyming_words(self, word: AnyWord, gram_mask: int=0) -> Iterable[IndexedWord]:
+        return self.index.rhyming_words(word.rhyme, word.lemma_id, gram_mask)
+    
+    def random_word(self) -> IndexedWord:
+        return self.index.random_word()
+    
+    def lemma_forms(self, rhyme: str, lemma_ids: List[int]) -> Iterable[IndexedWord]:
+        lemma_id_set = set(lemma_ids)
+        start, end = self.index.bucket_range(rhyme)
+        return (self.index.word(row) for row in range(start, end) if self.index.lemma_ids[row] in lemma_id_set)
+    
+    def bucket_words(self, rhyme: str, gram_mask: int=0) -> Iterable[IndexedWord]:
+        start, end = self.index.bucket_range(rhyme)
+        gram_masks = self.index.gram_masks
+        return (self.index.word(row) for row in range(start, end) if not gram_mask or gram_masks[row] & gram_mask)
+    
+    def neighbour_rhymes(self, rhyme: str, max_distance: int) -> List[str]:
+        return self.index.neighbour_rhymes(rhyme, max_distance)
+    
+    def rhyming_words_with_vectorized_dists(self, word: AnyWord, rhyme_filter: RhymeFilter=no_filter,
+                                            rhyme: Optional[str]=None) -> Iterable[Tuple[IndexedWord, float]]:
+        """The same as `get_rhyming_words_with_dists` but scores the whole bucket at once.
+        The bucket is the one of the word unless another basic `rhyme` is given.
+        The encoded bucket is kept in the index for the next lookups.
+        """
+        index = self.index
+        rhyme = word.rhyme if rhyme is None else rhyme
+        start, end = index.bucket_range(rhyme)
+        bucket_rhymes = index.bucket_cache.get(rhyme)
+        if bucket_rhymes is None:
+            bucket_rhymes = BucketRhymes([Rhyme.decode(index.rhyme_parts[row]) for row in range(start, end)])
+            index.bucket_cache[rhyme] = bucket_rhymes
+        
+        dists = bucket_rhymes.distances_from(Rhyme.decode(word.rhyme_parts)).tolist()
+        rows = index.rhyming_rows(rhyme, word.lemma_id, rhyme_filter.gram_mask)
+        words = ((index.word(row), dists[row - start]) for row in rows)
+        return ((w, dist) for w, dist in words if rhyme_filter.matches_ending(w))
+
+# When set, lookups are served from the index (in memory or mapped from its file) instead of the db.
+rhyme_index: Optional[AnyIndex] = None
+
+# When set, lookups query the db through its read-only connections instead of the ORM.
+serving_engine: Optional[Any] = None
+
+# Whether to score whole buckets of the in-memory index with NumPy.
+use_vectorized_distances = numpy_available
+
+# Whether to limit the rhymes of the words from the db to the precomputed top ones
+# instead of scoring the whole bucket.
+use_top_rhymes = True
+
+@lru_cache(maxsize=None)
+def has_table(name: str) -> bool:
+    """Whether the db has the table. Older dbs lack the precomputed ones."""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+        return cursor.fetchone() is not None
+    finally:
+        connection.close()
+
+@lru_cache(maxsize=None)
+def has_rows(name: str) -> bool:
+    """Whether the table of the db has any rows. The precomputed tables are created
+    by every build but filled only on request, so an empty one isn't queried.
+    Like `has_table`, the answer is kept until the build stamp changes (see `lookup_cache.py`).
+    """
+    if not has_table(name):
+        return False
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f'SELECT 1 FROM {name} LIMIT 1')
+        return cursor.fetchone() is not None
+    finally:
+        connection.close()
+
+def load_rhyme_index(fallback_to_sql: bool=True) -> Optional[RhymeIndex]:
+    """Loads the whole db into memory to serve the following lookups from there.
+    If the db can't be loaded (e.g. it is generated by an older version),
+    the lookups keep being served as before or, without `fallback_to_sql`, the error is raised.
+    """
+    global rhyme_index
+    try:
+        index = RhymeIndex.load(engine)
+    except Exception:
+        if not fallback_to_sql:
+            raise
+        return None
+    rhyme_index = index
+    return index
+
+def load_mapped_index(file_name: str=mapped_index_file, fallback_to_sql: bool=True) -> Optional[MappedRhymeIndex]:
+    """Maps the index file written by `db_generation.py --mapped-index` to serve the following lookups from it.
+    If the file can't be opened (e.g. it is missing or written by another version),
+    the lookups keep being served as before or, without `fallback_to_sql`, the error is raised.
+    """
+    global rhyme_index
+    try:
+        index = MappedRhymeIndex(file_name)
+    except (OSError, ValueError):
+        if not fallback_to_sql:
+            raise
+        return None
+    rhyme_index = index
+    return index
+
+def reload_rhyme_index() -> None:
+    """Reloads the in-memory index after the db has been rebuilt,
+    or opens the mapped index file again after it has been rewritten.
+    The previous index is kept serving until the new one is loaded;
+    if loading fails, the error is raised and the previous index stays.
+    """
+    global rhyme_index
+    if isinstance(rhyme_index, RhymeIndex):
+        rhyme_index = RhymeIndex.load(engine)
+    elif isinstance(rhyme_index, MappedRhymeIndex):
+        rhyme_index = MappedRhymeIndex(rhyme_index.file_name)
+
+def serving_mapped_index() -> Optional[MappedRhymeIndex]:
+    """The mapped index the lookups are served from, if they are."""
+    return rhyme_index if isinstance(rhyme_index, MappedRhymeIndex) else None
+
+def use_read_only_db(mmap_size: int=256 * 2**20, cache_size_kib: int=64 * 2**10,
+                     immutable: bool=False, pool_size: int=16, warm: bool=True) -> float:
+    """Makes the following lookups query the db with `SqliteWordSource`
+    (see `data.serving.create_serving_engine` for the meaning of the arguments).
+    With `warm`, reads the indexes of the db right away and returns the number of seconds it took.
+    """
+    global serving_engine
+    serving_engine = create_serving_engine(db_file, mmap_size, cache_size_kib, immutable, pool_size)
+    return warm_up(serving_engine) if warm else 0.0
+
+def dispose_engines() -> None:
+    """Closes the pooled connections, e.g. after the db file has been replaced.
+    The connections in use are closed when they are returned.
+    """
+    engine.dispose()
+    if serving_engine is not None:
+        serving_engine.dispose()
+
+def forget_inherited_connections() -> None:
+    """Drops the pooled connections a child process has inherited without closing them,
+    since they still belong to the parent. Runs as the initializer of the process pools.
+    """
+    engine.dispose(close=False)
+    if serving_engine is not None:
+        serving_engine.dispose(close=False)
+
+def open_word_source() -> WordSource:
+    if rhyme_index is not None:
+        return IndexWordSource(rhyme_index)
+    elif serving_engine is not None:
+        return SqliteWordSource(serving_engine)
+    else:
+        return SqlWordSource()
+
+def lookup_word(query: str, limit: Optional[int]=None, cursor: int=0,
+                rhyme_filter: RhymeFilter=no_filter) -> LookupResult:
     """Returns an object containing
     the prettified version of the input word,
     and either a list of possible accented forms if there are more than one
     or a list of rhymes otherwise.
+    With `limit`, only that many best rhyming lemmas are returned,
+    starting from `cursor` (see `LookupResultRhymes.next_cursor`).
+    Only the rhyming words passing `rhyme_filter` are scored and returned.
     """
-    session = Session()
+    source = open_word_source()
     try:
-        normalized = normalize_accented_spell(query)
-        is_accented = is_correctly_accented(normalized)
-        spell = normalize_spell(normalized)
-       
-        words = get_words_by_spell(session, spell)
-        
-        # TODO: do something with the mess below
-        
-        words_by_accent = sorted(group_by(words, get_accent).items(), key=lambda aw: aw[0])
-        if is_accented:
-            words_by_accent = [(a, w) for a, w in words_by_accent if a == normalized]
-        
-        # the word is absent in the database
-        if len(words_by_accent) == 0:
-            variants = [normalized] if is_accented else get_accent_variants(spell)
-            words_by_accent = [(accented, [create_word(spell, accented)]) for accented in variants]
-        
-        # more than one variant of accenting exist
-        if len(words_by_accent) > 1:
-            return LookupResultVariants(
-                prettify_accent_marks(spell),
-                [prettify_accent_marks(accented) for accented, _ in words_by_accent]
-            )
-        # only one variant of accenting exists
-        else:
-            accented, word_list = words_by_accent[0]
-            # for now, just using the first word. TODO: use all words
-            word = word_list[0]
-            rhyming_words_with_dists = get_rhyming_words_with_dists(session, word)
-            return LookupResultRhymes(
-                prettify_accent_marks(accented),
-                group_by_lemma(rhyming_words_with_dists)
-            )
+        with timed_stage('find'):
+            found = find_word(source, query)
+        if isinstance(found, LookupResultVariants):
+            return found
+        accented, word = found
+        rhyming_words_with_dists = get_rhyming_words_with_dists(source, word, rhyme_filter)
+        return make_rhymes_result(accented, rhyming_words_with_dists, limit, cursor)
     finally:
-        session.close()
+        source.close()
 
-def lookup_random_word() -> LookupResultRhymes:
+def lookup_word_stream(query: str, limit: Optional[int]=None, cursor: int=0,
+                       rhyme_filter: RhymeFilter=no_filter) -> Iterator[Union[LookupResult, List[RhymeResult]]]:
+    """The same as `lookup_word` but yields the result piece by piece:
+    first the result without rhymes, right away,
+    and then at most `limit` rhyming lemmas one by one, best first, starting from `cursor`.
+    """
+    source = open_word_source()
+    try:
+        with timed_stage('find'):
+            found = find_word(source, query)
+        if isinstance(found, LookupResultVariants):
+            yield found
+            return
+        accented, word = found
+        yield LookupResultRhymes(prettify_accent_marks(accented), [])
+        lemmas = iter_lemmas(get_rhyming_words_with_dists(source, word, rhyme_filter))
+        yield from it.islice(lemmas, cursor, cursor + limit if limit is not None else None)
+    finally:
+        source.close()
+
+def find_word(source: WordSource, query: str) -> Union[LookupResultVariants, Tuple[str, AnyWord]]:
+    """Returns either the accent variants of the query if it is ambiguous,
+    or its only accented form and the word to look up the rhymes of.
+    """
+    normalized = normalize_accented_spell(query)
+    is_accented = is_correctly_accented(normalized)
+    spell = normalize_spell(normalized)
+   
+    words = source.words_by_spell(spell)
+    
+    # TODO: do something with the mess below
+    
+    words_by_accent = sorted(group_by(words, get_accent).items(), key=lambda aw: aw[0])
+    if is_accented:
+        words_by_accent = [(a, w) for a, w in words_by_accent if a == normalized]
+    
+    # the word is absent in the database
+    if len(words_by_accent) == 0:
+        variants = [normalized] if is_accented else list(get_accent_variants(spell))
+        words_by_accent = [(accented, [word]) for accented, word in zip(variants, create_words(spell, variants))]
+    
+    # more than one variant of accenting exist
+    if len(words_by_accent) > 1:
+        return LookupResultVariants(
+            prettify_accent_marks(spell),
+            [prettify_accent_marks(accented) for accented, _ in words_by_accent]
+        )
+    # only one variant of accenting exists
+    else:
+        accented, word_list = words_by_accent[0]
+        # for now, just using the first word. TODO: use all words
+        return accented, word_list[0]
+
+def lookup_words(queries: Iterable[str], limit: Optional[int]=None,
+                 rhyme_filter: RhymeFilter=no_filter, processes: int=1) -> List[LookupResult]:
+    """The same as `lookup_word` for every query, in the input order.
+    Repeating queries are looked up once, and the queries with the same basic rhyme
+    share reading and parsing the bucket (see `get_bucket_rhyming_words_with_dists`).
+    With more than one process, the buckets are scored in a process pool.
+    """
+    source = open_word_source()
+    try:
+        found: Dict[str, Union[LookupResultVariants, Tuple[str, AnyWord]]] = {}
+        normalized_queries = [normalize_accented_spell(query) for query in queries]
+        with timed_stage('find'):
+            for normalized in normalized_queries:
+                if normalized not in found:
+                    found[normalized] = find_word(source, normalized)
+    finally:
+        source.close()
+    
+    results: Dict[str, LookupResult] = {n: f for n, f in found.items() if isinstance(f, LookupResultVariants)}
+    # (normalized query, accented, word) by basic rhyme
+    buckets = group_by(
+        ((n, f[0], as_indexed_word(f[1])) for n, f in found.items() if not isinstance(f, LookupResultVariants)),
+        lambda nw: nw[2].rhyme
+    )
+    tasks = [(words, limit, rhyme_filter) for words in buckets.values()]
+    if processes > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(processes, initializer=forget_inherited_connections) as pool:
+            for bucket_results in pool.imap_unordered(lookup_bucket, tasks):
+                results.update(bucket_results)
+    else:
+        for task in tasks:
+            results.update(lookup_bucket(task))
+    return [results[normalized] for normalized in normalized_queries]
+
+# words with the same basic rhyme as (normalized query, accented, word), the limit and the filter
+BucketTask = Tuple[List[Tuple[str, str, IndexedWord]], Optional[int], RhymeFilter]
+
+def lookup_bucket(task: BucketTask) -> List[Tuple[str, LookupResultRhymes]]:
+    """Returns the results of the queries of `lookup_words` with the same basic rhyme."""
+    words, limit, rhyme_filter = task
+    source = open_word_source()
+    try:
+        words_with_dists = get_bucket_rhyming_words_with_dists(source, [word for _, _, word in words], rhyme_filter)
+        return [(normalized, make_rhymes_result(accented, rhyming, limit))
+            for (normalized, accented, _), rhyming in zip(words, words_with_dists)]
+    finally:
+        source.close()
+
+def as_indexed_word(word: AnyWord) -> IndexedWord:
+    """A word which can be sent to another process."""
+    return IndexedWord(word.word_id, word.lemma_id, word.spell, word.trans, word.rhyme, word.rhyme_parts,
+        word.gram, word.gram_mask, word.orth, word.stem_len)
+
+def lookup_random_word(limit: Optional[int]=None) -> LookupResultRhymes:
     """Gets a random word from the db and returns an object containing
     the prettified version of the word and a list of its rhymes.
+    The word sources pick from the words known to have rhymes,
+    so the loop below only retries for dbs made by older versions.
     """
-    session = Session()
+    source = open_word_source()
     try:
-        count = session.query(Word.word_id).count()
-        
         while True:
-            random = randrange(count)
-            word = session.query(Word).offset(random).limit(1).one()
+            word = source.random_word()
             if not any(word.rhyme.endswith(num) for num in "456789"):
-                rhyming_words_with_dists = list(get_rhyming_words_with_dists(session, word))
+                rhyming_words_with_dists = list(get_rhyming_words_with_dists(source, word))
                 if len(rhyming_words_with_dists) > 0:
                     break
             # try again if there are no rhymes
         
         accented = get_accent(word)
-        return LookupResultRhymes(
-            prettify_accent_marks(accented),
-            group_by_lemma(rhyming_words_with_dists)
-        )
+        return make_rhymes_result(accented, rhyming_words_with_dists, limit)
     finally:
-        session.close()
+        source.close()
 
 
 def create_word(spell: str, accented: str) -> Word:
-    trans = phonetize(accented)
-    basic_rhyme = get_basic_rhyme(trans)
-    return Word(0, 0, spell, trans, basic_rhyme, '')
-
-def get_words_by_spell(session: Session, spell: str) -> Iterable[Word]:
-    yield from session.query(Word).filter_by(spell=spell)
-
-def get_rhyming_words_with_dists(session: Session, word: Word) -> Iterable[Tuple[Word, float]]:
-    rhyming_words = (session.query(Word)
-        .filter(Word.rhyme == word.rhyme)
-        .filter(Word.lemma_id != word.lemma_id)
-        .order_by(Word.lemma_id)
+    trans = phonetize_cached(accented)
+    basic_rhyme = get_basic_rhyme_cached(trans)
+    return Word(0, 0, spell, trans, basic_rhyme, encode_rhyme(trans), '')
+
+def create_words(spell: str, accented_variants: Iterable[str]) -> List[Word]:
+    """Creates words absent in the db for all the accent variants at once,
+    reusing the cached transcriptions of the variants looked up before.
+    """
+    variants = list(accented_variants)
+    transcriptions = phonetize_many(variants)
+    basic_rhymes = get_basic_rhyme_many(transcriptions)
+    return [Word(0, 0, spell, trans, basic_rhyme, encode_rhyme(trans), '') for trans, basic_rhyme in zip(transcriptions, basic_rhymes)]
+
+def get_rhyming_words_with_dists(source: WordSource, word: AnyWord,
+                                 rhyme_filter: RhymeFilter=no_filter) -> List[Tuple[AnyWord, float]]:
+    with timed_stage('fetch'):
+        # the top rhymes of a word may have no words passing a filter, so filtered lookups score the whole bucket
+        top_lemma_ids = source.top_rhyming_lemma_ids(word) if use_top_rhymes and rhyme_filter == no_filter else None
+        neighbours = source.neighbour_rhymes(word.rhyme, rhyme_filter.near) if rhyme_filter.near > 0 else []
+    if top_lemma_ids is None and isinstance(source, IndexWordSource) and use_vectorized_distances:
+        # the bucket is already in memory
+        with timed_stage('score'):
+            words_with_dists = [wd for rhyme in [word.rhyme, *neighbours]
+                for wd in source.rhyming_words_with_vectorized_dists(word, rhyme_filter, rhyme)]
+    else:
+        with timed_stage('fetch'):
+            if top_lemma_ids is not None:
+                rhyming_words = list(source.lemma_forms(word.rhyme, top_lemma_ids))
+            else:
+                # the grammatical features are checked by the db, the ending before scoring
+                rhyming_words = [w for w in source.rhyming_words(word, rhyme_filter.gram_mask) if rhyme_filter.matches_ending(w)]
+                for rhyme in neighbours:
+                    rhyming_words += [w for w in source.bucket_words(rhyme, rhyme_filter.gram_mask)
+                        if w.lemma_id != word.lemma_id and rhyme_filter.matches_ending(w)]
+        with timed_stage('score'):
+            # the query word is parsed once, the rhyming ones are stored pre-parsed
+            parsed = Rhyme.decode(word.rhyme_parts)
+            words_with_dists = [(rhyming_word, get_word_distance(parsed, rhyming_word)) for rhyming_word in rhyming_words]
+    if neighbours:
+        # `group_by_lemma` expects the forms of a lemma to be next to each other
+        words_with_dists.sort(key=lambda wd: wd[0].lemma_id)
+    record_bucket_size(len(words_with_dists))
+    return words_with_dists
+
+def get_bucket_rhyming_words_with_dists(source: WordSource, words: List[AnyWord],
+                                        rhyme_filter: RhymeFilter=no_filter) -> List[List[Tuple[AnyWord, float]]]:
+    """The same as `get_rhyming_words_with_dists` for several words with the same basic rhyme,
+    but the bucket (and its neighbours) is read and its rhymes are parsed only once.
+    """
+    with timed_stage('fetch'):
+        rhymes = [words[0].rhyme]
+        if rhyme_filter.near > 0:
+            rhymes += source.neighbour_rhymes(words[0].rhyme, rhyme_filter.near)
+    if isinstance(source, IndexWordSource) and use_vectorized_distances:
+        # the index keeps the bucket encoded anyway
+        with timed_stage('score'):
+            result = [[wd for rhyme in rhymes for wd in source.rhyming_words_with_vectorized_dists(word, rhyme_filter, rhyme)]
+                for word in words]
+            if len(rhymes) > 1:
+                for words_with_dists in result:
+                    words_with_dists.sort(key=lambda wd: wd[0].lemma_id)
+        record_bucket_size(sum(map(len, result)))
+        return result
+    
+    with timed_stage('fetch'):
+        bucket = [(w, Rhyme.decode(w.rhyme_parts)) for rhyme in rhymes for w in source.bucket_words(rhyme, rhyme_filter.gram_mask)
+            if rhyme_filter.matches_ending(w)]
+        if len(rhymes) > 1:
+            # `group_by_lemma` expects the forms of a lemma to be next to each other
+            bucket.sort(key=lambda wr: wr[0].lemma_id)
+    with timed_stage('score'):
+        result = []
+        for word in words:
+            top_lemma_ids = source.top_rhyming_lemma_ids(word) if use_top_rhymes and rhyme_filter == no_filter else None
+            top_lemma_id_set = set(top_lemma_ids) if top_lemma_ids is not None else None
+            rhyme = Rhyme.decode(word.rhyme_parts)
+            result.append([(w, parsed_rhyme_distance(rhyme, r)) for w, r in bucket
+                if w.lemma_id != word.lemma_id and (top_lemma_id_set is None or w.lemma_id in top_lemma_id_set)])
+    record_bucket_size(sum(map(len, result)))
+    return result
+
+def get_word_distance(rhyme: Optional[Rhyme], w: AnyWord) -> float:
+    return parsed_rhyme_distance(rhyme, Rhyme.decode(w.rhyme_parts))
+
+def make_rhymes_result(accented: str, words_with_dists: Iterable[Tuple[AnyWord, float]],
+                       limit: Optional[int]=None, cursor: int=0) -> LookupResultRhymes:
+    with timed_stage('group'):
+        rhymes, lemma_count = group_by_lemma(words_with_dists, limit, cursor)
+    end = cursor + len(rhymes)
+    return LookupResultRhymes(
+        prettify_accent_marks(accented),
+        rhymes,
+        lemma_count,
+        end if limit is not None and end < lemma_count else None
     )
-    return ((rhyming_word, get_word_distance(word, rhyming_word)) for rhyming_word in rhyming_words)
 
-def get_word_distance(w1: Word, w2: Word) -> float:
-    return normalized_rhyme_distance(w1.trans, w2.trans)
+def group_by_lemma(words_with_dists: Iterable[Tuple[AnyWord, float]],
+                   limit: Optional[int]=None, cursor: int=0) -> Tuple[List[List[RhymeResult]], int]:
+    """Returns the lemmas ordered by (distance, len(orthography), orthography)
+    of their closest forms, and the number of all lemmas.
+    With `limit`, returns only that many lemmas starting from `cursor`,
+    and only they are sorted completely.
+    """
+    lemmas, keys, stem_lens = get_lemma_keys(words_with_dists)
+    end = len(lemmas) if limit is None else min(cursor + limit, len(lemmas))
+    if end < len(lemmas):
+        # `nsmallest` is stable, just like `sorted`
+        selected = heapq.nsmallest(end, range(len(lemmas)), key=keys.__getitem__)
+    else:
+        selected = sorted(range(len(lemmas)), key=keys.__getitem__)
+    return [group_word_forms(lemmas[i], stem_lens[i]) for i in selected[cursor:end]], len(lemmas)
+
+def iter_lemmas(words_with_dists: Iterable[Tuple[AnyWord, float]]) -> Iterator[List[RhymeResult]]:
+    """Yields the lemmas in the order of `group_by_lemma`.
+    Each next lemma is taken from a heap, so the first ones come without sorting all of them.
+    """
+    lemmas, keys, stem_lens = get_lemma_keys(words_with_dists)
+    # the index breaks ties the same way a stable sort does
+    heap = [(key, i) for i, key in enumerate(keys)]
+    heapq.heapify(heap)
+    while heap:
+        _, i = heapq.heappop(heap)
+        yield group_word_forms(lemmas[i], stem_lens[i])
 
-def group_by_lemma(words_with_dists: Iterable[Tuple[Word, float]]) -> List[List[RhymeResult]]:
-    lemmas = it.groupby(words_with_dists, lambda wd: wd[0].lemma_id)
-    result = (group_word_forms([(yoficate_by_transcription(form.spell, form.trans), form.trans, dist) for form, dist in forms_with_dists])
-        for lemma, forms_with_dists in lemmas)
-    return list(sorted(result, key=lambda lemma: (lemma[0].distance, len(lemma[0].orthogaphy), lemma[0].orthogaphy)))
+def get_lemma_keys(words_with_dists: Iterable[Tuple[AnyWord, float]]) -> Tuple[List[List[Tuple[str, str, float]]], List[Tuple[float, int, str]], List[int]]:
+    """Returns the (orthography, transcription, distance) of the forms of every lemma,
+    the sort key of every lemma: (distance, len(orthography), orthography) of its closest form,
+    and the `stem_len` of every lemma.
+    """
+    lemmas = []
+    stem_lens = []
+    for lemma, group in it.groupby(words_with_dists, lambda wd: wd[0].lemma_id):
+        forms_with_dists = list(group)
+        lemmas.append([(get_orthography(form), form.trans, dist) for form, dist in forms_with_dists])
+        stem_lens.append(forms_with_dists[0][0].stem_len)
+    keys = [min((dist, len(orth), orth) for orth, _, dist in forms) for forms in lemmas]
+    return lemmas, keys, stem_lens
 
-def group_word_forms(forms_with_dists: List[Tuple[str, str, float]]) -> List[RhymeResult]:
-    common_prefix_len = min(len(form) for form, _, _ in forms_with_dists)
-    while not mit.all_equal(form[:common_prefix_len] for form, _, _ in forms_with_dists):
-        common_prefix_len -=1
+def get_orthography(word: AnyWord) -> str:
+    """The spelling with ё, stored in the db (see `data_model.Form.orth`)
+    or computed for the words which have it unknown.
+    """
+    return word.orth or yoficate_by_transcription(word.spell, word.trans)
+
+def group_word_forms(forms_with_dists: List[Tuple[str, str, float]], stem_len: int=0) -> List[RhymeResult]:
+    """`stem_len` is the length of a prefix known to be common to the forms,
+    e.g. to all the forms of the lemma.
+    """
+    prefix_len = common_prefix_len((form for form, _, _ in forms_with_dists), stem_len)
     
     forms_with_dists.sort(key=lambda fd: (fd[2], len(fd[0]), fd[0]))
     
-    return [RhymeResult(orth, f'-{orth[common_prefix_len:]}', trans, dist) for orth, trans, dist in forms_with_dists]
+    return [RhymeResult(orth, f'-{orth[prefix_len:]}', trans, dist) for orth, trans, dist in forms_with_dists]
 
-def get_accent(word: Word) -> str:
+def get_accent(word: AnyWord) -> str:
     return get_accent_by_transcription(word.spell, word.trans)
 
 # TODO: move
@@ -0,0 +1,200 @@
+"""Caches lookup results between requests."""
+
+from typing import Any, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+import os
+import queue
+import threading
+import time
+from .lookup import LookupResult, has_table, has_rows, dispose_engines, reload_rhyme_index, serving_mapped_index
+from .phonetics.accent import normalize_accented_spell
+from .data.data_model import db_file, engine
+
+@dataclass
+class LookupCacheStats:
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0  # lookups which waited for the same lookup running in another thread
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / requests if requests else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {**asdict(self), 'hit_rate': self.hit_rate}
+
+class Flight:
+    """A lookup in progress which other threads can wait for."""
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[LookupResult] = None
+        self.error: Optional[BaseException] = None
+
+class LookupCache:
+    """Remembers the results of the latest `max_size` lookups.
+
+    Queries are normalized before looking them up, so that different
+    spellings of the same query share the result.
+    The other arguments (e.g. the page of the results) are a part of the key.
+    Concurrent lookups of the same query are run only once.
+    The cache is cleared when `db_generation.py` changes the db.
+    """
+    def __init__(self, lookup: Callable[..., LookupResult], max_size: int=10_000) -> None:
+        self.lookup = lookup
+        self.max_size = max_size
+        self.results: 'OrderedDict[Tuple[Any, ...], LookupResult]' = OrderedDict()
+        self.flights: Dict[Tuple[Any, ...], Flight] = {}
+        self.lock = threading.Lock()
+        self.stats = LookupCacheStats()
+        self.db_file_signature: Optional[tuple] = None
+        self.build_stamp: Optional[str] = None
+        # increases on every invalidation, so that results computed before it are not stored
+        self.generation = 0
+
+    def __call__(self, query: str, *args: Any) -> LookupResult:
+        normalized = normalize_accented_spell(query)
+        key = (normalized, *args)
+        self.check_db()
+
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                self.results.move_to_end(key)
+                self.stats.hits += 1
+                return result
+
+            flight = self.flights.get(key)
+            is_leader = flight is None
+            if flight is None:
+                flight = self.flights[key] = Flight()
+                self.stats.misses += 1
+            else:
+                self.stats.coalesced += 1
+            generation = self.generation
+
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            assert flight.result is not None
+            return flight.result
+
+        try:
+            flight.result = self.lookup(normalized, *args)
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if flight.result is not None and generation == self.generation:
+                    self.results[key] = flight.result
+                    if len(self.results) > self.max_size:
+                        self.results.popitem(last=False)
+                self.stats.size = len(self.results)
+            flight.done.set()
+
+    def check_db(self) -> None:
+        """Clears the cache if the build stamp of the db has changed.
+        The stamp is read only when the db file looks modified.
+        When the lookups are served from a mapped index, it is opened again whenever its file
+        looks modified, and its own build stamp is compared, since a node may have only the file.
+        A loaded index is reloaded before the cache is cleared,
+        so that the results of the old index are not stored afterwards.
+        """
+        mapped_index = serving_mapped_index()
+        mapped_file = mapped_index.file_name if mapped_index is not None else None
+        signature: Optional[tuple] = (file_signature(db_file), file_signature(mapped_file) if mapped_file is not None else None)
+        if signature == (None, None):
+            signature = None  # there is nothing to check yet
+        if signature == self.db_file_signature:
+            return
+
+        # pooled connections may still refer to the replaced db file
+        dispose_engines()
+        with self.lock:
+            if signature == self.db_file_signature:
+                return  # another thread has checked it meanwhile
+            is_first_check = self.db_file_signature is None and self.generation == 0
+            self.db_file_signature = signature
+            previous_stamp = self.build_stamp
+        try:
+            if mapped_file is None:
+                build_stamp = read_build_stamp()
+                if build_stamp != previous_stamp and not is_first_check:
+                    reload_rhyme_index()
+            else:
+                if not is_first_check:
+                    reload_rhyme_index()
+                mapped_index = serving_mapped_index()
+                build_stamp = mapped_index.build_stamp if mapped_index is not None else None
+        except Exception:
+            # e.g. the db is being replaced: the old index and its results
+            # keep being served, and the next lookup checks the db again
+            with self.lock:
+                self.db_file_signature = None
+            return
+        with self.lock:
+            if build_stamp != self.build_stamp:
+                self.build_stamp = build_stamp
+                self.results.clear()
+                has_table.cache_clear()
+                has_rows.cache_clear()
+                self.generation += 1
+                self.stats.size = 0
+                if not is_first_check:
+                    self.stats.invalidations += 1
+
+class RandomResultPool:
+    """Keeps up to `size` random lookup results computed in advance
+    by a background thread, so that requests don't wait for them.
+    When the pool is empty, the result is computed right away.
+    After the db is rebuilt, up to `size` results from the old db may still be served.
+    """
+    def __init__(self, lookup: Callable[[], LookupResult], size: int) -> None:
+        self.lookup = lookup
+        self.results: 'queue.Queue[LookupResult]' = queue.Queue(maxsize=size)
+        self.thread = threading.Thread(target=self.refill, name='random-result-pool', daemon=True)
+        self.thread.start()
+
+    def __call__(self) -> LookupResult:
+        try:
+            return self.results.get_nowait()
+        except queue.Empty:
+            return self.lookup()
+
+    def refill(self) -> None:
+        while True:
+            try:
+                result = self.lookup()
+            except Exception:
+                # e.g. the db is being replaced, the requests will report the error if it persists
+                time.sleep(1.0)
+                continue
+            self.results.put(result)  # waits while the pool is full
+
+def file_signature(file_name: str) -> Optional[tuple]:
+    """Changes when the file is modified or replaced, None if it is missing."""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def read_build_stamp() -> Optional[str]:
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'build_stamp'")
+        if cursor.fetchone() is None:
+            return None
+        cursor.execute('SELECT stamp FROM build_stamp')
+        row = cursor.fetchone()
+        return row[0] if row is not None else None
+    finally:
+        connection.close()
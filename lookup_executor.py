@@ -0,0 +1,83 @@
+"""Runs lookups in a bounded pool of threads or processes."""
+
+from typing import Any, Callable, Dict, Optional, TypeVar
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import contextvars
+import threading
+
+T = TypeVar('T')
+
+class LookupOverloaded(Exception):
+    """Too many lookups are already running or waiting for a worker."""
+
+class LookupExecutor:
+    """Runs at most `max_workers` lookups at once and lets at most `max_pending`
+    lookups (including the running ones) wait for a worker.
+    Other lookups are rejected with `LookupOverloaded` right away,
+    so that a burst of slow lookups doesn't make every request wait.
+
+    In threads, the functions run in a copy of the caller's context,
+    so they record the stage timings of the caller's request (see `lookup_metrics.py`).
+    With `use_processes`, the CPU-bound scoring doesn't compete for the GIL
+    with the threads serving the requests, but the looked up functions
+    and their arguments and results must be picklable, and the stages aren't timed.
+    Every process runs `initializer` first.
+    """
+    def __init__(self, max_workers: int, max_pending: int, use_processes: bool=False,
+                 initializer: Optional[Callable[[], None]]=None) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self.use_processes = use_processes
+        self.executor: Executor = (ProcessPoolExecutor(max_workers, initializer=initializer) if use_processes
+            else ThreadPoolExecutor(max_workers, thread_name_prefix='lookup'))
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+
+    def acquire(self) -> None:
+        """Takes a pending slot or raises `LookupOverloaded`. `submit` takes one for every lookup;
+        a lookup which runs outside the pool (e.g. a streamed one) takes it itself
+        and calls `release` when it is done, so that it counts against `max_pending` too.
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise LookupOverloaded(f'{self.max_pending} lookups are pending')
+        with self.lock:
+            self.pending += 1
+
+    def submit(self, fn: Callable[..., T], *args: Any) -> 'Future[T]':
+        self.acquire()
+        try:
+            if self.use_processes:
+                future = self.executor.submit(fn, *args)
+            else:
+                future = self.executor.submit(contextvars.copy_context().run, fn, *args)
+        except BaseException:
+            self.release(None)
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def release(self, _: Any) -> None:
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def __call__(self, fn: Callable[..., T], *args: Any) -> T:
+        """Runs the function in the pool and waits for the result."""
+        return self.submit(fn, *args).result()
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Runs the function in the pool without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'workers': self.max_workers, 'max_pending': self.max_pending,
+                'pending': self.pending, 'rejected': self.rejected}
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,141 @@
+"""Measures how long the stages of the requests take.
+
+A request starts recording its `StageTimings`, and the code it runs marks
+its stages with `timed_stage`. Outside of a request, marking a stage costs
+a context variable lookup. `LookupMetrics` aggregates the timings of the requests.
+Every process has its own metrics.
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import heapq
+import threading
+import time
+
+class StageTimings:
+    """The seconds spent on every stage of a request, and the number of rhyming words it scored."""
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.seconds: Dict[str, float] = {}
+        self.bucket_size: Optional[int] = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def finish(self) -> None:
+        self.seconds['total'] = time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """The value of the Server-Timing header."""
+        metrics = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in self.seconds.items()]
+        if self.bucket_size is not None:
+            metrics.append(f'bucket;desc="{self.bucket_size} words"')
+        return ', '.join(metrics)
+
+# the timings of the current request, if it records them
+current_timings: ContextVar[Optional[StageTimings]] = ContextVar('current_timings', default=None)
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Adds the time spent in the block to the stage of the current request.
+    A stage entered several times (e.g. by a batch lookup) accumulates the time.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stage, time.perf_counter() - started)
+
+def record_bucket_size(size: int) -> None:
+    """Adds the number of scored rhyming words to the current request."""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.bucket_size = (timings.bucket_size or 0) + size
+
+class LookupMetrics:
+    """Aggregates the timings of the requests:
+    the quantiles of every stage over its latest `window` requests,
+    the histogram of the bucket sizes and the `slowest` requests since the start.
+    """
+    quantiles = [0.5, 0.95, 0.99]
+    bucket_size_bounds = [10, 100, 1_000, 10_000, 100_000]
+
+    def __init__(self, window: int=1000, slowest: int=10) -> None:
+        self.window = window
+        self.slowest_size = slowest
+        self.lock = threading.Lock()
+        self.stage_samples: Dict[str, 'deque[float]'] = {}
+        self.stage_sums: Dict[str, float] = {}
+        self.stage_counts: Dict[str, int] = {}
+        self.bucket_size_counts = [0] * (len(self.bucket_size_bounds) + 1)
+        self.bucket_size_sum = 0
+        # a min-heap of (total seconds, path, the longest stage), so the fastest of them is replaced first;
+        # the metrics are public, so the queries themselves are not kept
+        self.slowest: List[Tuple[float, str, str]] = []
+
+    def record(self, path: str, timings: StageTimings) -> None:
+        with self.lock:
+            for stage, seconds in timings.seconds.items():
+                if stage not in self.stage_samples:
+                    self.stage_samples[stage] = deque(maxlen=self.window)
+                    self.stage_sums[stage] = 0.0
+                    self.stage_counts[stage] = 0
+                self.stage_samples[stage].append(seconds)
+                self.stage_sums[stage] += seconds
+                self.stage_counts[stage] += 1
+            if timings.bucket_size is not None:
+                self.bucket_size_counts[bisect.bisect_left(self.bucket_size_bounds, timings.bucket_size)] += 1
+                self.bucket_size_sum += timings.bucket_size
+            total = timings.seconds.get('total')
+            if total is not None:
+                stages = {stage: seconds for stage, seconds in timings.seconds.items() if stage != 'total'}
+                request = (total, path, max(stages, key=stages.__getitem__, default=''))
+                if len(self.slowest) < self.slowest_size:
+                    heapq.heappush(self.slowest, request)
+                elif request > self.slowest[0]:
+                    heapq.heapreplace(self.slowest, request)
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text format."""
+        with self.lock:
+            lines = [
+                '# HELP rifmuj_stage_seconds Time spent on the stages of the requests (quantiles over the latest requests).',
+                '# TYPE rifmuj_stage_seconds summary',
+            ]
+            for stage, samples in self.stage_samples.items():
+                ordered = sorted(samples)
+                for q in self.quantiles:
+                    value = ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+                    lines.append(f'rifmuj_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'rifmuj_stage_seconds_sum{{stage="{stage}"}} {self.stage_sums[stage]:.6f}')
+                lines.append(f'rifmuj_stage_seconds_count{{stage="{stage}"}} {self.stage_counts[stage]}')
+
+            lines += [
+                '# HELP rifmuj_bucket_size Number of rhyming words scored per request.',
+                '# TYPE rifmuj_bucket_size histogram',
+            ]
+            cumulative = 0
+            for bound, count in zip([*map(str, self.bucket_size_bounds), '+Inf'], self.bucket_size_counts):
+                cumulative += count
+                lines.append(f'rifmuj_bucket_size_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'rifmuj_bucket_size_sum {self.bucket_size_sum}')
+            lines.append(f'rifmuj_bucket_size_count {cumulative}')
+
+            lines += [
+                '# HELP rifmuj_slowest_request_seconds The slowest requests since the start.',
+                '# TYPE rifmuj_slowest_request_seconds gauge',
+            ]
+            for rank, (seconds, path, stage) in enumerate(sorted(self.slowest, reverse=True), start=1):
+                lines.append(f'rifmuj_slowest_request_seconds{{rank="{rank}",path="{escape_label(path)}",'
+                    f'stage="{stage}"}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
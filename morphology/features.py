@@ -1,3 +1,4 @@
+from typing import Iterable
 from collections import ChainMap
 
 # Uncomment only what you need
@@ -101,3 +102,17 @@ morph_features: dict[str, dict[str, str]] = {
 }
 
 morph_abbr = dict(ChainMap(*morph_features.values()))
+
+# Every feature gets a bit of `Word.gram_mask`, in the order of `morph_features`.
+feature_bits = {
+    abbr: 1 << bit
+    for bit, abbr in enumerate(abbr for feature in morph_features.values() for abbr in feature.values())
+}
+assert len(feature_bits) <= 63, 'the features must fit into a signed 64-bit integer'
+
+def features_to_mask(features: Iterable[str]) -> int:
+    """Combines the bits of the feature abbreviations, e.g. {'Nn', 'Ad'}."""
+    mask = 0
+    for abbr in features:
+        mask |= feature_bits[abbr]
+    return mask
@@ -0,0 +1,23 @@
+"""Imports the modules of the app package (e.g. `lookup.py`, which uses relative imports)
+into the scripts run from its directory, without importing the app itself:
+the package `__init__.py` creates the Flask app and, depending on the environment,
+loads the index, starts the executors and so on, which the scripts don't need.
+"""
+
+from types import ModuleType
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+package_name = os.path.basename(package_dir)
+
+def import_package_module(name: str) -> ModuleType:
+    """Imports `name` (e.g. 'lookup') as a module of the package whose `__init__.py` is not run."""
+    if package_name not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(package_name, None, is_package=True)
+        spec.submodule_search_locations = [package_dir]
+        sys.modules[package_name] = importlib.util.module_from_spec(spec)
+    return importlib.import_module(f'{package_name}.{name}')
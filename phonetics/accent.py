@@ -42,6 +42,18 @@ def yoficate_by_transcription(spell: str, trans: str) -> str:
     syllables = zip(spell_syllable.finditer(spell), trans_syllable.finditer(trans))
     return ''.join(process_syllable(s, t, False) for s, t in syllables)
 
+def common_prefix_len(strings: Iterable[str], known_len: int=0) -> int:
+    """The length of the common prefix of the strings (there must be some),
+    which is known to be at least `known_len`.
+    """
+    strings = list(strings)
+    # the prefix common to the smallest and the largest string is common to all of them
+    first, last = min(strings), max(strings)
+    length = known_len
+    while length < len(first) and first[length] == last[length]:
+        length += 1
+    return length
+
 def get_accent_by_transcription(spell: str, trans: str) -> str:
     syllables = zip(spell_syllable.finditer(spell), trans_syllable.finditer(trans))
     return ''.join(process_syllable(s, t, True) for s, t in syllables)
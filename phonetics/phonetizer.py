@@ -1,8 +1,13 @@
 from __future__ import annotations
-from typing import List, Dict, Callable, Type, TypeVar, Match
+from typing import Any, Iterable, List, Dict, Callable, Type, TypeVar, Match, Pattern
 from enum import Enum, auto
+from functools import lru_cache, cached_property
+import os
 import re
+from . import repertoire, transducer
 from .repertoire import *
+from .transducer import SyllableTransducer, tokenizer_pattern
+from .rule_cache import RuleTables, load_rule_tables
 
 class VowelPosition(Enum):
     after_hard = auto()
@@ -18,10 +23,12 @@ class VowelStress(Enum):
 VS = VowelStress  # a short alias
 
 def detect_stress(match: Match) -> VowelStress:
-    accent = match['accent']
+    return stress_by_accent(match['accent'], match['word_end'] is not None)
+
+def stress_by_accent(accent: str, word_end: bool) -> VowelStress:
     if   accent == "'": return VS.stressed
     elif accent == "`": return VS.semistressed
-    elif match['word_end'] is not None: return VS.unstressed_final
+    elif word_end: return VS.unstressed_final
     else: return VS.unstressed
 
 def phonetize_vowel(position: VowelPosition, stress: VowelStress, vowel: str) -> str:
@@ -45,8 +52,14 @@ class PhonTransform:
     Use classmethods to create transformations of different types.
     """
     def __init__(self, search_pattern: str, sub_func: Callable[[Match], str]) -> None:
-        self.searchPattern = re.compile(search_pattern, re.VERBOSE)
+        self.search_pattern = search_pattern
         self.sub_func = sub_func
+        self.rule_dict: Dict[Any, Any] = {}
+    
+    @cached_property
+    def searchPattern(self) -> Pattern:
+        # compiled on the first use, since the compiled engine never applies some of the transformations
+        return re.compile(self.search_pattern, re.VERBOSE)
     
     def apply_to(self, string: str) -> str:
         """Returns the result of the transformation application to the argument string."""
@@ -72,9 +85,11 @@ class PhonTransform:
         When combining rules into a single dictionary, the latest
         rules in the list have priority over the preceding ones.
         """
-        rule_dict = {k: v for rule in rules for k, v in rule.items()}
+        rule_dict = merge_rules(rules)
         sub_func = lambda match: rule_dict[match.group()]
-        return cls(search_pattern, sub_func)
+        transform = cls(search_pattern, sub_func)
+        transform.rule_dict = rule_dict
+        return transform
     
     @classmethod
     def rules_with_cases(cls, search_pattern: str, CaseEnum: Type[TCaseEnum], detect_case: Callable[[Match], TCaseEnum], rules: Callable[[TCaseEnum], List[Dict[str, str]]]) -> PhonTransform:
@@ -93,101 +108,193 @@ class PhonTransform:
         analyzed in the `detect_case` function.
         """
         cases: List[TCaseEnum] = list(CaseEnum)
-        rule_dict = {case: {k: v for rule in rules(case) for k, v in rule.items()} for case in cases}
+        rule_dict = {case: merge_rules(rules(case)) for case in cases}
         sub_func = lambda match: rule_dict[detect_case(match)][match['key']]
-        return cls(search_pattern, sub_func)
+        transform = cls(search_pattern, sub_func)
+        transform.rule_dict = rule_dict
+        return transform
+
+def merge_rules(rules: Iterable[Dict[str, str]]) -> Dict[str, str]:
+    return {k: v for rule in rules for k, v in rule.items()}
 
 
-# List of transformations used in the `phonetize` function.
+# Transformations used in the `phonetize` function.
+
+# genitive singular adjective endings
+genitive_endings = PhonTransform.rules(
+    rf"[ое]'?го'?(?:ся)?(?=$|[{separators}])",
+    # different stress positions:
+    {f"{v}го{r}":  f"{v}во{r}"  for v in 'ое' for r in ['', 'ся']},
+    {f"{v}'го{r}": f"{v}'во{r}" for v in 'ое' for r in ['', 'ся']},
+    {f"{v}го'{r}": f"{v}во'{r}" for v in 'ое' for r in ['', 'ся']}
+)
+
+# softness and stress
+def softness_and_stress_rules(stress: VowelStress) -> List[Dict[str, str]]:
+    return [
+        # -ьо:
+        {f'{c}ьо': f'{phonemize(c).upper()}Y{phonetize_vowel(VP.after_soft, stress, "о")}' for c in consonant_ltrs},
+        {f'{hc}ьо': f'{phonemize(hc)}Y{phonetize_vowel(VP.after_soft, stress, "о")}' for hc in hard_only_cons_ltrs},
+        # vowel:
+        {f'{v}': f'{phonetize_vowel(VP.isolated, stress, v)}' for v in plain_vowel_ltrs},
+        {f'{jv}': f'Y{phonetize_vowel(VP.after_soft, stress, jv)}' for jv in jot_vowel_ltrs},
+        # vowel + consonant:
+        {f'{c}{v}': f'{phonemize(c)}{phonetize_vowel(VP.after_hard, stress, v)}' for c in consonant_ltrs for v in vowel_ltrs},
+        {f'{sc}{jv}': f'{phonemize(sc).upper()}{phonetize_vowel(VP.after_soft, stress, jv)}' for sc in softable_cons_ltrs for jv in jot_vowel_ltrs},
+        {f'{soc}{v}': f'{phonemize(soc).upper()}{phonetize_vowel(VP.after_soft, stress, v)}' for soc in soft_only_cons_ltrs for v in vowel_ltrs},
+        # consonant:
+        {f'{c}': f'{phonemize(c)}' for c in consonant_ltrs},
+        {f'{c}{s}': f'{phonemize(c)}' for c in consonant_ltrs for s in sign_ltrs},
+        {f'{sc}ь': f'{phonemize(sc).upper()}' for sc in softable_cons_ltrs},
+        {f'{soc}{s}': f'{phonemize(soc).upper()}' for soc in soft_only_cons_ltrs for s in sign_ltrs},
+        {f'{soc}': f'{phonemize(soc).upper()}' for soc in soft_only_cons_ltrs},
+        # incorrect formating in the file:
+        {f'{s}': '' for s in sign_ltrs}
+    ]
+
+softness_and_stress_pattern = rf'''(?P<key>[{consonant_ltrs}]ьо                          # special case: consonant + ьо
+                |[{consonant_ltrs}]?[{vowel_ltrs}{sign_ltrs}]  # optional consonant, then, vowel or sign
+                |[{consonant_ltrs}]                            # consonant not followed by a vowel
+         )(?P<accent>[{accents}]?)(?P<word_end>\b)?            # groups for stress type detection
+      '''
+
+def compile_rule_tables() -> RuleTables:
+    """Builds the tables which take the most time to import, see `rule_cache`:
+    the `softness_and_stress` rules by the name of the case and the pattern of `syllable_transducer`.
+    """
+    rules = {stress.name: merge_rules(softness_and_stress_rules(stress)) for stress in VowelStress}
+    return {
+        'softness_and_stress': rules,
+        'syllable_tokens': tokenizer_pattern(
+            {(accent, word_end): rules[stress_by_accent(accent, word_end).name]
+                for accent in ['', *accents] for word_end in [False, True]},
+            accents
+        ),
+    }
+
+# built only if the file of `rule_cache` is missing or outdated
+rule_tables = load_rule_tables(compile_rule_tables, [repertoire.__file__, transducer.__file__, __file__])
+
+softness_and_stress = PhonTransform.rules_with_cases(
+    softness_and_stress_pattern,
+    VowelStress,
+    detect_stress,
+    lambda stress: [rule_tables['softness_and_stress'][stress.name]]
+)
+
+# consonant clusters
+consonant_clusters = PhonTransform.rules(
+    r'''[tT]Sa\b          # reflexive verb endings
+       |tsts|TCTC         # cluster simplification
+       |[sSzZcj]TC        # cluster simplification
+       |[sSzZ][tTdD][nN]  # cluster simplification
+     ''',
+    # reflexive verb endings
+    {f'{t}Sa': 'tsa' for t in 'tT'},
+    # cluster simplification:
+    {'tsts': 'ts', 'TCTC': 'TC'},
+    {cc: 'C' for cc in ['sTC', 'STC', 'zTC', 'ZTC', 'cTC', 'jTC']},
+    {f'{s}{t}{n}': f'{s}{n}' for s in 'sSzZ' for t in 'tTdD' for n in 'nN'}
+)
+
+# removing word separators
+separator_removal = PhonTransform.replacement(rf'[{separators}]+', '')
+
+# assimilation by voiceness
+voiceness_assimilation = PhonTransform.rules(
+    rf'''[{voiceable_cons}]{{1,2}}(?=[{voicing_cons}])         # unvoiced cluster before a voicing consonant
+        |[{unvoiceable_cons}]{{1,2}}(?=[{voiceable_cons}]|\b)  # voiced cluster before an unvoicing consonant or word-finally
+      ''',
+    # voicing:
+    {f'{c}': f'{voice(c)}' for c in voiceable_cons},
+    {f'{c1}{c2}': f'{voice(c1)}{voice(c2)}' for c1 in voiceable_cons for c2 in voiceable_cons},
+    # unvoicing:
+    {f'{c}': f'{unvoice(c)}' for c in unvoiceable_cons},
+    {f'{c1}{c2}': f'{unvoice(c1)}{unvoice(c2)}' for c1 in unvoiceable_cons for c2 in unvoiceable_cons},
+)
+
+# removing repeating consonants
+repeating_consonants = PhonTransform.rules(
+    rf'(?i)([{consonants}])\1', # the same consonant twice, case insensitive
+    {f'{c}{c}': c for c in consonants + consonants.upper()},
+    {f'{c.upper()}{c}': c for c in consonants},
+    {f'{c}{c.upper()}': c.upper() for c in consonants}
+)
+
 # The order is significant: the transformations are applied in that order.
 phon_transforms = [
-    
-    # genitive singular adjective endings
-    PhonTransform.rules(
-        rf"[ое]'?го'?(?:ся)?(?=$|[{separators}])",
-        # different stress positions:
-        {f"{v}го{r}":  f"{v}во{r}"  for v in 'ое' for r in ['', 'ся']},
-        {f"{v}'го{r}": f"{v}'во{r}" for v in 'ое' for r in ['', 'ся']},
-        {f"{v}го'{r}": f"{v}во'{r}" for v in 'ое' for r in ['', 'ся']}
-    ),
-    
-    # softness and stress
-    PhonTransform.rules_with_cases(
-        rf'''(?P<key>[{consonant_ltrs}]ьо                          # special case: consonant + ьо
-                    |[{consonant_ltrs}]?[{vowel_ltrs}{sign_ltrs}]  # optional consonant, then, vowel or sign
-                    |[{consonant_ltrs}]                            # consonant not followed by a vowel
-             )(?P<accent>[{accents}]?)(?P<word_end>\b)?            # groups for stress type detection
-          ''',
-        VowelStress,
-        detect_stress,
-        lambda stress: [
-            # -ьо:
-            {f'{c}ьо': f'{phonemize(c).upper()}Y{phonetize_vowel(VP.after_soft, stress, "о")}' for c in consonant_ltrs},
-            {f'{hc}ьо': f'{phonemize(hc)}Y{phonetize_vowel(VP.after_soft, stress, "о")}' for hc in hard_only_cons_ltrs},
-            # vowel:
-            {f'{v}': f'{phonetize_vowel(VP.isolated, stress, v)}' for v in plain_vowel_ltrs},
-            {f'{jv}': f'Y{phonetize_vowel(VP.after_soft, stress, jv)}' for jv in jot_vowel_ltrs},
-            # vowel + consonant:
-            {f'{c}{v}': f'{phonemize(c)}{phonetize_vowel(VP.after_hard, stress, v)}' for c in consonant_ltrs for v in vowel_ltrs},
-            {f'{sc}{jv}': f'{phonemize(sc).upper()}{phonetize_vowel(VP.after_soft, stress, jv)}' for sc in softable_cons_ltrs for jv in jot_vowel_ltrs},
-            {f'{soc}{v}': f'{phonemize(soc).upper()}{phonetize_vowel(VP.after_soft, stress, v)}' for soc in soft_only_cons_ltrs for v in vowel_ltrs},
-            # consonant:
-            {f'{c}': f'{phonemize(c)}' for c in consonant_ltrs},
-            {f'{c}{s}': f'{phonemize(c)}' for c in consonant_ltrs for s in sign_ltrs},
-            {f'{sc}ь': f'{phonemize(sc).upper()}' for sc in softable_cons_ltrs},
-            {f'{soc}{s}': f'{phonemize(soc).upper()}' for soc in soft_only_cons_ltrs for s in sign_ltrs},
-            {f'{soc}': f'{phonemize(soc).upper()}' for soc in soft_only_cons_ltrs},
-            # incorrect formating in the file:
-            {f'{s}': '' for s in sign_ltrs}
-        ]
-    ),
-    
-    # consonant clusters
-    PhonTransform.rules(
-        r'''[tT]Sa\b          # reflexive verb endings
-           |tsts|TCTC         # cluster simplification
-           |[sSzZcj]TC        # cluster simplification
-           |[sSzZ][tTdD][nN]  # cluster simplification
-         ''',
-        # reflexive verb endings
-        {f'{t}Sa': 'tsa' for t in 'tT'},
-        # cluster simplification:
-        {'tsts': 'ts', 'TCTC': 'TC'},
-        {cc: 'C' for cc in ['sTC', 'STC', 'zTC', 'ZTC', 'cTC', 'jTC']},
-        {f'{s}{t}{n}': f'{s}{n}' for s in 'sSzZ' for t in 'tTdD' for n in 'nN'}
-    ),
-    
-    # removing word separators
-    PhonTransform.replacement(rf'[{separators}]+', ''),
-    
-    # assimilation by voiceness
-    PhonTransform.rules(
-        rf'''[{voiceable_cons}]{{1,2}}(?=[{voicing_cons}])         # unvoiced cluster before a voicing consonant
-            |[{unvoiceable_cons}]{{1,2}}(?=[{voiceable_cons}]|\b)  # voiced cluster before an unvoicing consonant or word-finally
-          ''',
-        # voicing:
-        {f'{c}': f'{voice(c)}' for c in voiceable_cons},
-        {f'{c1}{c2}': f'{voice(c1)}{voice(c2)}' for c1 in voiceable_cons for c2 in voiceable_cons},
-        # unvoicing:
-        {f'{c}': f'{unvoice(c)}' for c in unvoiceable_cons},
-        {f'{c1}{c2}': f'{unvoice(c1)}{unvoice(c2)}' for c1 in unvoiceable_cons for c2 in unvoiceable_cons},
-    ),
-    
-    # removing repeating consonants
-    PhonTransform.rules(
-        rf'(?i)([{consonants}])\1', # the same consonant twice, case insensitive
-        {f'{c}{c}': c for c in consonants + consonants.upper()},
-        {f'{c.upper()}{c}': c for c in consonants},
-        {f'{c}{c.upper()}': c.upper() for c in consonants}
-    ),
+    genitive_endings,
+    softness_and_stress,
+    consonant_clusters,
+    separator_removal,
+    voiceness_assimilation,
+    repeating_consonants,
 ]
 
 
-def phonetize(accented_spell: str) -> str:
+# The compiled engine: `softness_and_stress`, which matches almost every letter
+# and calls back into Python for each match, is replaced with a single
+# table-driven pass; the other transformations rarely match
+# and are applied as they are.
+syllable_transducer = SyllableTransducer(
+    {(accent, word_end): softness_and_stress.rule_dict[stress_by_accent(accent, word_end)]
+        for accent in ['', *accents] for word_end in [False, True]},
+    accents,
+    rule_tables['syllable_tokens']
+)
+compiled_transforms: List[Callable[[str], str]] = [
+    genitive_endings.apply_to,
+    syllable_transducer.apply_to,
+    consonant_clusters.apply_to,
+    separator_removal.apply_to,
+    voiceness_assimilation.apply_to,
+    repeating_consonants.apply_to,
+]
+
+
+def phonetize(accented_spell: str, compiled: bool=True) -> str:
     """Returns the phonetic transcription of a word by its accented spelling.
     Examples can be found in `test_phonetize.py`.
+    
+    The result is the same with either engine; `compiled=False` applies
+    `phon_transforms` one by one and serves as the reference implementation.
     """
+    if not compiled:
+        return phonetize_by_transforms(accented_spell)
+    result = accented_spell
+    for apply in compiled_transforms:
+        result = apply(result)
+    return result
+
+def phonetize_by_transforms(accented_spell: str) -> str:
     result = accented_spell
     for t in phon_transforms:
         result = t.apply_to(result)
     return result
+
+
+# Maximum number of transcriptions kept by `phonetize_cached`,
+# set by `RIFMUJ_PHONETIZE_CACHE_SIZE` or changed by `configure_phonetize_cache`.
+phonetize_cache_size = int(os.environ.get('RIFMUJ_PHONETIZE_CACHE_SIZE', 100_000))
+phonetize_cache = lru_cache(maxsize=phonetize_cache_size)(phonetize)
+
+def configure_phonetize_cache(size: int) -> None:
+    """Replaces the cache of `phonetize_cached` with an empty one of `size` transcriptions."""
+    global phonetize_cache, phonetize_cache_size
+    phonetize_cache_size = size
+    phonetize_cache = lru_cache(maxsize=size)(phonetize)
+
+def phonetize_cached(accented_spell: str) -> str:
+    """The same as `phonetize` but remembers the latest results.
+    Hit and miss counters are available via `phonetize_cache.cache_info()`.
+    """
+    return phonetize_cache(accented_spell)
+
+def phonetize_many(accented_spells: Iterable[str], use_cache: bool=True) -> List[str]:
+    """Returns the transcriptions of all the words in the input order.
+    Each distinct word is phonetized only once.
+    """
+    spells = list(accented_spells)
+    phonetize_one = phonetize_cached if use_cache else phonetize
+    transcriptions = {spell: phonetize_one(spell) for spell in dict.fromkeys(spells)}
+    return [transcriptions[spell] for spell in spells]
@@ -28,6 +28,24 @@ unvoiceable_cons = paired_voiced_cons + paired_voiced_cons.upper()
 voicing_cons = paired_voiced_cons[1:] + paired_voiced_cons[1:].upper()  # without [v]
 consonants = sonorant_cons + sonorant_cons.upper() + unvoiceable_cons + voiceable_cons
 
+# Phoneme codes
+# (strings of phonemes are packed into `bytes` of small integer codes, 0 is left for padding)
+phonemes = consonants + vowels
+phoneme_codes = {ph: code for code, ph in enumerate(phonemes, start=1)}
+pack_table = bytes.maketrans(phonemes.encode('ascii'), bytes(phoneme_codes.values()))
+unpack_table = bytes.maketrans(bytes(phoneme_codes.values()), phonemes.encode('ascii'))
+
+def pack_phonemes(phs: str) -> bytes:
+    """Returns the codes of a string of phonemes, e.g. a consonant cluster."""
+    return phs.encode('ascii').translate(pack_table)
+
+def unpack_phonemes(codes: bytes) -> str:
+    """Restores the string of phonemes from the result of `pack_phonemes`."""
+    return codes.translate(unpack_table).decode('ascii')
+
+def unpack_phoneme(code: int) -> str:
+    return phonemes[code - 1]
+
 def change(from_: str, to: str, also: Dict[str, str]={}) -> Callable[[str], str]:
     """Returns a string-transforming function which maps every character
     from `from_` in the input to the corresponding character in `to`.
@@ -1,33 +1,106 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Iterable, List, Optional, Sequence, Tuple
+from functools import lru_cache
 import itertools as it
+import os
 import re
-from .repertoire import vowels, stressed_vowels, consonants, unvoice
+from .repertoire import (vowels, stressed_vowels, consonants, unvoice, phoneme_codes,
+    pack_phonemes, unpack_phonemes, unpack_phoneme)
 from .distance import Distance
 
 class Syllable:
-    def __init__(self, parts: re.Match) -> None:
-        self.consonants = parts['cons']
-        self.vowel = parts['vowel']
+    """Consonants followed by a vowel, as phoneme codes (see `repertoire.pack_phonemes`).
+    `str` restores the phonemes.
+    """
+    __slots__ = ('consonants', 'vowel')
+    
+    def __init__(self, consonants: bytes, vowel: int) -> None:
+        self.consonants = consonants
+        self.vowel = vowel
+    
+    @classmethod
+    def from_phonemes(cls, consonants: str, vowel: str) -> Syllable:
+        return cls(pack_phonemes(consonants), phoneme_codes[vowel])
+    
+    @classmethod
+    def from_match(cls, parts: re.Match) -> Syllable:
+        return cls.from_phonemes(parts['cons'], parts['vowel'])
+    
+    def __str__(self) -> str:
+        return unpack_phonemes(self.consonants) + unpack_phoneme(self.vowel)
 
 class Rhyme:
-    def __init__(self, parts: re.Match) -> None:
+    """The syllables of a transcription around the stress, as phoneme codes.
+    `str` restores the transcription.
+    """
+    __slots__ = ('pretonic_syllables', 'stressed_syllable', 'posttonic_syllables', 'final_consonants')
+    
+    def __init__(self, pretonic_syllables: Sequence[Syllable], stressed_syllable: Syllable,
+                 posttonic_syllables: Sequence[Syllable], final_consonants: bytes) -> None:
+        self.pretonic_syllables = pretonic_syllables
+        self.stressed_syllable = stressed_syllable
+        self.posttonic_syllables = posttonic_syllables
+        self.final_consonants = final_consonants
+    
+    @classmethod
+    def from_match(cls, parts: re.Match) -> Rhyme:
         pretonic = split_syllable.finditer(parts['pre'])
-        self.pretonic_syllables = [Syllable(match) for match in pretonic]
-        
         stressed = split_syllable.match(parts['stress'])
         assert(stressed is not None)
-        self.stressed_syllable = Syllable(stressed)
-        
         posttonic = split_syllable.finditer(parts['post'])
-        self.posttonic_syllables = [Syllable(match) for match in posttonic]
-        
-        self.final_consonants = parts['final']
+        return cls(
+            tuple(Syllable.from_match(match) for match in pretonic),
+            Syllable.from_match(stressed),
+            tuple(Syllable.from_match(match) for match in posttonic),
+            pack_phonemes(parts['final'])
+        )
     
     @classmethod
     def from_transcription(cls, transcription: str) -> Optional[Rhyme]:
         parts = split_by_stress.match(transcription)
-        return cls(parts) if parts is not None else None
+        return cls.from_match(parts) if parts is not None else None
+    
+    def encode(self) -> str:
+        """Returns a compact string form of the rhyme to be stored in the db:
+        `pretonic|stressed|posttonic|final`, where syllables in a group
+        are separated with dots.
+        Each syllable ends with its vowel, so no other separators are needed.
+        """
+        return '|'.join([
+            '.'.join(map(str, self.pretonic_syllables)),
+            str(self.stressed_syllable),
+            '.'.join(map(str, self.posttonic_syllables)),
+            unpack_phonemes(self.final_consonants)
+        ])
+    
+    @classmethod
+    def decode(cls, encoded: str) -> Optional[Rhyme]:
+        """Restores the rhyme from the result of `encode` without regex parsing."""
+        if not encoded:
+            return None
+        pretonic, stressed, posttonic, final = encoded.split('|')
+        return cls(
+            decode_syllables(pretonic),
+            decode_syllable(stressed),
+            decode_syllables(posttonic),
+            pack_phonemes(final)
+        )
+    
+    def __str__(self) -> str:
+        return ''.join(map(str, self.pretonic_syllables)) + str(self.stressed_syllable) + \
+            ''.join(map(str, self.posttonic_syllables)) + unpack_phonemes(self.final_consonants)
+
+def decode_syllable(encoded: str) -> Syllable:
+    packed = pack_phonemes(encoded)
+    return Syllable(packed[:-1], packed[-1])
+
+def decode_syllables(encoded: str) -> Tuple[Syllable, ...]:
+    return tuple(decode_syllable(s) for s in encoded.split('.')) if encoded else ()
+
+def encode_rhyme(transcription: str) -> str:
+    """Returns the encoded rhyme structure of the transcription, see `Rhyme.encode`."""
+    rhyme = Rhyme.from_transcription(transcription)
+    return rhyme.encode() if rhyme is not None else ''
 
 
 def get_basic_rhyme(transcription: str) -> str:
@@ -35,20 +108,87 @@ def get_basic_rhyme(transcription: str) -> str:
     if rhyme is None:
         return ''
     
-    stressed_vowel = rhyme.stressed_syllable.vowel
+    stressed_vowel = unpack_phoneme(rhyme.stressed_syllable.vowel)
     posttonic_syl_count = len(rhyme.posttonic_syllables)
     
     if posttonic_syl_count > 0:
-        posttonic_cluster = rhyme.posttonic_syllables[0].consonants
+        posttonic_cluster = unpack_phonemes(rhyme.posttonic_syllables[0].consonants)
         cluster_last_cons = re.sub("[lnm]", "r", unvoice(posttonic_cluster[-1:]))
         cluster_other_cons = '_' if len(posttonic_cluster) > 1 else ''
         return stressed_vowel + cluster_other_cons + cluster_last_cons + str(posttonic_syl_count)
     elif rhyme.final_consonants:
-        return stressed_vowel + rhyme.final_consonants
+        return stressed_vowel + unpack_phonemes(rhyme.final_consonants)
     else:
-        pretonic_cons = rhyme.stressed_syllable.consonants[-1:]
+        pretonic_cons = unpack_phonemes(rhyme.stressed_syllable.consonants[-1:])
         return unvoice(pretonic_cons) + stressed_vowel
 
+# Maximum number of basic rhymes kept by `get_basic_rhyme_cached`,
+# set by `RIFMUJ_BASIC_RHYME_CACHE_SIZE` or changed by `configure_basic_rhyme_cache`.
+basic_rhyme_cache_size = int(os.environ.get('RIFMUJ_BASIC_RHYME_CACHE_SIZE', 100_000))
+basic_rhyme_cache = lru_cache(maxsize=basic_rhyme_cache_size)(get_basic_rhyme)
+
+def configure_basic_rhyme_cache(size: int) -> None:
+    """Replaces the cache of `get_basic_rhyme_cached` with an empty one of `size` basic rhymes."""
+    global basic_rhyme_cache, basic_rhyme_cache_size
+    basic_rhyme_cache_size = size
+    basic_rhyme_cache = lru_cache(maxsize=size)(get_basic_rhyme)
+
+def get_basic_rhyme_cached(transcription: str) -> str:
+    """The same as `get_basic_rhyme` but remembers the latest results.
+    Hit and miss counters are available via `basic_rhyme_cache.cache_info()`.
+    """
+    return basic_rhyme_cache(transcription)
+
+def get_basic_rhyme_many(transcriptions: Iterable[str], use_cache: bool=True) -> List[str]:
+    """Returns the basic rhymes of all the transcriptions in the input order.
+    Each distinct transcription is processed only once.
+    """
+    transcription_list = list(transcriptions)
+    get_one = get_basic_rhyme_cached if use_cache else get_basic_rhyme
+    basic_rhymes = {trans: get_one(trans) for trans in dict.fromkeys(transcription_list)}
+    return [basic_rhymes[trans] for trans in transcription_list]
+
+def basic_rhyme_distance(rhyme1: str, rhyme2: str) -> int:
+    """An edit distance between basic rhymes telling how likely their buckets
+    are to hold near rhymes of each other, e.g. 1 for `O_k1` and `Ok1` or for `Ol` and `OL`.
+
+    Inserting or deleting a consonant costs 2, the `_` of a cluster costs 1,
+    and the number of syllables after the stress costs 4.
+    Replacing a consonant costs 2, or 1 if only the softness differs.
+    Replacing the stressed vowel or the number of syllables costs as much as deleting and inserting,
+    so the rhymes which differ in them are at least 4 apart.
+    The distance is a metric, so it can be searched with a BK-tree (see `rhyme_neighbours.py`).
+    """
+    previous = list(it.accumulate(map(basic_rhyme_indel_cost, rhyme2), initial=0))
+    for c1 in rhyme1:
+        current = [previous[0] + basic_rhyme_indel_cost(c1)]
+        for j, c2 in enumerate(rhyme2):
+            current.append(min(
+                previous[j + 1] + basic_rhyme_indel_cost(c1),
+                current[j] + basic_rhyme_indel_cost(c2),
+                previous[j] + basic_rhyme_replace_cost(c1, c2)
+            ))
+        previous = current
+    return previous[-1]
+
+def basic_rhyme_indel_cost(c: str) -> int:
+    if c == '_':
+        return 1
+    elif c.isdigit():
+        return 4
+    else:
+        return 2
+
+def basic_rhyme_replace_cost(c1: str, c2: str) -> int:
+    if c1 == c2:
+        return 0
+    elif c1 in vowels or c2 in vowels or c1.isdigit() or c2.isdigit():
+        return basic_rhyme_indel_cost(c1) + basic_rhyme_indel_cost(c2)
+    elif c1.lower() == c2.lower():
+        return 1
+    else:
+        return 2
+
 def normalized_rhyme_distance(trans1: str, trans2: str) -> float:
     """Returns the rhyme distance between two transcriptions
     normalized so that the value is in [0; 1].
@@ -57,6 +197,83 @@ def normalized_rhyme_distance(trans1: str, trans2: str) -> float:
     """
     r1 = Rhyme.from_transcription(trans1)
     r2 = Rhyme.from_transcription(trans2)
+    return parsed_rhyme_distance(r1, r2)
+
+def parsed_rhyme_distance(r1: Optional[Rhyme], r2: Optional[Rhyme]) -> float:
+    """The same as `normalized_rhyme_distance` but takes already parsed rhymes,
+    e.g. decoded from the db, so that the query word is parsed only once.
+    
+    Phoneme distances are taken from `exact_distances` and `voiceness_distances`,
+    and the parts of the distance are summed as plain floats in the same order
+    as `parsed_rhyme_distance_by_objects` does, so the results are exactly the same.
+    """
+    if r1 is None or r2 is None:
+        return 1.0
+    
+    pretonic_actual = pretonic_total = 0.0
+    pretonic2 = r2.pretonic_syllables
+    for i, s1 in enumerate(reversed(r1.pretonic_syllables)):
+        weight = pretonic_exp_base ** i
+        if i < len(pretonic2):
+            actual, total = syllable_distance_parts(s1, pretonic2[-1 - i], voiceness_distances)
+            pretonic_actual += actual * weight
+            pretonic_total += total * weight
+        else:
+            pretonic_actual += weight
+            pretonic_total += weight
+    
+    stressed_actual, stressed_total = cluster_distance_parts(
+        r1.stressed_syllable.consonants, r2.stressed_syllable.consonants, voiceness_distances)
+    
+    posttonic_actual = posttonic_total = 0.0
+    for s1, s2 in zip(r1.posttonic_syllables, r2.posttonic_syllables):
+        actual, total = syllable_distance_parts(s1, s2, exact_distances)
+        posttonic_actual += actual
+        posttonic_total += total
+    
+    final_actual, final_total = cluster_distance_parts(r1.final_consonants, r2.final_consonants, exact_distances)
+    
+    actual = (
+        pretonic_actual * pretonic_weight +
+        stressed_actual * stressed_syl_cons_weight +
+        posttonic_actual * posttonic_weight +
+        final_actual * final_cons_weight
+    )
+    total = (
+        pretonic_total * pretonic_weight +
+        stressed_total * stressed_syl_cons_weight +
+        posttonic_total * posttonic_weight +
+        final_total * final_cons_weight
+    )
+    return actual / total
+
+# phoneme code -> phoneme code -> the distance between the phonemes
+PhonDistanceTable = List[List[float]]
+
+def cluster_distance_parts(cl1: bytes, cl2: bytes, table: PhonDistanceTable) -> Tuple[float, float]:
+    """The `actual` and `total` parts of `cluster_distance`."""
+    len1, len2 = len(cl1), len(cl2)
+    if len1 != len2:
+        if len1 >= 2 and len2 >= 2:
+            coeff = 1.6 ** max(len1, len2)
+            return (table[cl1[0]][cl2[0]] + table[cl1[-1]][cl2[-1]]) / 2 * coeff, coeff
+        return 1.0, 1.0
+    if len1 == 0:
+        return 0.0, 1.0
+    actual = 0.0
+    for ph1, ph2 in zip(cl1, cl2):
+        actual += table[ph1][ph2]
+    return actual / len1, 1.0
+
+def syllable_distance_parts(s1: Syllable, s2: Syllable, cluster_table: PhonDistanceTable) -> Tuple[float, float]:
+    """The `actual` and `total` parts of `syllable_distance`."""
+    actual, total = cluster_distance_parts(s1.consonants, s2.consonants, cluster_table)
+    return actual + exact_distances[s1.vowel][s2.vowel] * vowel_to_cons_weight, total + vowel_to_cons_weight
+
+def parsed_rhyme_distance_by_objects(r1: Optional[Rhyme], r2: Optional[Rhyme]) -> float:
+    """The reference implementation of `parsed_rhyme_distance`,
+    which adds up `Distance` objects.
+    """
     if r1 is None or r2 is None:
         return 1.0
     
@@ -72,15 +289,15 @@ def normalized_rhyme_distance(trans1: str, trans2: str) -> float:
     pretonic_dist = sum(pretonic_syl_weighted_dists, Distance.empty())
     
     stressed_syl_cons_dist = cluster_distance(
-        r1.stressed_syllable.consonants,
-        r2.stressed_syllable.consonants,
+        unpack_phonemes(r1.stressed_syllable.consonants),
+        unpack_phonemes(r2.stressed_syllable.consonants),
         allow_wrong_voiceness=True)
     
     posttonic_syllables = zip(r1.posttonic_syllables, r2.posttonic_syllables)
     posttonic_syl_dists = (syllable_distance(s1, s2) for s1, s2 in posttonic_syllables)
     posttonic_dist = sum(posttonic_syl_dists, Distance.empty())
     
-    final_cons_dist = cluster_distance(r1.final_consonants, r2.final_consonants)
+    final_cons_dist = cluster_distance(unpack_phonemes(r1.final_consonants), unpack_phonemes(r2.final_consonants))
     
     distance = (
         pretonic_weight * pretonic_dist +
@@ -116,8 +333,20 @@ def cluster_distance(cl1: str, cl2: str, allow_wrong_voiceness: bool=False) -> D
         return sum(distances, Distance.empty()) / len(cl1)
 
 def syllable_distance(s1: Syllable, s2: Syllable, allow_wrong_voiceness: bool=False) -> Distance:
-    return (cluster_distance(s1.consonants, s2.consonants, allow_wrong_voiceness) +
-        vowel_to_cons_weight * phon_distance(s1.vowel, s2.vowel))
+    return (cluster_distance(unpack_phonemes(s1.consonants), unpack_phonemes(s2.consonants), allow_wrong_voiceness) +
+        vowel_to_cons_weight * phon_distance(unpack_phoneme(s1.vowel), unpack_phoneme(s2.vowel)))
+
+def make_phon_distance_table(allow_wrong_voiceness: bool) -> PhonDistanceTable:
+    """Returns the `phon_distance` values for all pairs of phoneme codes.
+    The padding code 0 is at the distance 1 from every phoneme.
+    """
+    size = len(phoneme_codes) + 1
+    table = [[1.0] * size for _ in range(size)]
+    table[0][0] = 0.0
+    for ph1, code1 in phoneme_codes.items():
+        for ph2, code2 in phoneme_codes.items():
+            table[code1][code2] = phon_distance(ph1, ph2, allow_wrong_voiceness).actual
+    return table
 
 # constants:
 
@@ -129,6 +358,10 @@ stressed_syl_cons_weight = 0.33
 posttonic_weight         = 0.99
 final_cons_weight        = 1.3
 
+# the phoneme distance tables of `parsed_rhyme_distance`
+exact_distances = make_phon_distance_table(allow_wrong_voiceness=False)
+voiceness_distances = make_phon_distance_table(allow_wrong_voiceness=True)
+
 
 # regexps:
 
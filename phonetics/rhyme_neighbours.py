@@ -0,0 +1,61 @@
+"""Finds the basic rhymes close to each other by `phonetics.rhyme.basic_rhyme_distance`,
+so that the lookup can offer near rhymes from the neighbouring buckets
+without scoring the whole db (see `lookup.RhymeFilter.near`).
+"""
+
+from typing import Callable, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+from .rhyme import basic_rhyme_distance
+
+T = TypeVar('T')
+
+class BKTree(Generic[T]):
+    """A Burkhard-Keller tree: finds the items within a distance from a query
+    comparing it only to a small part of them.
+    The distance must be a metric with integer values.
+    """
+    def __init__(self, distance: Callable[[T, T], int], items: Iterable[T]=()) -> None:
+        self.distance = distance
+        # a node is an item and its children by their distances from it
+        self.root: Optional[Tuple[T, Dict[int, tuple]]] = None
+        for item in items:
+            self.add(item)
+
+    def add(self, item: T) -> None:
+        if self.root is None:
+            self.root = (item, {})
+            return
+        node = self.root
+        while True:
+            node_item, children = node
+            d = self.distance(item, node_item)
+            if d == 0:
+                return
+            if d not in children:
+                children[d] = (item, {})
+                return
+            node = children[d]
+
+    def search(self, item: T, max_distance: int) -> List[Tuple[int, T]]:
+        """Returns (distance, item) for every item within `max_distance` from the given one."""
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_item, children = nodes.pop()
+            d = self.distance(item, node_item)
+            if d <= max_distance:
+                found.append((d, node_item))
+            # by the triangle inequality, the other subtrees are farther than `max_distance`
+            nodes.extend(child for child_d, child in children.items() if abs(child_d - d) <= max_distance)
+        return found
+
+def find_rhyme_neighbours(rhymes: Iterable[str], max_distance: int) -> Iterable[Tuple[str, str, int]]:
+    """Yields (rhyme, neighbour, distance) for every ordered pair of different rhymes
+    within `max_distance`. Words without a rhyme (the empty basic rhyme) have no neighbours.
+    """
+    distinct = sorted(set(rhyme for rhyme in rhymes if rhyme))
+    tree = BKTree(basic_rhyme_distance, distinct)
+    for rhyme in distinct:
+        for distance, neighbour in sorted(tree.search(rhyme, max_distance)):
+            if distance > 0:
+                yield rhyme, neighbour, distance
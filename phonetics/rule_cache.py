@@ -0,0 +1,69 @@
+"""Keeps the compiled rule tables of the phonetizer in a file between runs,
+so that importing it doesn't rebuild them.
+
+The file stores a hash of the source files the tables are built from,
+and the tables are rebuilt when any of them changes. The hash (CRC-32) and the format
+(`marshal`, which is specific to the Python version) are chosen for the speed of import.
+RIFMUJ_RULE_CACHE sets the file, an empty value disables it.
+"""
+
+from typing import Any, Callable, Dict, Iterable, Optional
+import marshal
+import os
+import sys
+import zlib
+
+RuleTables = Dict[str, Any]
+
+default_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'phonetizer-rules.marshal')
+cache_file = os.environ.get('RIFMUJ_RULE_CACHE', default_file)
+
+# changes when the format of the file changes
+format_version = 1
+
+def source_hash(source_files: Iterable[str]) -> Optional[str]:
+    """Returns None if a source file can't be read, e.g. when running from a zip."""
+    digest = zlib.crc32(f'{format_version} {sys.version_info[:2]}'.encode())
+    try:
+        for file_name in source_files:
+            with open(file_name, 'rb') as file:
+                source = file.read()
+            digest = zlib.crc32(source, zlib.crc32(str(len(source)).encode(), digest))
+    except OSError:
+        return None
+    return f'{digest:08x}'
+
+def load_rule_tables(build: Callable[[], RuleTables], source_files: Iterable[str],
+        file_name: Optional[str]=None) -> RuleTables:
+    """Returns the tables from the cache file if it was written for the same sources,
+    otherwise builds them and rewrites the file.
+    The cache is only an optimization: a file which can't be read or written is ignored.
+    """
+    file_name = cache_file if file_name is None else file_name
+    expected_hash = source_hash(source_files)
+    if not file_name or expected_hash is None:
+        return build()
+
+    try:
+        with open(file_name, 'rb') as file:
+            cached = marshal.load(file)
+        if isinstance(cached, dict) and cached.get('source_hash') == expected_hash:
+            return cached['tables']
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    tables = build()
+    try:
+        os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+        # another process may be writing the same file, so it's replaced at once
+        temp_name = f'{file_name}.{os.getpid()}.tmp'
+        try:
+            with open(temp_name, 'wb') as file:
+                marshal.dump({'source_hash': expected_hash, 'tables': tables}, file)
+            os.replace(temp_name, file_name)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+    except OSError:
+        pass
+    return tables
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from typing import Dict, Iterable, Optional, Tuple
+import re
+
+# A trie node maps a character to the next node.
+# The empty string key marks the end of a rule table key.
+TrieNode = Dict[str, 'TrieNode']
+
+class SyllableTransducer:
+    """A compiled form of a `rules_with_cases` transformation
+    whose cases are determined by an accent mark and the word end.
+
+    The keys of the rule tables are compiled into a trie, and the trie
+    into a single regex which splits the input into tokens in one
+    left-to-right pass. Each token is the longest key at its position,
+    an optional accent mark after it and the next character (if it is
+    a word character), or a single character that starts no key.
+    Replacements are then looked up in the table corresponding to the accent
+    and to whether the word ends after the token, without calling back
+    into Python for every match.
+
+    This is equivalent to the regex-based transformation as long as
+    its search pattern alternatives prefer longer keys to shorter ones.
+    """
+    def __init__(self, tables: Dict[Tuple[str, bool], Dict[str, str]], accents: str,
+            pattern: Optional[str]=None) -> None:
+        """`pattern` is the result of `tokenizer_pattern` for the same arguments, if it is already known."""
+        self.tables = tables
+        if pattern is None:
+            pattern = tokenizer_pattern(tables, accents)
+        self.tokenizer = re.compile(pattern, re.DOTALL)
+
+    def apply_to(self, string: str) -> str:
+        """Returns the result of the transformation application to the argument string."""
+        tables = self.tables
+        # `\b` after the token: a word character follows an accent mark
+        # or no word character follows a letter
+        return ''.join([
+            tables[accent, (next_char != '') == (accent != '')][key] if key else other
+            for key, accent, next_char, other in self.tokenizer.findall(string)
+        ])
+
+
+def tokenizer_pattern(tables: Dict[Tuple[str, bool], Dict[str, str]], accents: str) -> str:
+    trie = make_trie(key for table in tables.values() for key in table)
+    return rf'({trie_to_regex(trie)})([{re.escape(accents)}]?)(?=(\w?))|(.)'
+
+def make_trie(keys: Iterable[str]) -> TrieNode:
+    trie: TrieNode = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return trie
+
+def trie_to_regex(node: TrieNode) -> str:
+    """Returns a regex matching the longest key of the trie.
+    Children with identical subtrees are merged into character classes.
+    """
+    subpatterns: Dict[str, str] = {}
+    for char, child in sorted(node.items()):
+        if char:
+            subpattern = trie_to_regex(child)
+            subpatterns[subpattern] = subpatterns.get(subpattern, '') + re.escape(char)
+
+    alternatives = [
+        (f'[{chars}]' if len(chars) > 1 else chars) + (f'(?:{subpattern})' if '|' in subpattern else subpattern)
+        for subpattern, chars in subpatterns.items()
+    ]
+    # longer continuations are tried first
+    alternatives.sort(key=len, reverse=True)
+    pattern = '|'.join(alternatives)
+
+    if '' in node and pattern:
+        return f'(?:{pattern})?'
+    else:
+        return pattern
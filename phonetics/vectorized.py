@@ -0,0 +1,155 @@
+"""Computes rhyme distances from one word to a whole bucket of words at once.
+
+Requires NumPy, which is an optional dependency: check `numpy_available`
+before using anything from this module. NumPy is imported when the first
+`BucketRhymes` is made, since it takes longer to import than the rest of the package.
+"""
+
+from __future__ import annotations
+from typing import Any, Optional, Sequence, Tuple
+import importlib.util
+
+from .rhyme import (Rhyme, Syllable, vowel_to_cons_weight, pretonic_exp_base,
+    pretonic_weight, stressed_syl_cons_weight, posttonic_weight, final_cons_weight)
+from . import rhyme as scalar
+
+numpy_available = importlib.util.find_spec('numpy') is not None
+
+# set by `load_numpy`
+np: Any = None
+exact_distances: Any = None
+voiceness_distances: Any = None
+
+def load_numpy() -> None:
+    global np, exact_distances, voiceness_distances
+    if np is not None:
+        return
+    import numpy
+    # The syllables of the rhymes are already encoded with phoneme codes, 0 is used for padding.
+    exact_distances = numpy.array(scalar.exact_distances)
+    voiceness_distances = numpy.array(scalar.voiceness_distances)
+    np = numpy
+
+
+class Clusters:
+    """Consonant clusters of all words of a bucket
+    as a padded matrix of phoneme codes and a vector of lengths.
+    """
+    def __init__(self, clusters: Sequence[bytes]) -> None:
+        width = max((len(cl) for cl in clusters), default=0)
+        self.codes = np.zeros((len(clusters), max(width, 1)), dtype=np.int16)
+        for i, cl in enumerate(clusters):
+            self.codes[i, :len(cl)] = np.frombuffer(cl, dtype=np.uint8)
+        self.lengths = np.array([len(cl) for cl in clusters], dtype=np.int16)
+
+    def distances_from(self, cluster: bytes, table: Any) -> Tuple[Any, Any]:
+        """Returns the `actual` and `total` parts of `cluster_distance`
+        from the cluster to every cluster of the bucket.
+        """
+        count = len(self.lengths)
+        query = list(cluster)
+        query_len = len(cluster)
+
+        # clusters of equal lengths are compared phoneme by phoneme
+        if query_len == 0:
+            equal_actual = np.zeros(count)
+        elif query_len <= self.codes.shape[1]:
+            equal_actual = table[query, self.codes[:, :query_len]].mean(axis=1)
+        else:
+            equal_actual = np.ones(count)  # never used: no cluster is that long
+
+        # clusters of different lengths (at least 2) are compared by the first and the last phonemes
+        if query_len >= 2:
+            last = self.codes[np.arange(count), np.maximum(self.lengths - 1, 0)]
+            coeff = 1.6 ** np.maximum(self.lengths, query_len)
+            edges_actual = (table[query[0], self.codes[:, 0]] + table[query[-1], last]) / 2 * coeff
+        else:
+            coeff = np.ones(count)
+            edges_actual = np.ones(count)
+
+        equal = self.lengths == query_len
+        both_long = np.minimum(self.lengths, query_len) >= 2
+        actual = np.where(equal, equal_actual, np.where(both_long, edges_actual, 1.0))
+        total = np.where(equal, 1.0, np.where(both_long, coeff, 1.0))
+        return actual, total
+
+class Syllables:
+    """The n-th syllables (counting from the stress) of all words of a bucket;
+    `present` tells which words have that many syllables.
+    """
+    def __init__(self, syllables: Sequence[Optional[Syllable]]) -> None:
+        self.present = np.array([s is not None for s in syllables])
+        self.clusters = Clusters([s.consonants if s is not None else b'' for s in syllables])
+        self.vowels = np.array([s.vowel if s is not None else 0 for s in syllables], dtype=np.int16)
+
+    def distances_from(self, syllable: Syllable, cluster_table: Any) -> Tuple[Any, Any]:
+        """Returns the `actual` and `total` parts of `syllable_distance`."""
+        cons_actual, cons_total = self.clusters.distances_from(syllable.consonants, cluster_table)
+        vowel_actual = exact_distances[syllable.vowel, self.vowels]
+        return cons_actual + vowel_to_cons_weight * vowel_actual, cons_total + vowel_to_cons_weight
+
+class BucketRhymes:
+    """Rhymes of all words of a bucket encoded as NumPy arrays."""
+    def __init__(self, rhymes: Sequence[Optional[Rhyme]]) -> None:
+        load_numpy()
+        self.count = len(rhymes)
+        self.parsed = np.array([r is not None for r in rhymes])
+        valid = [r for r in rhymes if r is not None]
+        # replacing unparsed rhymes with any valid one, they get the distance of 1.0 anyway
+        placeholder = valid[0] if valid else Rhyme((), Syllable.from_phonemes('', 'A'), (), b'')
+        filled = [r if r is not None else placeholder for r in rhymes]
+
+        max_pretonic = max((len(r.pretonic_syllables) for r in filled), default=0)
+        self.pretonic = [
+            Syllables([r.pretonic_syllables[-1 - i] if i < len(r.pretonic_syllables) else None for r in filled])
+            for i in range(max_pretonic)]
+        self.stressed = Clusters([r.stressed_syllable.consonants for r in filled])
+        max_posttonic = max((len(r.posttonic_syllables) for r in filled), default=0)
+        self.posttonic = [
+            Syllables([r.posttonic_syllables[i] if i < len(r.posttonic_syllables) else None for r in filled])
+            for i in range(max_posttonic)]
+        self.final = Clusters([r.final_consonants for r in filled])
+
+    def distances_from(self, rhyme: Optional[Rhyme]) -> Any:
+        """Returns the vector of `parsed_rhyme_distance(rhyme, r)` for every rhyme `r` of the bucket."""
+        if rhyme is None:
+            return np.ones(self.count)
+
+        pretonic_actual = np.zeros(self.count)
+        pretonic_total = np.zeros(self.count)
+        for i, syllable in enumerate(rhyme.pretonic_syllables[::-1]):
+            weight = pretonic_exp_base ** i
+            if i < len(self.pretonic):
+                syllables = self.pretonic[i]
+                actual, total = syllables.distances_from(syllable, voiceness_distances)
+                pretonic_actual += weight * np.where(syllables.present, actual, 1.0)
+                pretonic_total += weight * np.where(syllables.present, total, 1.0)
+            else:
+                pretonic_actual += weight
+                pretonic_total += weight
+
+        stressed_actual, stressed_total = self.stressed.distances_from(
+            rhyme.stressed_syllable.consonants, voiceness_distances)
+
+        posttonic_actual = np.zeros(self.count)
+        posttonic_total = np.zeros(self.count)
+        for syllable, syllables in zip(rhyme.posttonic_syllables, self.posttonic):
+            actual, total = syllables.distances_from(syllable, exact_distances)
+            posttonic_actual += np.where(syllables.present, actual, 0.0)
+            posttonic_total += np.where(syllables.present, total, 0.0)
+
+        final_actual, final_total = self.final.distances_from(rhyme.final_consonants, exact_distances)
+
+        actual = (
+            pretonic_weight * pretonic_actual +
+            stressed_syl_cons_weight * stressed_actual +
+            posttonic_weight * posttonic_actual +
+            final_cons_weight * final_actual
+        )
+        total = (
+            pretonic_weight * pretonic_total +
+            stressed_syl_cons_weight * stressed_total +
+            posttonic_weight * posttonic_total +
+            final_cons_weight * final_total
+        )
+        return np.where(self.parsed, actual / total, 1.0)
@@ -1,64 +1,23 @@
 'use strict';
 
+// the same regexes of the endings as the server accepts (see `safe_ending_regex` in lookup.py)
+const safeEndingRegExp = /^(?:[a-zа-яё.|]|\[\^?[a-zа-яё]+\])*$/i;
+const maxEndingLength = 32;
+
 $(() =>
 {
-  const filterInput = $('#filter input');
-  const filterApplyButton = $('#applyFilter');
+  const filterForm = $('#filter');
+  const filterInput = $('#filter input[name=ending]');
   const filterClearButton = $('#clearFilter');
   
-  filterInput.keypress(e => { if((e.keyCode || e.which) === 13) onFilterChange(filterInput); });
-  filterApplyButton.click(() => onFilterChange(filterInput));
-  filterClearButton.click(() => { filterInput.val(''); onFilterChange(filterInput) });
+  filterForm.submit(e => { if(!checkFilter(filterInput)) e.preventDefault(); });
+  filterClearButton.click(() => { filterInput.val(''); filterForm.submit(); });
 });
 
-function onFilterChange(filterInput)
+function checkFilter(filterInput)
 {
-  try
-  {
-    const regExp = new RegExp(`(?:${filterInput.val()})$`);
-    filterInput.removeClass('error');
-    applyFilter(regExp);
-  }
-  catch(e)
-  {
-    console.log(e);
-    filterInput.addClass('error');
-  }
-}
-
-function applyFilter(regExp)
-{
-  const lemmas = $('.results li');
-  lemmas.each((_, item) => checkLemma($(item), regExp));
-}
-
-function checkLemma(lemma, regExp)
-{
-  const forms = lemma.children('span');
-  let formCount = 0;
-  
-  forms.each((_, item) =>
-  {
-    const form = $(item);
-    const orth = form.data('orth');
-    const isMatched = !!(regExp.test(orth) | regExp.test(form.data('trans')));
-    
-    if(isMatched)
-    {
-      if(formCount === 0)
-      {
-        form.text(orth);
-        form.removeClass('small');
-      }
-      else
-      {
-        form.text(', ' + form.data('end'));
-        form.addClass('small');
-      }
-      formCount++;
-    }
-    form.toggle(isMatched);
-  });
-  
-  //lemma.toggle(formCount > 0);
+  const ending = filterInput.val();
+  const isValid = ending.length <= maxEndingLength && safeEndingRegExp.test(ending);
+  filterInput.toggleClass('error', !isValid);
+  return isValid;
 }
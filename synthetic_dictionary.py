@@ -0,0 +1,155 @@
+"""Generates a made-up dictionary in the format of the Hagen dictionary (see `hagen.py`),
+so that the db can be built and benchmarked without the real dictionary.
+
+The words follow the Russian spelling, stress and inflection closely enough
+to fill the rhyme buckets realistically. Nouns in -ание and -ение make
+huge buckets, like they do in the real dictionary.
+The output depends only on the arguments.
+"""
+
+from typing import Iterator, List, NamedTuple, Set, Tuple
+import argparse
+import random
+
+from hagen import file_encoding
+
+class Paradigm(NamedTuple):
+    pos: str
+    suffix: str  # the part of every form between the stem and the ending, e.g. 'ани'
+    endings: List[Tuple[str, str]]  # (ending, grammatical features)
+    ending_stress: bool  # whether the forms may be stressed on the ending
+
+noun_fem = Paradigm('сущ жен', '', [
+    ('а', 'им ед'), ('ы', 'род ед'), ('е', 'дат ед'), ('у', 'вин ед'), ('ой', 'тв ед'), ('е', 'пр ед'),
+    ('ы', 'им мн'), ('ам', 'дат мн'), ('ами', 'тв мн'), ('ах', 'пр мн'),
+], ending_stress=True)
+
+noun_masc = Paradigm('сущ муж', '', [
+    ('', 'им ед'), ('а', 'род ед'), ('у', 'дат ед'), ('ом', 'тв ед'), ('е', 'пр ед'),
+    ('ы', 'им мн'), ('ов', 'род мн'), ('ам', 'дат мн'), ('ами', 'тв мн'), ('ах', 'пр мн'),
+], ending_stress=True)
+
+adjective = Paradigm('прл', '', [
+    ('ый', 'ед муж им'), ('ого', 'ед муж род'), ('ому', 'ед муж дат'), ('ым', 'ед муж тв'),
+    ('ом', 'ед муж пр'), ('ая', 'ед жен им'), ('ой', 'ед жен род'), ('ую', 'ед жен вин'),
+    ('ое', 'ед ср им'), ('ые', 'мн им'), ('ых', 'мн род'), ('ыми', 'мн тв'),
+], ending_stress=False)
+
+verb = Paradigm('гл несов', 'а', [
+    ('ть', 'инф'), ('ю', 'наст ед 1-л'), ('ешь', 'наст ед 2-л'), ('ет', 'наст ед 3-л'),
+    ('ем', 'наст мн 1-л'), ('ете', 'наст мн 2-л'), ('ют', 'наст мн 3-л'),
+    ('л', 'прош ед муж'), ('ла', 'прош ед жен'), ('ло', 'прош ед ср'), ('ли', 'прош мн'), ('й', 'пов ед'),
+], ending_stress=False)
+
+# stressed on the suffix, so all of them rhyme with each other
+noun_ania = Paradigm('сущ ср', 'ани', [
+    ('е', 'им ед'), ('я', 'род ед'), ('ю', 'дат ед'), ('ем', 'тв ед'), ('и', 'пр ед'),
+    ('я', 'им мн'), ('й', 'род мн'), ('ям', 'дат мн'), ('ями', 'тв мн'), ('ях', 'пр мн'),
+], ending_stress=False)
+
+noun_enia = noun_ania._replace(suffix='ени')
+
+# (paradigm, weight) for the lemmas outside the huge buckets
+regular_paradigms = [(noun_fem, 3), (noun_masc, 3), (adjective, 2), (verb, 2)]
+huge_bucket_paradigms = [noun_ania, noun_enia]
+
+onsets = list('бвгдзклмнпрстфхшжчц') + ['ст', 'пр', 'тр', 'кр', 'гр', 'бл', 'зв', 'сл']
+codas = list('бвгдзклмнпрстфхшжчщ') + ['ст', 'нк', 'рт', 'льн']
+vowels = 'аоуиеыя'
+# letters after which only some vowels are spelled
+hushing = 'гкхжшчщц'
+hushing_vowels = 'аоуие'
+
+def generate_articles(lemmas: int, seed: int=0, huge_bucket_share: float=0.05) -> Iterator[List[str]]:
+    """Yields the lines of `lemmas` dictionary articles.
+    `huge_bucket_share` of the lemmas are nouns in -ание and -ение.
+    """
+    rng = random.Random(seed)
+    stems: Set[Tuple[str, str, str]] = set()
+    word_id = 1
+    while len(stems) < lemmas:
+        if rng.random() < huge_bucket_share:
+            paradigm = rng.choice(huge_bucket_paradigms)
+        else:
+            paradigm = rng.choices([p for p, _ in regular_paradigms], [w for _, w in regular_paradigms])[0]
+        stem = make_stem(rng, syllables=rng.choice([1, 1, 2, 2, 2, 3]),
+            open_end=paradigm.suffix != '' and paradigm.suffix[0] in 'ае')
+        key = (stem, paradigm.pos, paradigm.suffix)
+        if key in stems:
+            continue
+        stems.add(key)
+
+        lines = make_article(rng, stem, paradigm, word_id)
+        word_id += len(lines)
+        yield lines
+
+def make_stem(rng: random.Random, syllables: int, open_end: bool) -> str:
+    stem = ''
+    for _ in range(syllables):
+        onset = rng.choice(onsets)
+        stem += onset + rng.choice(hushing_vowels if onset[-1] in hushing else vowels)
+    if open_end:
+        return stem + rng.choice(onsets)
+    return stem + rng.choice(codas)
+
+def make_article(rng: random.Random, stem: str, paradigm: Paradigm, first_id: int) -> List[str]:
+    stem_vowels = [i for i, c in enumerate(stem) if c in vowels]
+    if paradigm.suffix:
+        stress = len(stem)  # the first vowel of the suffix
+    elif paradigm.ending_stress and rng.random() < 0.3:
+        stress = -1  # the ending, if it has a vowel
+    else:
+        stress = rng.choice(stem_vowels)
+    # ё is always stressed, so it can appear only in a stressed stem
+    if 0 <= stress < len(stem) and stem[stress] == 'е' and rng.random() < 0.3:
+        stem = stem[:stress] + 'ё' + stem[stress + 1:]
+    double_accent = stress >= 0 and len(stem_vowels) > 1 and rng.random() < 0.02
+
+    lines = []
+    for offset, (ending, gram) in enumerate(paradigm.endings):
+        form = stem + paradigm.suffix + spell_ending(stem + paradigm.suffix, ending)
+        if stress >= 0:
+            accented = accent(form, stress)
+        elif any(c in vowels for c in form[len(stem):]):
+            accented = accent(form, next(i for i in range(len(stem), len(form)) if form[i] in vowels))
+        else:
+            accented = accent(form, stem_vowels[-1])
+        if double_accent:
+            other = next(i for i in stem_vowels if i != stress)
+            accented = accent(accented, other if other < stress else other + 1)
+        marker = '*' if rng.random() < 0.005 else ''
+        lines.append(f'{marker}{form} | {paradigm.pos} {gram} | {accented} | {first_id + offset}')
+    return lines
+
+def spell_ending(stem: str, ending: str) -> str:
+    """ы is spelled as и after г, к, х and the hushing consonants."""
+    if ending.startswith('ы') and stem[-1:] in hushing:
+        return 'и' + ending[1:]
+    return ending
+
+def accent(word: str, vowel_index: int) -> str:
+    return f"{word[:vowel_index + 1]}'{word[vowel_index + 1:]}"
+
+def write_dictionary(file_name: str, lemmas: int, seed: int=0, huge_bucket_share: float=0.05) -> int:
+    """Writes the dictionary to the file in the encoding of the Hagen dictionary.
+    Returns the number of lines with words.
+    """
+    word_count = 0
+    with open(file_name, 'w', encoding=file_encoding) as file:
+        for index, lines in enumerate(generate_articles(lemmas, seed, huge_bucket_share)):
+            # articles are separated by empty lines
+            file.write(('\n' if index > 0 else '') + '\n'.join(lines) + '\n')
+            word_count += len(lines)
+    return word_count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file', help='file to write the dictionary to')
+    parser.add_argument('--lemmas', type=int, default=20_000,
+        help='number of dictionary articles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--huge-bucket-share', type=float, default=0.05,
+        help='share of the lemmas rhyming with each other, like the nouns in -ание')
+    args = parser.parse_args()
+
+    print(f'{write_dictionary(args.file, args.lemmas, args.seed, args.huge_bucket_share)} words written')
@@ -59,6 +59,16 @@ def test_is_correctly_accented(input: str, result: bool) -> None:
 def test_yoficate_by_transcription(spell: str, trans: str, yoficated: str) -> None:
     assert yoficate_by_transcription(spell, trans) == yoficated
 
+@pytest.mark.parametrize('strings, length', [
+    (['палка'], 5),
+    (['палка', 'палки', 'палкой'], 4),
+    (['шёл', 'шла', 'идти'], 0),
+    (['кот', 'кота', 'кот'], 3),
+])
+def test_common_prefix_len(strings: List[str], length: int) -> None:
+    assert common_prefix_len(strings) == length
+    assert common_prefix_len(strings, min(length, 2)) == length
+
 @pytest.mark.parametrize('accented',
     ["пе'рвый", "второ'й", "а'льфа", "ерунда'", "ао'рист", "рлье'х", "к", "селё'дка"]
 )
@@ -0,0 +1,22 @@
+from sqlalchemy import create_engine
+from ..data.data_model import create_schema
+
+def test_bucket_scan_is_clustered(tmp_path) -> None:
+    engine = create_engine(f'sqlite:///{tmp_path / "database.sqlite"}')
+    create_schema(engine)
+    with engine.connect() as connection:
+        connection.exec_driver_sql("INSERT INTO rhyme_keys VALUES (1, 'Ak1')")
+        connection.exec_driver_sql("INSERT INTO lemmas VALUES (1, 5)")
+        connection.exec_driver_sql("INSERT INTO grams VALUES (1, 'Nn')")
+        connection.exec_driver_sql("INSERT INTO forms VALUES (1, 1, 1, 'палка', 'pAlka', '|pA|lka|', 1, NULL)")
+        assert connection.exec_driver_sql('SELECT spell, rhyme, gram, orth, stem_len FROM words').fetchall() == [
+            ('палка', 'Ak1', 'Nn', 'палка', 5)]
+        plans = [connection.exec_driver_sql(f'EXPLAIN QUERY PLAN SELECT * FROM words '
+            f'WHERE rhyme = ? AND lemma_id != ? {gram_filter} ORDER BY lemma_id', ('Ak1', 3)).fetchall()
+            for gram_filter in ['', 'AND gram_mask & 1 != 0']]
+    for plan in plans:
+        details = [row[-1] for row in plan]
+        # a single range of the forms, read in the order of the lemmas, with or without the filter
+        assert any('forms USING PRIMARY KEY (rhyme_id=?)' in detail for detail in details)
+        assert not any('TEMP B-TREE' in detail for detail in details)
+    engine.dispose()
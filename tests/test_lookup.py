@@ -0,0 +1,130 @@
+import sys
+import pytest
+from sqlalchemy import create_engine
+from werkzeug.datastructures import MultiDict
+from ..phonetics.rhyme import encode_rhyme
+from ..data.data_model import create_schema, max_neighbour_distance
+from ..data.rhyme_index import RhymeIndex, IndexedWord
+from ..data.serving import create_serving_engine
+from ..lookup import (group_by_lemma, iter_lemmas, lookup_word, lookup_word_stream, lookup_words,
+                      load_mapped_index, LookupResultRhymes, RhymeFilter)
+from .test_rhyme_index import make_index
+
+def make_words_with_dists():
+    return [
+        (IndexedWord(1, 1, 'палка', 'pAlka', 'Ak1', encode_rhyme('pAlka'), 'Nn'), 0.3),
+        (IndexedWord(2, 1, 'палки', 'pAlKi', 'Ak1', encode_rhyme('pAlKi'), 'Nn'), 0.2),
+        (IndexedWord(3, 3, 'галка', 'gAlka', 'Ak1', encode_rhyme('gAlka'), 'Nn'), 0.2),
+        (IndexedWord(5, 5, 'балка', 'bAlka', 'Ak1', encode_rhyme('bAlka'), 'Nn'), 0.1),
+        (IndexedWord(7, 7, 'скалка', 'skAlka', 'Ak1', encode_rhyme('skAlka'), 'Nn'), 0.2),
+    ]
+
+def test_group_by_lemma() -> None:
+    rhymes, lemma_count = group_by_lemma(make_words_with_dists())
+    assert lemma_count == 4
+    assert [[form.orthogaphy for form in lemma] for lemma in rhymes] == [
+        ['балка'], ['галка'], ['палки', 'палка'], ['скалка']]
+    assert rhymes[2][1].ending == '-а'
+
+def test_group_by_lemma_pages() -> None:
+    all_rhymes, _ = group_by_lemma(make_words_with_dists())
+    for limit in range(1, 6):
+        pages = [group_by_lemma(make_words_with_dists(), limit, cursor)
+            for cursor in range(0, 4, limit)]
+        assert [lemma for page, _ in pages for lemma in page] == all_rhymes
+        assert all(lemma_count == 4 for _, lemma_count in pages)
+
+def test_iter_lemmas() -> None:
+    all_rhymes, _ = group_by_lemma(make_words_with_dists())
+    assert list(iter_lemmas(make_words_with_dists())) == all_rhymes
+
+def test_rhyme_filter_ending() -> None:
+    words = [word for word, _ in make_words_with_dists()]
+    assert [w.word_id for w in words if RhymeFilter('и').matches_ending(w)] == [2]
+    assert [w.word_id for w in words if RhymeFilter('[kK][ai]').matches_ending(w)] == [1, 2, 3, 5, 7]
+    assert all(RhymeFilter().matches_ending(w) for w in words)
+    assert [w.word_id for w in words if RhymeFilter('[^и]|.ки').matches_ending(w)] == [1, 2, 3, 5, 7]
+
+@pytest.mark.parametrize('ending', ['(.|.)*(.|.)*Z', 'a+', 'a{2}', '[a-z]', '\\w', 'к' * 33])
+def test_rhyme_filter_unsafe_ending(ending: str) -> None:
+    with pytest.raises(ValueError):
+        RhymeFilter(ending).ending_pattern
+
+def test_group_by_lemma_stored_orthography() -> None:
+    computed, _ = group_by_lemma(make_words_with_dists())
+    # as stored by `db_generation.py`: палка and палки share 'палк'
+    stored = [(word._replace(orth=word.spell, stem_len=4 if word.lemma_id == 1 else len(word.spell)), dist)
+        for word, dist in make_words_with_dists()]
+    assert group_by_lemma(stored)[0] == computed
+    
+    yo = [(IndexedWord(9, 9, 'все', 'fSO', 'O', encode_rhyme('fSO'), 'Pn'), 0.1)]
+    assert group_by_lemma(yo)[0][0][0].orthogaphy == 'всё'
+    assert group_by_lemma([(yo[0][0]._replace(orth='всё', stem_len=3), 0.1)])[0] == group_by_lemma(yo)[0]
+
+def test_lookup_word_stream_pages(monkeypatch) -> None:
+    monkeypatch.setattr(sys.modules[lookup_word.__module__], 'rhyme_index', make_index())
+    result = lookup_word('галка')
+    assert isinstance(result, LookupResultRhymes) and len(result.rhymes) == 2
+    for cursor in range(3):
+        header, *lemmas = lookup_word_stream('галка', 1, cursor)
+        assert isinstance(header, LookupResultRhymes)
+        assert header.prettified_input_word == result.prettified_input_word
+        assert lemmas == result.rhymes[cursor:cursor + 1]
+    assert list(lookup_word_stream('галка'))[1:] == result.rhymes
+
+def test_failed_load_keeps_the_index(tmp_path, monkeypatch) -> None:
+    module = sys.modules[lookup_word.__module__]
+    index = make_index()
+    monkeypatch.setattr(module, 'rhyme_index', index)
+    assert load_mapped_index(str(tmp_path / 'missing.index')) is None
+    assert module.rhyme_index is index
+    with pytest.raises(OSError):
+        load_mapped_index(str(tmp_path / 'missing.index'), fallback_to_sql=False)
+    assert module.rhyme_index is index
+
+# галки is in the neighbouring bucket of палка, but its lemma галка is in the same one
+neighbours = {'Ak1': [(1, 'AK1')], 'AK1': [(1, 'Ak1')]}
+
+def make_db(db_file: str, index: RhymeIndex) -> None:
+    engine = create_engine(f'sqlite:///{db_file}')
+    create_schema(engine)
+    words = [index.word(row) for row in range(len(index))]
+    rhyme_ids = {rhyme: rhyme_id for rhyme_id, rhyme in enumerate(sorted(set(w.rhyme for w in words)), start=1)}
+    with engine.begin() as connection:
+        connection.exec_driver_sql('INSERT INTO rhyme_keys VALUES (?, ?)', [(i, rhyme) for rhyme, i in rhyme_ids.items()])
+        connection.exec_driver_sql('INSERT OR IGNORE INTO lemmas VALUES (?, ?)', [(w.lemma_id, w.stem_len) for w in words])
+        connection.exec_driver_sql('INSERT OR IGNORE INTO grams VALUES (?, ?)', [(w.gram_mask, w.gram) for w in words])
+        connection.exec_driver_sql('INSERT INTO forms VALUES (?, ?, ?, ?, ?, ?, ?, NULL)',
+            [(rhyme_ids[w.rhyme], w.lemma_id, w.word_id, w.spell, w.trans, w.rhyme_parts, w.gram_mask) for w in words])
+        connection.exec_driver_sql('INSERT INTO rhyme_neighbours VALUES (?, ?, ?)',
+            [(rhyme, distance, neighbour) for rhyme, pairs in neighbours.items() for distance, neighbour in pairs])
+    engine.dispose()
+
+@pytest.mark.parametrize('source', ['index', 'index.scalar', 'db'])
+def test_near_rhymes(source: str, tmp_path, monkeypatch) -> None:
+    lookup = sys.modules[lookup_word.__module__]
+    index = make_index()
+    index.neighbours = neighbours
+    if source == 'db':
+        make_db(str(tmp_path / 'database.sqlite'), index)
+        monkeypatch.setattr(lookup, 'serving_engine', create_serving_engine(str(tmp_path / 'database.sqlite')))
+        monkeypatch.setattr(lookup, 'has_table', lambda name: name == 'rhyme_neighbours')
+    else:
+        monkeypatch.setattr(lookup, 'rhyme_index', index)
+        monkeypatch.setattr(lookup, 'use_vectorized_distances', source == 'index' and lookup.use_vectorized_distances)
+    
+    def lemmas(result) -> list:
+        return sorted(sorted(form.orthogaphy for form in lemma) for lemma in result.rhymes)
+    assert lemmas(lookup_word('палка')) == [['галка'], ['скалка']]
+    # the forms of галка from both buckets are merged into a single lemma
+    near = RhymeFilter(near=1)
+    result = lookup_word('палка', None, 0, near)
+    assert lemmas(result) == [['галка', 'галки'], ['скалка']]
+    assert [r.to_dict() for r in lookup_words(['палка', 'скалка'], None, near)][0] == result.to_dict()
+
+def test_filter_args_near() -> None:
+    from .. import filter_args
+    assert filter_args(MultiDict({'near': str(max_neighbour_distance)})).near == max_neighbour_distance
+    for near in ['-1', str(max_neighbour_distance + 1)]:
+        with pytest.raises(ValueError):
+            filter_args(MultiDict({'near': near}))
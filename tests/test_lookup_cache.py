@@ -0,0 +1,104 @@
+from typing import Any, List
+import sys
+import threading
+import time
+import pytest
+from .test_rhyme_index import make_index
+from ..lookup import LookupResult, LookupResultVariants, lookup_word
+from ..data.mapped_index import MappedRhymeIndex, write_mapped_index
+from ..lookup_cache import LookupCache, RandomResultPool
+
+def make_lookup(calls: List[str], delay: float=0.0):
+    def lookup(query: str) -> LookupResult:
+        calls.append(query)
+        time.sleep(delay)
+        if query == 'ошибка':
+            raise ValueError(query)
+        return LookupResultVariants(query, [])
+    return lookup
+
+def test_hits_and_eviction() -> None:
+    calls: List[str] = []
+    cache = LookupCache(make_lookup(calls), max_size=2)
+    assert cache('мука').prettified_input_word == 'мука'
+    cache(' Мука ')
+    cache('му́ка')
+    cache("му'ка")
+    cache('кот')  # evicts the least recently used 'мука'
+    cache("му'ка")
+    cache('мука')
+    assert calls == ['мука', "му'ка", 'кот', 'мука']
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.size) == (3, 4, 2)
+
+def test_concurrent_lookups_are_coalesced() -> None:
+    calls: List[str] = []
+    cache = LookupCache(make_lookup(calls, delay=0.1))
+    threads = [threading.Thread(target=cache, args=('кот',)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ['кот']
+    assert cache.stats.misses + cache.stats.coalesced + cache.stats.hits == 5
+
+def test_errors_are_not_cached() -> None:
+    calls: List[str] = []
+    cache = LookupCache(make_lookup(calls))
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache('ошибка')
+    assert calls == ['ошибка', 'ошибка']
+
+def test_random_result_pool() -> None:
+    calls: List[str] = []
+    lookup = make_lookup(calls)
+    pool = RandomResultPool(lambda: lookup('кот'), size=2)
+    deadline = time.monotonic() + 5
+    while pool.results.qsize() < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool().prettified_input_word == 'кот'
+    assert pool.results.qsize() <= 2
+
+def test_rebuilt_db_reloads_the_index(tmp_path: Any, monkeypatch: Any) -> None:
+    module = sys.modules[LookupCache.__module__]  # the package attribute is the app's cache
+    db = tmp_path / 'rhymes.db'
+    db.write_text('1')
+    stamps = ['build 1']
+    reloads: List[str] = []
+    monkeypatch.setattr(module, 'db_file', str(db))
+    monkeypatch.setattr(module, 'dispose_engines', lambda: None)
+    monkeypatch.setattr(module, 'read_build_stamp', lambda: stamps[-1])
+    monkeypatch.setattr(module, 'reload_rhyme_index', lambda: reloads.append(stamps[-1]))
+    calls: List[str] = []
+    cache = LookupCache(make_lookup(calls))
+    cache('кот')
+    cache('кот')
+    assert (calls, reloads) == (['кот'], [])
+
+    db.write_text('22')
+    stamps.append('build 2')
+    cache('кот')
+    assert (calls, reloads) == (['кот', 'кот'], ['build 2'])
+    assert cache.stats.invalidations == 1
+
+def test_rewritten_mapped_index(tmp_path: Any, monkeypatch: Any) -> None:
+    module = sys.modules[LookupCache.__module__]
+    lookup_module = sys.modules[lookup_word.__module__]
+    index = make_index()
+    file_name = str(tmp_path / 'database.index')
+    write_mapped_index(index, file_name, 'build 1')
+    monkeypatch.setattr(lookup_module, 'rhyme_index', MappedRhymeIndex(file_name))
+    # the node has only the index file
+    monkeypatch.setattr(module, 'db_file', str(tmp_path / 'missing.db'))
+    monkeypatch.setattr(module, 'dispose_engines', lambda: None)
+    calls: List[str] = []
+    cache = LookupCache(make_lookup(calls))
+    cache('кот')
+    write_mapped_index(index, file_name, 'build 1')
+    cache('кот')
+    assert calls == ['кот'] and cache.stats.invalidations == 0
+
+    write_mapped_index(index, file_name, 'build 2')
+    cache('кот')
+    assert calls == ['кот', 'кот'] and cache.stats.invalidations == 1
+    assert lookup_module.rhyme_index.build_stamp == 'build 2'
@@ -0,0 +1,58 @@
+import asyncio
+import sys
+import time
+import threading
+import pytest
+from ..lookup_executor import LookupExecutor, LookupOverloaded
+
+def test_backpressure() -> None:
+    executor = LookupExecutor(max_workers=1, max_pending=2)
+    release = threading.Event()
+    futures = [executor.submit(release.wait) for _ in range(2)]
+    with pytest.raises(LookupOverloaded):
+        executor.submit(release.wait)
+    assert executor.stats()['rejected'] == 1
+    release.set()
+    for future in futures:
+        future.result()
+    assert executor(len, 'abc') == 3
+    assert executor.stats()['pending'] == 0
+
+def test_run() -> None:
+    executor = LookupExecutor(max_workers=2, max_pending=4)
+    async def main():
+        return await asyncio.gather(*[executor.run(pow, 2, n) for n in range(4)])
+    assert asyncio.run(main()) == [1, 2, 4, 8]
+
+def test_acquire_outside_the_pool() -> None:
+    executor = LookupExecutor(max_workers=1, max_pending=1)
+    executor.acquire()
+    with pytest.raises(LookupOverloaded):
+        executor.submit(len, 'abc')
+    assert executor.stats()['pending'] == 1
+    executor.release(None)
+    assert executor(len, 'abc') == 3
+
+def test_stream_in_the_pool(monkeypatch) -> None:
+    from .. import ExecutorStream
+    package = sys.modules[ExecutorStream.__module__]
+    executor = LookupExecutor(max_workers=1, max_pending=1)
+    monkeypatch.setattr(package, 'lookup_executor', executor)
+    monkeypatch.setattr(package, 'stream_buffer', 2)
+    produced = []
+    def pieces():
+        for n in range(10):
+            produced.append(n)
+            yield []
+    stream = ExecutorStream(pieces)
+    with pytest.raises(LookupOverloaded):
+        ExecutorStream(pieces)
+    lines = iter(stream)
+    assert next(lines) == '{"lemma": []}\n'
+    time.sleep(0.1)
+    # the producer waits for the client
+    assert len(produced) <= 4
+    stream.close()
+    assert stream.produced is not None
+    stream.produced.result()
+    assert len(produced) <= 5
@@ -0,0 +1,53 @@
+from ..lookup_executor import LookupExecutor
+from ..lookup_metrics import LookupMetrics, StageTimings, current_timings, timed_stage, record_bucket_size
+
+def test_timed_stage() -> None:
+    with timed_stage('find'):
+        pass  # nothing is recorded outside of a request
+    timings = StageTimings()
+    token = current_timings.set(timings)
+    try:
+        for _ in range(2):
+            with timed_stage('score'):
+                pass
+        record_bucket_size(10)
+        record_bucket_size(5)
+    finally:
+        current_timings.reset(token)
+    timings.finish()
+    assert list(timings.seconds) == ['score', 'total']
+    assert timings.bucket_size == 15
+    assert timings.server_timing().startswith('score;dur=')
+    assert timings.server_timing().endswith(', bucket;desc="15 words"')
+
+def test_executor_records_stages() -> None:
+    executor = LookupExecutor(max_workers=1, max_pending=1)
+    def lookup() -> None:
+        with timed_stage('group'):
+            pass
+    timings = StageTimings()
+    token = current_timings.set(timings)
+    try:
+        executor(lookup)
+    finally:
+        current_timings.reset(token)
+    assert 'group' in timings.seconds
+
+def test_prometheus() -> None:
+    metrics = LookupMetrics(window=10, slowest=2)
+    for n in range(1, 21):
+        timings = StageTimings()
+        timings.seconds = {'score': n / 1000, 'total': n / 100}
+        timings.bucket_size = n * 10
+        metrics.record('/lookup', timings)
+    text = metrics.to_prometheus()
+    # the quantiles are taken over the latest 10 requests, the sums over all of them
+    assert 'rifmuj_stage_seconds{stage="score",quantile="0.5"} 0.016000' in text
+    assert 'rifmuj_stage_seconds{stage="score",quantile="0.99"} 0.020000' in text
+    assert 'rifmuj_stage_seconds_sum{stage="score"} 0.210000' in text
+    assert 'rifmuj_stage_seconds_count{stage="total"} 20' in text
+    assert 'rifmuj_bucket_size_bucket{le="100"} 10' in text
+    assert 'rifmuj_bucket_size_bucket{le="+Inf"} 20' in text
+    assert 'rifmuj_slowest_request_seconds{rank="1",path="/lookup",stage="score"} 0.200000' in text
+    assert 'rifmuj_slowest_request_seconds{rank="2",path="/lookup",stage="score"} 0.190000' in text
+    assert 'rank="3"' not in text
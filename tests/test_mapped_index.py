@@ -0,0 +1,44 @@
+import sys
+import pytest
+from ..data.mapped_index import MappedRhymeIndex, write_mapped_index, header
+from ..morphology.features import features_to_mask
+from .test_rhyme_index import make_index
+
+def test_same_as_rhyme_index(tmp_path) -> None:
+    index = make_index()
+    index.collect_random_rows()
+    index.neighbours = {'Ak1': [(1, 'AK1'), (6, 'A')]}
+    file_name = str(tmp_path / 'database.index')
+    write_mapped_index(index, file_name, 'stamp')
+    mapped = MappedRhymeIndex(file_name)
+    
+    assert len(mapped) == len(index)
+    assert mapped.build_stamp == 'stamp'
+    assert [mapped.word(row) for row in range(len(mapped))] == [index.word(row) for row in range(len(index))]
+    for spell in ['скалка', 'галка', 'балка']:
+        assert mapped.words_by_spell(spell) == index.words_by_spell(spell)
+    for rhyme in ['A', 'AK1', 'Ak1', 'Ok1', '']:
+        assert mapped.bucket_range(rhyme) == index.bucket_range(rhyme)
+        assert mapped.neighbour_rhymes(rhyme, 6) == index.neighbour_rhymes(rhyme, 6)
+        for gram_mask in [0, features_to_mask(['Vb'])]:
+            assert list(mapped.rhyming_words(rhyme, 3, gram_mask)) == list(index.rhyming_words(rhyme, 3, gram_mask))
+    assert mapped.neighbour_rhymes('Ak1', 3) == ['AK1']
+    assert {mapped.random_word().rhyme for _ in range(20)} == {'Ak1'}
+
+def test_other_files(tmp_path) -> None:
+    file_name = tmp_path / 'database.index'
+    file_name.write_bytes(b'SQLite format 3\0' + bytes(100))
+    with pytest.raises(ValueError):
+        MappedRhymeIndex(str(file_name))
+    with pytest.raises(OSError):
+        MappedRhymeIndex(str(tmp_path / 'missing.index'))
+
+def test_other_byte_order(tmp_path) -> None:
+    file_name = tmp_path / 'database.index'
+    write_mapped_index(make_index(), str(file_name))
+    data = bytearray(file_name.read_bytes())
+    other = 'big' if sys.byteorder == 'little' else 'little'
+    header.pack_into(data, 0, *header.unpack_from(data)[:3], other.encode())
+    file_name.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match=f'{other}-endian'):
+        MappedRhymeIndex(str(file_name))
@@ -1,5 +1,12 @@
+from typing import Iterable
+import os
+import random
 import pytest
-from ..phonetics.phonetizer import phonetize
+from ..phonetics import phonetizer
+from ..phonetics.phonetizer import phonetize, phonetize_cached, phonetize_many, compile_rule_tables, rule_tables
+from ..phonetics.rule_cache import load_rule_tables
+from ..phonetics.accent import normalize_accented_spell
+from ..phonetics.repertoire import vowel_ltrs, consonant_ltrs, sign_ltrs, accents, separators
 
 @pytest.mark.parametrize('accented_spell, transcription', [
     # jot vowels and signs
@@ -62,3 +69,79 @@ from ..phonetics.phonetizer import phonetize
 ])
 def test_phonetize(accented_spell: str, transcription: str) -> None:
     assert phonetize(accented_spell) == transcription
+
+
+dictionary_file = os.path.join(os.path.dirname(__file__), '..', 'data', 'hagen-morph.txt')
+
+def generate_words(count: int, seed: int=0) -> Iterable[str]:
+    """Yields random letter sequences with accent marks and separators
+    to exercise every rule of the phonetizer.
+    """
+    rng = random.Random(seed)
+    letters = vowel_ltrs + consonant_ltrs + sign_ltrs
+    for _ in range(count):
+        chars = [rng.choice(letters) for _ in range(rng.randint(1, 12))]
+        for _ in range(rng.randint(0, 2)):
+            chars.insert(rng.randrange(len(chars) + 1), rng.choice(accents + separators))
+        yield ''.join(chars)
+
+def test_compiled_engine_on_generated_words() -> None:
+    for word in generate_words(20_000):
+        assert phonetize(word) == phonetize(word, compiled=False), word
+
+@pytest.mark.skipif(not os.path.exists(dictionary_file), reason='the dictionary file is not downloaded')
+def test_compiled_engine_on_dictionary() -> None:
+    with open(dictionary_file, encoding='windows-1251') as file:
+        for line in file:
+            parts = line.split('|')
+            if len(parts) < 3:
+                continue
+            accented_spell = normalize_accented_spell(parts[2].strip())
+            assert phonetize(accented_spell) == phonetize(accented_spell, compiled=False), accented_spell
+
+def test_phonetize_many() -> None:
+    words = ["колесо'", "до'ля", "колесо'", "его'"]
+    phonetizer.phonetize_cache.cache_clear()
+    assert phonetize_many(words) == ['kaLisO', 'dOLa', 'kaLisO', 'YivO']
+    assert phonetizer.phonetize_cache.cache_info().misses == 3
+    assert phonetize_many(words[:2]) == ['kaLisO', 'dOLa']
+    assert phonetizer.phonetize_cache.cache_info().hits == 2
+    assert phonetize_many(words, use_cache=False) == phonetize_many(words)
+
+def test_configure_phonetize_cache() -> None:
+    size = phonetizer.phonetize_cache_size
+    try:
+        phonetizer.configure_phonetize_cache(2)
+        assert phonetizer.phonetize_cache.cache_info().maxsize == 2
+        assert phonetize_many(["колесо'", "до'ля", "его'"]) == ['kaLisO', 'dOLa', 'YivO']
+        assert phonetizer.phonetize_cache.cache_info().currsize == 2
+        assert phonetize_cached("до'ля") == 'dOLa'
+    finally:
+        phonetizer.configure_phonetize_cache(size)
+    assert phonetizer.phonetize_cache.cache_info().maxsize == size
+
+def test_rule_cache(tmp_path) -> None:
+    assert rule_tables == compile_rule_tables()
+
+    source = tmp_path / 'rules.py'
+    source.write_text('rules = 1')
+    cache = str(tmp_path / 'cache' / 'rules.marshal')
+    builds = []
+    def build() -> dict:
+        builds.append(source.read_text())
+        return {'rules': {'a': 'b'}}
+
+    assert load_rule_tables(build, [str(source)], cache) == {'rules': {'a': 'b'}}
+    assert load_rule_tables(build, [str(source)], cache) == {'rules': {'a': 'b'}}
+    assert len(builds) == 1
+    source.write_text('rules = 2')
+    load_rule_tables(build, [str(source)], cache)
+    assert len(builds) == 2
+    # a damaged file is rebuilt too
+    with open(cache, 'wb') as file:
+        file.write(b'\x00garbage')
+    load_rule_tables(build, [str(source)], cache)
+    assert len(builds) == 3
+    # without the sources, nothing is cached
+    load_rule_tables(build, [str(tmp_path / 'missing.py')], cache)
+    assert len(builds) == 4
@@ -1,7 +1,12 @@
+from typing import Callable, Dict, Iterable, List, TypeVar
+import random
 import pytest
 from ..phonetics.accent import normalize_accented_spell, is_correctly_accented
+from ..phonetics import rhyme as rhyme_module
 from ..phonetics.phonetizer import phonetize
-from ..phonetics.rhyme import get_basic_rhyme, normalized_rhyme_distance
+from ..phonetics.repertoire import consonant_ltrs, vowel_ltrs, pack_phonemes, unpack_phonemes, phonemes
+from ..phonetics.rhyme import (get_basic_rhyme, get_basic_rhyme_many, basic_rhyme_distance, normalized_rhyme_distance,
+    Rhyme, encode_rhyme, parsed_rhyme_distance, parsed_rhyme_distance_by_objects)
 
 @pytest.mark.parametrize('word, basic_rhyme', [
     ('а́',       'A'),
@@ -14,6 +19,44 @@ def test_basic_rhyme(word: str, basic_rhyme: str) -> None:
     trans = get_transcription(word)
     assert get_basic_rhyme(trans) == basic_rhyme
 
+def test_basic_rhyme_many() -> None:
+    transcriptions = [get_transcription(w) for w in ['голова́', 'голо́в', 'голова́']]
+    assert get_basic_rhyme_many(transcriptions) == ['fA', 'Of', 'fA']
+    assert get_basic_rhyme_many(transcriptions, use_cache=False) == ['fA', 'Of', 'fA']
+
+def test_configure_basic_rhyme_cache() -> None:
+    size = rhyme_module.basic_rhyme_cache_size
+    try:
+        rhyme_module.configure_basic_rhyme_cache(1)
+        assert rhyme_module.basic_rhyme_cache.cache_info().maxsize == 1
+        transcriptions = [get_transcription(w) for w in ['голова́', 'голо́в']]
+        assert get_basic_rhyme_many(transcriptions) == ['fA', 'Of']
+        assert rhyme_module.basic_rhyme_cache.cache_info().currsize == 1
+    finally:
+        rhyme_module.configure_basic_rhyme_cache(size)
+    assert rhyme_module.basic_rhyme_cache.cache_info().maxsize == size
+
+@pytest.mark.parametrize('rhyme1, rhyme2, distance', [
+    ('Ok1', 'Ok1', 0),
+    ('O_k1', 'Ok1', 1),
+    ('Ol', 'OL', 1),
+    ('Ol', 'Or', 2),
+    ('Ok1', 'Ak1', 4),
+    ('A', 'Ak1', 6),
+])
+def test_basic_rhyme_distance(rhyme1: str, rhyme2: str, distance: int) -> None:
+    assert basic_rhyme_distance(rhyme1, rhyme2) == distance
+    assert basic_rhyme_distance(rhyme2, rhyme1) == distance
+
+def test_basic_rhyme_distance_is_metric() -> None:
+    rng = random.Random(1)
+    words = [''.join(rng.choice(consonant_ltrs) + rng.choice(vowel_ltrs) for _ in range(rng.randint(1, 4)))
+        + rng.choice(['', 'к', 'ст', 'рдс']) for _ in range(300)]
+    rhymes = sorted(set(get_basic_rhyme(phonetize(add_random_accent(word, rng))) for word in words))
+    for _ in range(3000):
+        a, b, c = rng.sample(rhymes, 3)
+        assert basic_rhyme_distance(a, c) <= basic_rhyme_distance(a, b) + basic_rhyme_distance(b, c)
+
 
 @pytest.mark.parametrize('word, better_rhyme, worse_rhyme', [
     ('па́лка', 'га́лка', 'селёдка'),
@@ -37,8 +80,82 @@ def test_better_rhyme(word: str, better_rhyme: str, worse_rhyme: str) -> None:
         worse_distance  = normalized_rhyme_distance(word_trans, worse_trans)
         assert better_distance < worse_distance
 
+@pytest.mark.parametrize('word', ['а́', 'голова́', 'голо́вка', 'пое́здка', 'бегемо`топодо́бный'])
+def test_encoded_rhyme(word: str) -> None:
+    trans = get_transcription(word)
+    encoded = encode_rhyme(trans)
+    decoded = Rhyme.decode(encoded)
+    assert decoded is not None
+    assert decoded.encode() == encoded
+    assert ''.join(str(s) for s in decoded.pretonic_syllables) + \
+        str(decoded.stressed_syllable) + \
+        ''.join(str(s) for s in decoded.posttonic_syllables) + \
+        unpack_phonemes(decoded.final_consonants) == trans
+    assert str(decoded) == trans
+
+def test_packed_phonemes() -> None:
+    assert len(pack_phonemes(phonemes)) == len(phonemes)
+    assert 0 not in pack_phonemes(phonemes)
+    assert unpack_phonemes(pack_phonemes(phonemes)) == phonemes
+    assert unpack_phonemes(pack_phonemes('')) == ''
+
+@pytest.mark.parametrize('word, other', [
+    ('па́лка', 'га́лка'),
+    ('па́лка', 'селёдка'),
+    ('ко́т', 'террако́т'),
+    ('плацда́рм', 'жа́рм'),
+])
+def test_parsed_rhyme_distance(word: str, other: str) -> None:
+    trans1, trans2 = get_transcription(word), get_transcription(other)
+    parsed = parsed_rhyme_distance(Rhyme.decode(encode_rhyme(trans1)), Rhyme.decode(encode_rhyme(trans2)))
+    assert parsed == normalized_rhyme_distance(trans1, trans2)
+
 
 def get_transcription(word: str) -> str:
     accented_spell = normalize_accented_spell(word)
     assert is_correctly_accented(accented_spell)
     return phonetize(accented_spell)
+
+
+def test_vectorized_distances() -> None:
+    np = pytest.importorskip('numpy')
+    from ..phonetics.vectorized import BucketRhymes
+    
+    rng = random.Random(0)
+    words = [''.join(rng.choice(consonant_ltrs) + rng.choice(vowel_ltrs) for _ in range(rng.randint(1, 4)))
+        + rng.choice(['', 'к', 'ст', 'рдс']) for _ in range(3000)]
+    transcriptions = [phonetize(add_random_accent(word, rng)) for word in words]
+    buckets = group_by(transcriptions, get_basic_rhyme)
+    
+    for basic_rhyme, bucket in buckets.items():
+        bucket_rhymes = BucketRhymes([Rhyme.from_transcription(t) for t in bucket])
+        for trans in bucket[:5]:
+            expected = [normalized_rhyme_distance(trans, other) for other in bucket]
+            actual = bucket_rhymes.distances_from(Rhyme.from_transcription(trans))
+            assert np.allclose(actual, expected), basic_rhyme
+
+def test_tabulated_distances() -> None:
+    rng = random.Random(1)
+    words = [''.join(rng.choice(consonant_ltrs) * rng.randint(1, 3) + rng.choice(vowel_ltrs) for _ in range(rng.randint(1, 4)))
+        + rng.choice(['', 'к', 'ст', 'рдс', 'вств']) for _ in range(3000)]
+    transcriptions = [phonetize(add_random_accent(word, rng)) for word in words]
+    buckets = group_by(transcriptions, get_basic_rhyme)
+    
+    for bucket in buckets.values():
+        rhymes = [Rhyme.from_transcription(t) for t in bucket]
+        for rhyme in rhymes[:5]:
+            for other in rhymes:
+                # the same floats are summed in the same order
+                assert parsed_rhyme_distance(rhyme, other) == parsed_rhyme_distance_by_objects(rhyme, other)
+
+def add_random_accent(word: str, rng: random.Random) -> str:
+    vowel_positions = [i for i, letter in enumerate(word) if letter in vowel_ltrs]
+    position = rng.choice(vowel_positions) + 1
+    return word[:position] + "'" + word[position:]
+
+T = TypeVar('T')
+def group_by(items: Iterable[T], key: Callable[[T], str]) -> Dict[str, List[T]]:
+    groups: Dict[str, List[T]] = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return groups
@@ -0,0 +1,48 @@
+from ..phonetics.rhyme import encode_rhyme
+from ..data.rhyme_index import RhymeIndex, IndexedWord
+from ..morphology.features import features_to_mask
+
+def make_index() -> RhymeIndex:
+    words = [
+        IndexedWord(4, 3, 'галка', 'gAlka', 'Ak1', encode_rhyme('gAlka'), 'Nn', features_to_mask(['Nn']), 'галка', 4),
+        IndexedWord(3, 3, 'галки', 'gAlKi', 'AK1', encode_rhyme('gAlKi'), 'Nn', features_to_mask(['Nn']), 'галки', 4),
+        IndexedWord(1, 1, 'палка', 'pAlka', 'Ak1', encode_rhyme('pAlka'), 'NnVb', features_to_mask(['Nn', 'Vb']), 'палка', 5),
+        IndexedWord(-7, 7, 'скалка', 'skAlka', 'Ak1', encode_rhyme('skAlka'), 'Nn', features_to_mask(['Nn']), 'скалка', 6),
+        IndexedWord(7, 7, 'скалка', 'skalkA', 'A', encode_rhyme('skalkA'), 'Nn', features_to_mask(['Nn']), 'скалка', 6),
+    ]
+    index = RhymeIndex()
+    for word in sorted(words, key=lambda w: (w.rhyme, w.lemma_id, w.word_id)):
+        index.append(word)
+    index.sort_spell_rows()
+    return index
+
+def test_buckets() -> None:
+    index = make_index()
+    assert len(index) == 5
+    assert [w.spell for w in index.rhyming_words('Ak1', 3)] == ['палка', 'скалка']
+    assert [w.word_id for w in index.rhyming_words('Ak1', 1)] == [4, -7]
+    assert list(index.rhyming_words('Ok1', 1)) == []
+
+def test_words_by_spell() -> None:
+    index = make_index()
+    assert [w.trans for w in index.words_by_spell('скалка')] == ['skAlka', 'skalkA']
+    assert index.words_by_spell('балка') == []
+
+def test_random_word() -> None:
+    index = make_index()
+    index.collect_random_rows()
+    # the other buckets have a single lemma each
+    assert {index.random_word().rhyme for _ in range(20)} == {'Ak1'}
+
+def test_neighbour_rhymes() -> None:
+    index = make_index()
+    index.neighbours = {'Ak1': [(1, 'AK1'), (6, 'A')]}
+    assert index.neighbour_rhymes('Ak1', 3) == ['AK1']
+    assert index.neighbour_rhymes('Ak1', 6) == ['AK1', 'A']
+    assert index.neighbour_rhymes('A', 6) == []
+
+def test_gram_mask() -> None:
+    index = make_index()
+    assert [w.spell for w in index.rhyming_words('Ak1', 3, features_to_mask(['Vb']))] == ['палка']
+    assert [w.spell for w in index.rhyming_words('Ak1', 3, features_to_mask(['Vb', 'Nn']))] == ['палка', 'скалка']
+    assert list(index.rhyming_words('Ak1', 3, features_to_mask(['Ad']))) == []
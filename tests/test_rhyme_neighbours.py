@@ -0,0 +1,30 @@
+import random
+from ..phonetics.accent import normalize_accented_spell
+from ..phonetics.phonetizer import phonetize
+from ..phonetics.rhyme import get_basic_rhyme, basic_rhyme_distance
+from ..phonetics.rhyme_neighbours import BKTree, find_rhyme_neighbours
+
+words = ['па́лка', 'па́лки', 'ба́лку', 'ко́т', 'кто́', 'кро́т', 'мо́ст', 'хво́ст', 'до́м', 'то́м', 'ды́м',
+    'замо́к', 'дымо́к', 'стано́к', 'ру́ка', 'мука́', 'ре́чка', 'пе́чь', 'но́чь', 'до́чка', 'то́чки',
+    'сло́во', 'сло́ва', 'голова́', 'трава́', 'ле́то', 'поэ́т', 'сове́т', 'ве́тер', 'ве́чер', 'и', 'в']
+
+def test_bk_tree_search() -> None:
+    rng = random.Random(1)
+    items = [rng.randrange(1000) for _ in range(300)]
+    tree = BKTree(lambda a, b: abs(a - b), items)
+    for query in rng.sample(range(1000), 50):
+        for max_distance in [0, 1, 5, 30]:
+            expected = {(abs(query - item), item) for item in items if abs(query - item) <= max_distance}
+            assert sorted(tree.search(query, max_distance)) == sorted(expected)
+
+def test_find_rhyme_neighbours() -> None:
+    rhymes = [get_basic_rhyme(phonetize(normalize_accented_spell(word))) for word in words]
+    distinct = sorted(set(rhyme for rhyme in rhymes if rhyme))
+    for max_distance in range(4):
+        expected = sorted((rhyme, neighbour, basic_rhyme_distance(rhyme, neighbour))
+            for rhyme in distinct for neighbour in distinct
+            if rhyme != neighbour and basic_rhyme_distance(rhyme, neighbour) <= max_distance)
+        found = list(find_rhyme_neighbours(rhymes, max_distance))
+        assert sorted(found) == expected
+        assert len(set(found)) == len(found)
+    assert any(distance == 1 for _, _, distance in find_rhyme_neighbours(rhymes, 1))
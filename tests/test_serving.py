@@ -0,0 +1,48 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from ..data.serving import create_serving_engine, warm_up
+
+def test_read_only_connections(tmp_path) -> None:
+    db_file = str(tmp_path / 'database.sqlite')
+    with sqlite3.connect(db_file) as writer:
+        writer.execute('CREATE TABLE words (word_id INTEGER PRIMARY KEY, spell TEXT)')
+        writer.execute('CREATE INDEX ix_words_spell ON words (spell)')
+        writer.execute("INSERT INTO words VALUES (1, 'кот')")
+    
+    engine = create_serving_engine(db_file)
+    assert warm_up(engine) >= 0.0
+    connection = engine.raw_connection()
+    try:
+        assert connection.execute('SELECT spell FROM words').fetchall() == [('кот',)]
+        assert connection.execute('PRAGMA query_only').fetchone() == (1,)
+        with pytest.raises(sqlite3.OperationalError):
+            connection.execute("INSERT INTO words VALUES (2, 'мука')")
+    finally:
+        connection.close()
+    engine.dispose()
+
+def test_more_threads_than_pooled_connections(tmp_path) -> None:
+    db_file = str(tmp_path / 'database.sqlite')
+    with sqlite3.connect(db_file) as connection:
+        connection.execute('CREATE TABLE words (word_id INTEGER PRIMARY KEY, spell TEXT)')
+        connection.executemany('INSERT INTO words VALUES (?, ?)', [(i, f'слово{i}') for i in range(100)])
+    
+    engine = create_serving_engine(db_file, pool_size=2)
+    # every thread holds its connection until all of them have read a row
+    barrier = threading.Barrier(8)
+    def read(word_id: int) -> str:
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT spell FROM words WHERE word_id = ?', (word_id,))
+            barrier.wait(timeout=5)
+            row = cursor.fetchone()
+            assert row is not None
+            return row[0]
+        finally:
+            connection.close()
+    with ThreadPoolExecutor(8) as threads:
+        assert list(threads.map(read, range(8))) == [f'слово{i}' for i in range(8)]
+    engine.dispose()
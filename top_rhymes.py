@@ -0,0 +1,87 @@
+"""Precomputes the best rhyming lemmas for every word of the db,
+ordered the same way the lookup orders them (see `lookup.group_by_lemma`).
+"""
+
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import heapq
+import sqlite3
+
+from data.data_model import db_file
+from phonetics.rhyme import Rhyme, parsed_rhyme_distance
+from phonetics.vectorized import numpy_available, BucketRhymes
+
+if numpy_available:
+    import numpy as np
+
+class BucketWord(NamedTuple):
+    word_id: int
+    lemma_id: int
+    orth: str  # see `data_model.Form.orth`
+    rhyme_parts: str
+
+# (word id, [(lemma id, distance), ...])
+WordTopRhymes = Tuple[int, List[Tuple[int, float]]]
+
+def get_bucket(connection: Any, rhyme: str) -> List[BucketWord]:
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT word_id, lemma_id, orth, rhyme_parts FROM words
+        WHERE rhyme = ? ORDER BY lemma_id, word_id''', (rhyme,))
+    return [BucketWord(*row) for row in cursor]
+
+def rank_bucket(words: List[BucketWord], k: int) -> Iterable[WordTopRhymes]:
+    """For every word of the bucket yields its id and its `k` best rhyming lemmas
+    with the distances to their closest forms.
+    The lemmas are ordered by (distance, len(orthography), orthography)
+    of their closest forms, just like in the lookup results.
+    """
+    rhymes = [Rhyme.decode(w.rhyme_parts) for w in words]
+    orthographies = [w.orth for w in words]
+    if numpy_available:
+        yield from rank_bucket_vectorized(words, rhymes, orthographies, k)
+    else:
+        yield from rank_bucket_scalar(words, rhymes, orthographies, k)
+
+def rank_bucket_scalar(words: List[BucketWord], rhymes: List[Optional[Rhyme]],
+                       orthographies: List[str], k: int) -> Iterable[WordTopRhymes]:
+    for word, rhyme in zip(words, rhymes):
+        best_forms: Dict[int, Tuple[float, int, str]] = {}
+        for other, other_rhyme, orth in zip(words, rhymes, orthographies):
+            if other.lemma_id == word.lemma_id:
+                continue
+            key = (parsed_rhyme_distance(rhyme, other_rhyme), len(orth), orth)
+            if other.lemma_id not in best_forms or key < best_forms[other.lemma_id]:
+                best_forms[other.lemma_id] = key
+        # `nsmallest` is stable, so lemmas with equal keys stay in the lemma_id order
+        top = heapq.nsmallest(k, best_forms.items(), key=lambda lemma_key: lemma_key[1])
+        yield word.word_id, [(lemma_id, key[0]) for lemma_id, key in top]
+
+def rank_bucket_vectorized(words: List[BucketWord], rhymes: List[Optional[Rhyme]],
+                           orthographies: List[str], k: int) -> Iterable[WordTopRhymes]:
+    bucket_rhymes = BucketRhymes(rhymes)
+    lemma_ids = np.array([w.lemma_id for w in words])
+    # the rank of (len(orthography), orthography) among the forms of the bucket
+    orth_keys = sorted(set((len(orth), orth) for orth in orthographies))
+    orth_key_ranks = {key: rank for rank, key in enumerate(orth_keys)}
+    orth_ranks = np.array([orth_key_ranks[len(orth), orth] for orth in orthographies])
+
+    for word, rhyme in zip(words, rhymes):
+        candidates = np.nonzero(lemma_ids != word.lemma_id)[0]
+        dists = bucket_rhymes.distances_from(rhyme)[candidates]
+        # `lexsort` is stable, and sorts by the last key first
+        order = np.lexsort((orth_ranks[candidates], dists))
+        ordered_lemma_ids = lemma_ids[candidates][order]
+        # the first occurrence of each lemma is its closest form
+        _, first_forms = np.unique(ordered_lemma_ids, return_index=True)
+        top = np.sort(first_forms)[:k]
+        yield word.word_id, list(zip(ordered_lemma_ids[top].tolist(), dists[order][top].tolist()))
+
+
+connection = None
+
+def rank_bucket_in_worker(rhyme: str, k: int, file_name: str=db_file) -> Tuple[str, List[WordTopRhymes]]:
+    """Ranks a bucket reading it through the connection of the current process to the db file."""
+    global connection
+    if connection is None:
+        connection = sqlite3.connect(file_name)
+    return rhyme, list(rank_bucket(get_bucket(connection, rhyme), k))